@@ -44,53 +44,77 @@ import numpy as np
 import gpi
 
 
-def read(fname, datatype, numelem, skipbytes):
+# in the order of the <type> buttons
+DTYPES = [np.float32, np.float64, np.int32, np.uint8, np.int16, np.complex64, np.complex128]
+BYTEORDERS = ['=', '<', '>']
+
+
+def parse_slices(spec):
+    ''' Index tuple from a slice spec in numpy syntax, e.g. "3, :, 0:64:2"
+    (an empty spec is the whole array).
+    '''
+    index = []
+    for item in spec.split(','):
+        item = item.strip()
+        if item == '...':
+            index.append(Ellipsis)
+        elif ':' in item:
+            parts = item.split(':')
+            if len(parts) > 3:
+                raise ValueError("bad slice: "+item)
+            index.append(slice(*[int(p) if p.strip() else None for p in parts]))
+        elif item:
+            index.append(int(item))
+        elif spec.strip():
+            raise ValueError("empty index in slice spec: "+spec)
+    return tuple(index)
+
+
+def read(fname, datatype, numelem, skipbytes, byteorder='=', shape=None,
+         index=(), mmap=False):
     ''' Read and cast data arrays from raw file format.
-    -datatype: 0:float, 1:double, 2:int, 3:char, 4:complex<float>,
-    5:complex<double>
+    -datatype: index into DTYPES, 0:float, 1:double, 2:int, 3:char,
+    4:short int, 5:complex<float>, 6:complex<double>
+    -byteorder: '=' native, '<' little or '>' big endian
+
+    The file is read straight into the array, or with an index (a tuple
+    from parse_slices()) or mmap, memory-mapped so that only the slabs
+    that are indexed get read.  With mmap the result is a read-only view of
+    the file (in its byte order), otherwise a native-endian copy.
     '''
     if not type(fname) is str:
-        self.node.warn("Input is not a string.")
         raise Exception("read(): input is not a string.")
-
-    # opens the file
-    try:
-        fil = open(fname, 'rb')
-    except IOError:
-        print('cannot open', fname)
-        raise Exception("read(): cannot open file")
-
-    # read into byte array
-    fil.seek(skipbytes)
-
-    # read the dataset 
-    if datatype == 0:
-        data = fil.read(numelem*np.dtype(np.float32).itemsize)
-        data = np.fromstring(data, dtype=np.float32)
-    elif datatype == 1:
-        data = fil.read(numelem*np.dtype(np.float64).itemsize)
-        data = np.fromstring(data, dtype=np.float64)
-    elif datatype == 2:
-        data = fil.read(numelem*np.dtype(np.int32).itemsize)
-        data = np.fromstring(data, dtype=np.int32)
-    elif datatype == 3:
-        data = fil.read(numelem*np.dtype(np.uint8).itemsize)
-        data = np.fromstring(data, dtype=np.uint8)
-    elif datatype == 4:
-        data = fil.read(numelem*np.dtype('i2').itemsize)
-        data = np.fromstring(data, dtype='i2')
-    elif datatype == 5:
-        data = fil.read(numelem*np.dtype(np.complex64).itemsize)
-        data = np.fromstring(data, dtype=np.complex64)
-    elif datatype == 6:
-        data = fil.read(numelem*np.dtype(np.complex128).itemsize)
-        data = np.fromstring(data, dtype=np.complex128)
-    else:
+    if datatype not in range(len(DTYPES)):
         print("Error: read(): No valid datatype chosen: "+str(datatype))
         raise Exception("read(): no valid datatype chosen.")
 
+    dtype = np.dtype(DTYPES[datatype]).newbyteorder(byteorder)
+    if shape is None:
+        shape = (numelem,)
+
+    if mmap or index:
+        data = np.memmap(fname, dtype=dtype, mode='r', offset=skipbytes,
+                         shape=tuple(shape))[index]
+        if mmap:
+            return data
+        data = np.array(data)
+    else:
+        # opens the file
+        try:
+            fil = open(fname, 'rb')
+        except IOError:
+            print('cannot open', fname)
+            raise Exception("read(): cannot open file")
+
+        # read the dataset, without an intermediate byte string
+        fil.seek(skipbytes)
+        data = np.fromfile(fil, dtype=dtype, count=numelem)
+        fil.close()
+        data.shape = shape
+
     # convert data
-    fil.close()
+    if not dtype.isnative:
+        data = data.astype(dtype.newbyteorder('='))
     return(data)
 
 
@@ -98,6 +122,10 @@ class ExternalNode(gpi.NodeAPI):
     """Reads raw data into several c-types: float, double, int, and char.
     OUTPUT: Numpy array of data
 
+    Large files need not be read whole: with a Slice only the indexed slabs are read from
+    disk, and with Memory Map the output is a read-only memory map of the file that is
+    paged in as downstream nodes touch it, so it loads immediately.
+
     WIDGETS:
     I/O Info: information about file
     File Browser: file browswer
@@ -105,6 +133,11 @@ class ExternalNode(gpi.NodeAPI):
     <type>: type of data in file
     ndim:  Number of dimensions to fill (of output array)
     Dimension N: number of elements in the Nth dimension
+    Byte Order: of the data in the file; the output is native unless memory-mapped
+    Slice: optional index of the output in numpy syntax over the dimensions above,
+           e.g. "3, :, 0:64" for the 4th index of dimension 0 and the first 64 of dimension 2
+    Memory Map: output a memory map of the file (no copy); it is only valid while the file
+                is unchanged, and keeps the byte order of the file
     Compute: compute
     """
 
@@ -126,6 +159,9 @@ class ExternalNode(gpi.NodeAPI):
         for i in range(self.ndim):
             self.addWidget('SpinBox', self.dim_base_name+str(i), min=1, val=1, max=gpi.GPI_INT_MAX)
 
+        self.addWidget('ExclusivePushButtons', 'Byte Order', buttons=['native', 'little', 'big'], val=0)
+        self.addWidget('StringBox', 'Slice', placeholder='e.g. 0, :, 0:64 (empty: all)')
+        self.addWidget('PushButton', 'Memory Map', toggle=True)
         self.addWidget('PushButton', 'Compute', toggle=True)
 
         # IO Ports
@@ -138,6 +174,18 @@ class ExternalNode(gpi.NodeAPI):
         fname = self.URI(self.getVal('File Browser'))
         self.setDetailLabel(fname)
 
+        try:
+            parse_slices(self.getVal('Slice') or '')
+        except ValueError as e:
+            self.log.warn(str(e))
+            return 1
+
+        return 0
+
+    def execType(self):
+        # a memory-mapped output must not be copied to another process
+        return gpi.GPI_THREAD
+
     def compute(self):
 
         import os
@@ -196,13 +244,18 @@ class ExternalNode(gpi.NodeAPI):
         if not compute:
             return 0
 
-        out = read(fname, dtype, nelem, skipbytes)
+        if skipbytes + nelem*np.dtype(DTYPES[dtype]).itemsize > fsize:
+            self.log.warn("ERROR: ReadRaw(): the file is smaller than " \
+                + "Skip Bytes plus the dims!")
+            return 0
 
         try:
-            out.shape = dims
-        except:
-            self.log.warn("ERROR: ReadRaw(): reshape: dims are not the " \
-                + "same footprint as array!")
+            out = read(fname, dtype, nelem, skipbytes,
+                       byteorder=BYTEORDERS[self.getVal('Byte Order')], shape=dims,
+                       index=parse_slices(self.getVal('Slice') or ''),
+                       mmap=self.getVal('Memory Map'))
+        except IndexError as e:
+            self.log.warn("ERROR: ReadRaw(): slice: "+str(e))
             return 0
 
         self.setData('out', out)
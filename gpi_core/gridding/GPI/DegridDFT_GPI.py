@@ -37,6 +37,7 @@
 
 import gpi
 import numpy as np
+import multiprocessing
 
 class ExternalNode(gpi.NodeAPI):
     """Inverse Gridding module for Post-Cartesian Data using DFT - works with 2D data
@@ -55,6 +56,11 @@ class ExternalNode(gpi.NodeAPI):
     WIDGETS:
     Eff Mtx - effective matrix of coords (specifies Nyquist distance)
     dwell (us) - time per sample, required for off-resonance degridding
+    Precision - Single is much faster and accurate to about 1e-6, Double for reference calculations
+    Time Segments - 0 computes the off-resonance phase exactly for every pixel and sample.  Otherwise the
+                    readout is split into this many segments and each sample is interpolated between the
+                    segments either side of it, which is much faster (error roughly falls 10x per doubling)
+    Threads - number of threads the samples are shared between
     """
 
     def execType(self):
@@ -65,13 +71,16 @@ class ExternalNode(gpi.NodeAPI):
         # Widgets
         self.addWidget('SpinBox','Eff Mtx',min=10,val = 240)
         self.addWidget('DoubleSpinBox','dwell (us)', min=0.0, val = 2.0)
+        self.addWidget('ExclusivePushButtons','Precision', buttons=['Single','Double'], val=1)
+        self.addWidget('SpinBox','Time Segments', min=0, val=0)
+        self.addWidget('SpinBox','Threads', min=1, max=256, val=multiprocessing.cpu_count())
 
         # IO Ports
         self.addInPort('image', 'NPYarray', ndim=2, dtype=[np.complex64, np.complex128])
         self.addInPort('offres', 'NPYarray', ndim=2, dtype=[np.float32, np.float64],obligation=gpi.OPTIONAL)
         self.addInPort('coords', 'NPYarray', dtype=[np.float32, np.float64])
 
-        self.addOutPort('data', 'NPYarray', dtype= np.complex128)
+        self.addOutPort('data', 'NPYarray', dtype=[np.complex64, np.complex128])
 
     def validate(self):
         crds = self.getData('coords')
@@ -89,7 +98,13 @@ class ExternalNode(gpi.NodeAPI):
 
         effmtx = self.getVal('Eff Mtx')
         dwell = self.getVal('dwell (us)') * 1e-6
-        image = self.getData('image').astype(np.complex128)
+        single = self.getVal('Precision') == 0
+        nseg = self.getVal('Time Segments')
+        nthreads = self.getVal('Threads')
+        if single:
+          image = self.getData('image').astype(np.complex64)
+        else:
+          image = self.getData('image').astype(np.complex128)
         offres = self.getData('offres')
         crds = self.getData('coords').astype(np.float64)
         narms, npts, ndim = crds.shape
@@ -104,7 +119,13 @@ class ExternalNode(gpi.NodeAPI):
         outdim = np.array([crds[...,0].size],dtype=np.int64)
 
         # out = dft.dftgrid(image,newcrds,outdim,effmtx)
-        out = dft.dftgrid(image,offres,newcrds,time,outdim,effmtx)
+        offres = offres.astype(np.float64)
+        if single:
+          out = dft.dftgrid_single(image,offres,newcrds,time,outdim,effmtx,
+                                   nseg=nseg,nthreads=nthreads)
+        else:
+          out = dft.dftgrid(image,offres,newcrds,time,outdim,effmtx,
+                            nseg=nseg,nthreads=nthreads)
 
         out = np.reshape(out,crds[...,0].shape)
         self.setData('data', out)
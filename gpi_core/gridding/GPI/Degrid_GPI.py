@@ -0,0 +1,157 @@
+# Copyright (c) 2014, Dignity Health
+#
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+#
+#     Under either license, the following additional term applies:
+#
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+#
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+#
+#         This file is part of the GPI core node library.
+#
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Date: 2026oct17
+# Brief: Convolution degridding of Cartesian k-space onto non-Cartesian coordinates, the adjoint of Grid.
+
+import gpi
+import numpy as np
+import multiprocessing
+
+class ExternalNode(gpi.NodeAPI):
+    """Inverse Gridding module for Post-Cartesian Data - works with 1D, 2D and 3D data
+    Resamples gridded k-space at the given coordinates, using the same kernel, oversampled matrix and
+    off-center shift as Grid.  This is the exact adjoint of Grid, so Grid and Degrid can be used as the
+    forward and backward operators of iterative reconstructions (e.g. with ConjugateGradient).
+
+    INPUTS:
+    data - gridded k-space complex data, as output by Grid (i.e. on the oversampled matrix).
+             The last 1, 2 or 3 dimensions (depending on the last dimension of coords) are the grid,
+             any other dimensions are independent sets (slices, coils, etc.) and must end with the
+             coordinate set dimensions, as for the output of Grid
+    coords - k-space coordinates, normalized in units of "1/resolution", i.e. ranging from -0.5 to 0.5
+               Last dimension must be 1, 2 or 3 (corresponding to kx, kx/ky, or kx/ky/kz, respectively)
+               Samples outside of this range are set to 0
+    weighting - optional sampling density weighting, multiplied onto the samples so that the result is the
+                  adjoint of Grid with the same weighting
+
+    OUTPUTS:
+    out - complex samples at coords, with the set dimensions of data followed by the point dimensions of coords
+
+    WIDGETS:
+    Dims per Set - How many dimensions of coords (not counting the last) make up one set of samples,
+                   as for Grid
+    Kernel, Kernel Width, Oversampling - gridding kernel, as given to Grid
+    dx, dy, dz - for off-center FOV correction, in pixels, as given to Grid
+    Threads - number of threads used for degridding
+    """
+
+    def execType(self):
+        return gpi.GPI_PROCESS
+
+    def initUI(self):
+
+        # Widgets
+        self.addWidget('Slider','Dims per Set',min=1,val=2)
+        self.addWidget('ExclusivePushButtons','Kernel', buttons=['Hanning-Gaussian','Kaiser-Bessel'], val=0)
+        self.addWidget('DoubleSpinBox','Kernel Width', min=2.0, max=8.0, val=5.0, singlestep=0.5)
+        self.addWidget('DoubleSpinBox','Oversampling', min=1.0, max=4.0, val=1.5, singlestep=0.05)
+        self.addWidget('DoubleSpinBox','dx (pixels)', val=0.0)
+        self.addWidget('DoubleSpinBox','dy (pixels)', val=0.0)
+        self.addWidget('DoubleSpinBox','dz (pixels)', val=0.0)
+        self.addWidget('SpinBox','Threads', min=1, max=256, val=multiprocessing.cpu_count())
+
+        # IO Ports
+        self.addInPort('data', 'NPYarray', dtype=[np.complex64, np.complex128])
+        self.addInPort('coords', 'NPYarray', dtype=[np.float64, np.float32])
+        self.addInPort('weighting', 'NPYarray', dtype=[np.float32, np.float64],
+                       obligation=gpi.OPTIONAL)
+        self.addOutPort('out', 'NPYarray', dtype=[np.complex64, np.complex128])
+
+    def validate(self):
+
+        data = self.getData('data')
+        crds = self.getData('coords')
+        wghts = self.getData('weighting')
+
+        ndim = crds.shape[-1]
+        if ndim not in [1,2,3]:
+          self.log.warn("only 1-3 dimensional degridding implemented")
+          return 1
+
+        self.setAttr('Dims per Set', max = crds.ndim-1)
+        dps = self.getVal('Dims per Set')
+
+        # the set dimensions of coords must be the last set dimensions of data
+        csets = crds.shape[:crds.ndim-1-dps]
+        if data.ndim < ndim + len(csets) or \
+           data.shape[data.ndim-ndim-len(csets):data.ndim-ndim] != csets:
+          self.log.warn("sets of data and coords don't match")
+          return 1
+
+        if wghts is not None and wghts.shape != crds.shape[:-1]:
+          self.log.warn("shape of weights must match crds")
+          return 1
+
+        return 0
+
+    def compute(self):
+
+        import numpy as np
+        import gpi_core.gridding.grid as gd
+
+        crds = self.getData('coords')
+        wghts = self.getData('weighting')
+        data = self.getData('data')
+        dps = self.getVal('Dims per Set')
+        dx = self.getVal('dx (pixels)')
+        dy = self.getVal('dy (pixels)')
+        dz = self.getVal('dz (pixels)')
+        nthreads = self.getVal('Threads')
+        kerntype = self.getVal('Kernel')
+        width = self.getVal('Kernel Width')
+        osf = self.getVal('Oversampling')
+
+        in_dtype = data.dtype
+        ndim = crds.shape[-1]
+        ptshape = crds.shape[crds.ndim-1-dps:-1]
+        npts = int(np.prod(ptshape))
+        ncsets = crds[...,0].size//npts
+        gridshape = data.shape[data.ndim-ndim:]
+        setshape = data.shape[:data.ndim-ndim]
+        ndsets = int(np.prod(setshape))//ncsets
+
+        crds = np.reshape(crds.astype(np.float32),(ncsets,npts,ndim))
+        data = np.reshape(data.astype(np.complex64),(ndsets,ncsets)+gridshape)
+
+        out = gd.degrid(crds,data,dx,dy,dz,
+                        nthreads=nthreads,kernel=kerntype,width=width,osf=osf)
+
+        if wghts is not None:
+          out *= np.reshape(wghts.astype(np.float32),(ncsets,npts))
+
+        out = np.reshape(out,setshape+ptshape)
+        self.setData('out', out.astype(in_dtype, copy=False))
+
+        return(0)
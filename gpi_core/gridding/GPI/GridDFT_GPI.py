@@ -37,6 +37,7 @@
 
 import gpi
 import numpy as np
+import multiprocessing
 
 class ExternalNode(gpi.NodeAPI):
     """Inverse Gridding module for Post-Cartesian Data using DFT - works with 2D data
@@ -53,6 +54,8 @@ class ExternalNode(gpi.NodeAPI):
     
     WIDGETS:
     Eff Mtx - effective matrix of coords (specifies Nyquist distance)
+    Precision - Single is much faster and accurate to about 1e-6, Double for reference calculations
+    Threads - number of threads the image is shared between
     """
 
     def execType(self):
@@ -62,12 +65,14 @@ class ExternalNode(gpi.NodeAPI):
 
         # Widgets
         self.addWidget('SpinBox','Eff Mtx',min=10,val = 100)
+        self.addWidget('ExclusivePushButtons','Precision', buttons=['Single','Double'], val=1)
+        self.addWidget('SpinBox','Threads', min=1, max=256, val=multiprocessing.cpu_count())
 
         # IO Ports
         self.addInPort('data', 'NPYarray', ndim=2, dtype=[np.complex64, np.complex128])
         self.addInPort('coords', 'NPYarray', dtype=[np.float32, np.float64])
         self.addInPort('weighting', 'NPYarray', dtype=[np.float32, np.float64], obligation=gpi.OPTIONAL)
-        self.addOutPort('image', 'NPYarray', dtype= np.complex128)
+        self.addOutPort('image', 'NPYarray', dtype=[np.complex64, np.complex128])
 
     def validate(self):
         crds = self.getData('coords')
@@ -84,7 +89,12 @@ class ExternalNode(gpi.NodeAPI):
         import gpi_core.gridding.dft as dft
 
         effmtx = self.getVal('Eff Mtx')
-        data = self.getData('data').astype(np.complex128)
+        single = self.getVal('Precision') == 0
+        nthreads = self.getVal('Threads')
+        if single:
+          data = self.getData('data').astype(np.complex64)
+        else:
+          data = self.getData('data').astype(np.complex128)
         crds = self.getData('coords').astype(np.float64)
         wghts = self.getData('weighting')
         newcrds = np.reshape(crds,(crds[...,0].size,2))
@@ -109,7 +119,12 @@ class ExternalNode(gpi.NodeAPI):
         #outdim = np.array([crds[...,0].size],dtype=np.int64)
         outdim = np.array([effmtx,effmtx],dtype=np.int64)
 
-        out = dft.dft_grid(data,newcrds,outdim,effmtx,wghts.astype(np.float64))
+        if single:
+          out = dft.dft_grid_single(data,newcrds,outdim,effmtx,wghts.astype(np.float64),
+                                    nthreads=nthreads)
+        else:
+          out = dft.dft_grid(data,newcrds,outdim,effmtx,wghts.astype(np.float64),
+                             nthreads=nthreads)
 
         #out = np.reshape(out,crds[...,0].shape)
         self.setData('image', out)
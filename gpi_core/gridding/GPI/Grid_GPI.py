@@ -37,6 +37,7 @@
 
 import gpi
 import numpy as np
+import multiprocessing
 
 class ExternalNode(gpi.NodeAPI):
     """Gridding module for Post-Cartesian Data - works with 2D and 3D data
@@ -52,7 +53,7 @@ class ExternalNode(gpi.NodeAPI):
     OUTPUTS:
     gridded data, which is M+E dimensions, where
                   M is 1, 2 or 3, depending on last dimension of coords input (i.e. 1D, 2D, or 3D)
-                    The size of these M dimensions is 1.5 times the given effective matrix
+                    The size of these M dimensions is the given effective matrix times the Oversampling widget
                   E is (# input data dims) - (Dims per set widget value)
                     E represents slices, coils, etc., which don't get gridded together.
 
@@ -61,12 +62,28 @@ class ExternalNode(gpi.NodeAPI):
                    Remaining dimensions are independent, e.g. for slices, coils, etc.
     Eff MTX XY - number of pixels in the final image (XY), nominally (without zero-padding) given by FOV/resolution
       Add 25% to matrix for "true resolution" for (e.g.) spiral
-      Output data are gridded to a matrix 50% larger than this to mitigate gridding artifacts
+      Output data are gridded to a matrix larger than this (see Oversampling) to mitigate gridding artifacts
     Eff MTX Z - number of pixels in the final image (Z), nominally (without zero-padding) given by FOV/resolution
       Add 25% to matrix for "true resolution" for (e.g.) stack of cones, spherical distributed spiral, FLORET
-      Output data are gridded to a matrix 50% larger than this to mitigate gridding artifacts
+      Output data are gridded to a matrix larger than this (see Oversampling) to mitigate gridding artifacts
+    Kernel - gridding kernel: the original Hanning-Gaussian, or Kaiser-Bessel, which stays accurate at
+             low oversampling.  Rolloff must be set to the same Kernel, Kernel Width and Oversampling
+    Kernel Width - kernel width in (oversampled) grid points, 5 for the original kernel,
+             e.g. 4-6 for Kaiser-Bessel
+    Oversampling - ratio of the gridded matrix to the effective matrix, 1.5 for the original kernel.
+             Kaiser-Bessel can go down to about 1.25, which saves a lot of memory and FFT time in 3D
     dx, dy, dz - for off-center FOV correction.  Specify number of pixels in each direction to shift (in image space)
                  prior to gridding.
+    Threads - number of threads used for gridding.  Multiple sets (e.g. coils) are gridded in parallel
+              in a single call, with each sample's kernel footprint computed once per set of coordinates.
+              A single set is split into slabs which are gridded in parallel.  Either way the result
+              is the same as with a single thread.
+    Plan Cache (MB) - if non-zero, the kernel weights and grid indices for the coordinates are kept as a sparse
+              gridding plan, so that re-gridding new data on the same trajectory (and MTX and offsets) is a
+              sparse matrix product.  A plan is only made when a trajectory comes a second time; the first
+              time it is gridded directly with the Threads above.  Plans are cached up to this size, least
+              recently used first out.  Trajectories whose plan would not fit are gridded directly.
+              0 (the default) disables the cache.
 
       Note on Input dimensions: If coords is N dimensions, with the last used for the 2D/3D information,
                                   1) weights must have N-1 dimensions, of the same shape as corresponding coords
@@ -93,6 +110,9 @@ class ExternalNode(gpi.NodeAPI):
     """
 
     def execType(self):
+        # the plan cache has to live in this process between runs
+        if self.getVal('Plan Cache (MB)') > 0:
+            return gpi.GPI_THREAD
         return gpi.GPI_PROCESS
 
     def initUI(self):
@@ -101,9 +121,14 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget('Slider','Dims per Set',min=1,val=2)
         self.addWidget('SpinBox','Eff MTX XY', min=5, val=240)
         self.addWidget('SpinBox','Eff MTX Z',  min=5, val=240)
+        self.addWidget('ExclusivePushButtons','Kernel', buttons=['Hanning-Gaussian','Kaiser-Bessel'], val=0)
+        self.addWidget('DoubleSpinBox','Kernel Width', min=2.0, max=8.0, val=5.0, singlestep=0.5)
+        self.addWidget('DoubleSpinBox','Oversampling', min=1.0, max=4.0, val=1.5, singlestep=0.05)
         self.addWidget('DoubleSpinBox','dx (pixels)', val=0.0)
         self.addWidget('DoubleSpinBox','dy (pixels)', val=0.0)
         self.addWidget('DoubleSpinBox','dz (pixels)', val=0.0)
+        self.addWidget('SpinBox','Threads', min=1, max=256, val=multiprocessing.cpu_count())
+        self.addWidget('SpinBox','Plan Cache (MB)', min=0, max=65536, val=0)
 
         # IO Ports
         self.addInPort('data', 'NPYarray', dtype=[np.complex64, np.complex128],
@@ -228,16 +253,21 @@ class ExternalNode(gpi.NodeAPI):
 
         import numpy as np
         import gpi_core.gridding.grid as gd
+        import gpi_core.gridding.gridplan as gp
 
         crds = np.float32(self.getData('coords'))
         wghts = self.getData('weighting')
         data = self.getData('data')
         dps = self.getVal('Dims per Set')
-        mtx_xy = (3*self.getVal('Eff MTX XY')/2) # 1.5X OVERSAMPLE
-        mtx_z  = (3*self.getVal('Eff MTX Z')/2) # 1.5X OVERSAMPLE
+        kerntype = self.getVal('Kernel')
+        width = self.getVal('Kernel Width')
+        osf = self.getVal('Oversampling')
+        mtx_xy = osf*self.getVal('Eff MTX XY')
+        mtx_z  = osf*self.getVal('Eff MTX Z')
         dx = self.getVal('dx (pixels)')
         dy = self.getVal('dy (pixels)')
         dz = self.getVal('dz (pixels)')
+        nthreads = self.getVal('Threads')
 
         # Each gridded set will have npts points gridded onto it
         # There are separate coordinates for ncsets of different gridded units (lines, planes, volumes)
@@ -286,13 +316,24 @@ class ExternalNode(gpi.NodeAPI):
             outdim1 = np.array([mtx_z,mtx_xy,mtx_xy],dtype=np.int64)
 
         outshape = np.append([ndsets*ncsets], outdim1)
-        out = np.zeros(outshape,  dtype = in_dtype)
 
-        # Grid it
-        for i in range(ndsets):
-          for j in range(ncsets):
-            outset = gd.grid(crds[j,...],data[i,j,...],wghts[j,...],outdim,dx,dy,dz)
-            out[i*ncsets+j,...] = outset.astype(in_dtype)
+        # Grid it - from a cached plan if there is room for one, otherwise all
+        # sets in one call, sharing the kernel footprint of each coordinate set
+        # between its data sets (e.g. coils)
+        maxbytes = self.getVal('Plan Cache (MB)')*2**20
+        plan = None
+        if 0 < gp.plan_estimate(ncsets*npts, crds.shape[-1], width) <= maxbytes:
+          plan = gp.get_plan(crds,outdim,dx,dy,dz,kerntype,width,osf,maxbytes=maxbytes,
+                             on_repeat=True)
+        if plan is not None:
+          out = plan.grid(data,wghts)
+        elif ndsets*ncsets == 1:
+          out = gd.grid(crds[0,...],data[0,0,...],wghts[0,...],outdim,dx,dy,dz,
+                        nthreads=nthreads,kernel=kerntype,width=width,osf=osf)
+        else:
+          out = gd.grid_batch(crds,data,wghts,outdim,dx,dy,dz,
+                              nthreads=nthreads,kernel=kerntype,width=width,osf=osf)
+        out = np.reshape(out,outshape).astype(in_dtype, copy=False)
 
         # RESHAPE OUTPUT
         if datshape.size == dps:
@@ -301,6 +342,6 @@ class ExternalNode(gpi.NodeAPI):
           outshape = np.append(datshape[0:datshape.size-dps],outdim1)
           out = np.reshape(out,outshape)
 
-        self.setData('out', out.astype(in_dtype))
+        self.setData('out', out)
 
         return(0)
@@ -0,0 +1,160 @@
+# Copyright (c) 2014, Dignity Health
+#
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+#
+#     Under either license, the following additional term applies:
+#
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+#
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+#
+#         This file is part of the GPI core node library.
+#
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Date: 2026oct17
+# Brief: Grid, inverse FFT and Rolloff of non-Cartesian data in one step.
+
+import gpi
+import numpy as np
+import multiprocessing
+
+class ExternalNode(gpi.NodeAPI):
+    """Non-Cartesian reconstruction in one step: Grid -> inverse FFT -> Rolloff - works with 1D, 2D and 3D data
+    Gives the same images as Grid, FFTW (inverse, over the gridded dims) and Rolloff in a row, but each set
+    (coil, slice, ...) is gridded, transformed in place and rolled off/cropped straight into the output in a
+    single native call.  Only one oversampled grid is held at a time, instead of the full oversampled
+    k-space of every set plus its transform.
+
+    INPUTS:
+    data - k-space complex data, as for Grid
+    coords - k-space coordinates, normalized in units of "1/resolution", i.e. ranging from -0.5 to 0.5
+               Last dimension must be 1, 2 or 3 (corresponding to kx, kx/ky, or kx/ky/kz, respectively)
+    weighting - optional sampling density weighting (e.g. from SDC), same shape as coords without the last dim
+
+    OUTPUTS:
+    out - complex images of the effective matrix size, with the set dimensions of data first
+
+    WIDGETS:
+    Dims per Set - How many dimensions get gridded into the same space, as for Grid
+    Eff MTX XY, Eff MTX Z - number of pixels in the final image, as for Grid
+    Kernel, Kernel Width, Oversampling - gridding kernel, used for both gridding and rolloff correction
+    dx, dy, dz - for off-center FOV correction, in pixels, as for Grid
+    Isotropic FOV - multiplies the images by a circular/spherical mask for 2D/3D data, as for Rolloff
+    Threads - number of threads used for gridding and rolloff of each set
+    """
+
+    def execType(self):
+        # the rolloff correction vectors are cached in this process between runs
+        return gpi.GPI_THREAD
+
+    def initUI(self):
+
+        # Widgets
+        self.addWidget('Slider','Dims per Set',min=1,val=2)
+        self.addWidget('SpinBox','Eff MTX XY', min=5, val=240)
+        self.addWidget('SpinBox','Eff MTX Z',  min=5, val=240)
+        self.addWidget('ExclusivePushButtons','Kernel', buttons=['Hanning-Gaussian','Kaiser-Bessel'], val=0)
+        self.addWidget('DoubleSpinBox','Kernel Width', min=2.0, max=8.0, val=5.0, singlestep=0.5)
+        self.addWidget('DoubleSpinBox','Oversampling', min=1.0, max=4.0, val=1.5, singlestep=0.05)
+        self.addWidget('DoubleSpinBox','dx (pixels)', val=0.0)
+        self.addWidget('DoubleSpinBox','dy (pixels)', val=0.0)
+        self.addWidget('DoubleSpinBox','dz (pixels)', val=0.0)
+        self.addWidget('PushButton','Isotropic FOV',toggle=True,val=True)
+        self.addWidget('SpinBox','Threads', min=1, max=256, val=multiprocessing.cpu_count())
+
+        # IO Ports
+        self.addInPort('data', 'NPYarray', dtype=[np.complex64, np.complex128])
+        self.addInPort('coords', 'NPYarray', dtype=[np.float64, np.float32])
+        self.addInPort('weighting', 'NPYarray', dtype=[np.float32, np.float64],
+                       obligation=gpi.OPTIONAL)
+        self.addOutPort('out', 'NPYarray', dtype=[np.complex64, np.complex128])
+
+    def validate(self):
+
+        data = self.getData('data')
+        crds = self.getData('coords')
+        wghts = self.getData('weighting')
+
+        if crds.shape[-1] not in [1,2,3]:
+          self.log.warn("only 1-3 dimensional gridding implemented")
+          return 1
+        self.setAttr('Eff MTX Z', visible=crds.shape[-1]==3)
+        self.setAttr('Dims per Set', max = crds.ndim-1)
+
+        if data.ndim < crds.ndim - 1 or \
+           data.shape[data.ndim-crds.ndim+1:] != crds.shape[:-1]:
+          self.log.warn("sizes of data and coords don't match")
+          return 1
+
+        if wghts is not None and wghts.shape != crds.shape[:-1]:
+          self.log.warn("shape of weights must match crds")
+          return 1
+
+        return 0
+
+    def compute(self):
+
+        import numpy as np
+        import gpi_core.gridding.grid as gd
+
+        crds = self.getData('coords')
+        wghts = self.getData('weighting')
+        data = self.getData('data')
+        dps = self.getVal('Dims per Set')
+        kerntype = self.getVal('Kernel')
+        width = self.getVal('Kernel Width')
+        osf = self.getVal('Oversampling')
+        dx = self.getVal('dx (pixels)')
+        dy = self.getVal('dy (pixels)')
+        dz = self.getVal('dz (pixels)')
+        isofov = self.getVal('Isotropic FOV')
+        nthreads = self.getVal('Threads')
+
+        in_dtype = data.dtype
+        ndim = crds.shape[-1]
+        npts = int(np.prod(crds.shape[crds.ndim-1-dps:-1]))
+        ncsets = crds[...,0].size//npts
+        ndsets = data.size//crds[...,0].size
+        setshape = data.shape[:data.ndim-dps]
+
+        crds = np.reshape(crds.astype(np.float32),(ncsets,npts,ndim))
+        data = np.reshape(data.astype(np.complex64),(ndsets,ncsets,npts))
+        if wghts is None:
+          wghts = np.ones((ncsets,npts), dtype=np.float32)
+        else:
+          wghts = np.reshape(wghts.astype(np.float32),(ncsets,npts))
+
+        # gridded and cropped matrices, as Grid and Rolloff would make them
+        # Note we are reversing the order of dimensions - necessary for python-c
+        mtx = [osf*self.getVal('Eff MTX XY')]*2 + [osf*self.getVal('Eff MTX Z')]
+        outdim = np.array(mtx[:ndim], dtype=np.int64)
+        imgdim = np.array(np.ceil(np.round(outdim/osf, 6)), dtype=np.int64)
+
+        out = gd.nufft_adjoint(crds,data,wghts,outdim,imgdim,dx,dy,dz,isofov,
+                               nthreads=nthreads,kernel=kerntype,width=width,osf=osf)
+
+        out = np.reshape(out, setshape + tuple(imgdim[::-1]))
+        self.setData('out', out.astype(in_dtype, copy=False))
+
+        return(0)
@@ -37,12 +37,13 @@
 
 import gpi
 import numpy as np
+import multiprocessing
 
 
 class ExternalNode(gpi.NodeAPI):
     """Implements rolloff correction in-house 2D gridding module written in C++.
-    This module corrects the image shading created by the Grid module and crops the data by 1/3
-    in each Gridded dimension to produce an image of the right matrix size
+    This module corrects the image shading created by the Grid module and crops the data by the oversampling
+    factor (1/3 for the default 1.5) in each Gridded dimension to produce an image of the right matrix size
 
     INPUT: complex data - typically the output of Grid, Fourier Transformed to image space
            These data can represent 1D, 2D or 3D data, with optional extra dimensions representing (e.g.) coils or slices
@@ -53,16 +54,25 @@ class ExternalNode(gpi.NodeAPI):
     Num Rolloff Dims - Set to 1, 2, or 3 corresponding to 1D, 2D, or 3D gridded data sets
                        Remaining dims are treated independently, e.g. as slices, coils, etc.
     Isotropic FOV - multiplies data by a circular/spherical mask for 2D/3D data
+    Kernel, Kernel Width, Oversampling - must match the Grid settings; the shading correction is computed
+                       from the same kernel, and the output is the input size divided by Oversampling
+    Threads - number of threads; all sets are corrected in a single pass, and the correction vectors are
+              kept between runs for the same sizes and kernel
     """
 
     def execType(self):
-        return gpi.GPI_PROCESS
+        # the correction vectors are cached in this process between runs
+        return gpi.GPI_THREAD
 
     def initUI(self):
 
         # Widgets
         self.addWidget('Slider','Num Rolloff Dims',min=1,max=3,val=2)
         self.addWidget('PushButton','Isotropic FOV',toggle=True,val=True)
+        self.addWidget('ExclusivePushButtons','Kernel', buttons=['Hanning-Gaussian','Kaiser-Bessel'], val=0)
+        self.addWidget('DoubleSpinBox','Kernel Width', min=2.0, max=8.0, val=5.0, singlestep=0.5)
+        self.addWidget('DoubleSpinBox','Oversampling', min=1.0, max=4.0, val=1.5, singlestep=0.05)
+        self.addWidget('SpinBox','Threads', min=1, max=256, val=multiprocessing.cpu_count())
 
         # IO Ports
         self.addInPort('data', 'NPYarray', dtype=[np.complex64, np.complex128])
@@ -94,42 +104,28 @@ class ExternalNode(gpi.NodeAPI):
         oshape = np.copy(dshape)
         nrd = self.getVal('Num Rolloff Dims')
         isofov = self.getVal('Isotropic FOV')
+        kerntype = self.getVal('Kernel')
+        width = self.getVal('Kernel Width')
+        osf = self.getVal('Oversampling')
 
-        # dimensions for rolloff - we will loop in this wrapper (below) around multiple sets
+        # cropped size, rounding off the error in dividing by osf
+        def crop(n):
+          return np.ceil(np.round(n/osf, 6))
+
+        # dimensions for rolloff - all sets are done in one call
         # Note we are reversing the order of dimensions - necessary for python-c
-        if nrd == 1:
-          oshape[-1] = np.ceil(2*dshape[-1]/3.)
-          outdim = np.array([oshape[-1] ],dtype=np.int64)
-          nsets = np.prod(oshape)//np.prod(outdim)
-          newdshape = np.array((nsets,dshape[-1]))
-          outdim1 = outdim
-        elif nrd == 2:
-          oshape[-1] = np.ceil(2*dshape[-1]/3.)
-          oshape[-2] = np.ceil(2*dshape[-2]/3.)
-          outdim = np.array([oshape[-1], oshape[-2] ],dtype=np.int64)
-          nsets = np.prod(oshape)//np.prod(outdim)
-          newdshape = np.array((nsets,dshape[-2],dshape[-1]))
-          outdim1 = outdim
-        elif nrd == 3:
-          oshape[-1] = np.ceil(2*dshape[-1]/3.)
-          oshape[-2] = np.ceil(2*dshape[-2]/3.)
-          oshape[-3] = np.ceil(2*dshape[-3]/3.)
-          outdim = np.array([oshape[-1], oshape[-2], oshape[-3] ],dtype=np.int64)
-          outdim1 = np.array([oshape[-3], oshape[-2], oshape[-1] ],dtype=np.int64)
-          nsets = np.prod(oshape)//np.prod(outdim)
-          newdshape = np.array((nsets,dshape[-3],dshape[-2],dshape[-1]))
+        for i in range(1, nrd+1):
+          oshape[-i] = crop(dshape[-i])
+        outdim = np.array(oshape[::-1][:nrd], dtype=np.int64)
+        nsets = int(np.prod(dshape[:-nrd]))
 
         # Reshape data to have the first index be # sets, the rest be the rolled-off data
-        data = np.reshape(data,newdshape)
-
-        outshape1 = np.append([nsets], outdim1)
-        out = np.zeros(outshape1,  dtype = in_dtype)
-
-        for i in range(int(nsets)):
-          # force single precision
-          outset = gd.rolloff(data[i,...].astype(np.complex64),outdim,isofov)
-          out[i,...] = np.require(outset, dtype=in_dtype)
+        data = np.reshape(data, (nsets,) + tuple(dshape[-nrd:]))
 
+        # force single precision
+        out = gd.rolloff_batch(np.require(data, dtype=np.complex64, requirements='C'),
+                               outdim, isofov, kernel=kerntype, width=width, osf=osf,
+                               nthreads=self.getVal('Threads'))
         out = np.reshape(out, oshape)
 
         self.setData('out', np.require(out, dtype=in_dtype))
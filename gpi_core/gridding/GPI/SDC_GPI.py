@@ -37,6 +37,7 @@
 
 import gpi
 import numpy as np
+import multiprocessing
 
 class ExternalNode(gpi.NodeAPI):
     """Computes Sampling Density Correction for 2D and 3D waveforms
@@ -58,6 +59,12 @@ class ExternalNode(gpi.NodeAPI):
     Effective Matrix Z - FOV/resolution in Z, which indicates the width of data correlation in k-space
     Taper - taper the weights at the edge of k-space; value indicates the fraction of k-space radius to
             (linearly) taper from 1 to 0 (at the very edge): 0 gives no taper, 1 is "full" taper
+    krad Scale - scales the kernel radius (3D only)
+    Threads - number of threads; all sets are computed in a single call
+    Disk Cache (MB) - if non-zero, the weights are saved in a cache directory (set by $GPI_SDC_CACHE,
+              default ~/.cache/gpi_core/sdc) keyed on a hash of the coordinates, weights and the settings
+              above, and loaded from there when the same trajectory is seen again.  Least recently used
+              weights are removed to keep the cache under this size.  0 disables the cache.
     """
 
     def execType(self):
@@ -73,6 +80,8 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget('DoubleSpinBox','Effective MTX Z',val=300.0, min=2.0)
         self.addWidget('DoubleSpinBox','Taper',val=0.0, min=0.0, max = 1.0, singlestep = 0.01)
         self.addWidget('DoubleSpinBox','krad Scale',val=1.0, min=0.2, max = 2.0, singlestep = 0.1)
+        self.addWidget('SpinBox','Threads', min=1, max=256, val=multiprocessing.cpu_count())
+        self.addWidget('SpinBox','Disk Cache (MB)', min=0, max=65536, val=1024)
 
         # IO Ports
         self.addInPort('crds', 'NPYarray')
@@ -173,20 +182,26 @@ class ExternalNode(gpi.NodeAPI):
 
           # import in thread to save namespace 
           import gpi_core.gridding.sdc as sd
-          for set in range(nsets):
-            if crds.shape[-1] == 1:
-              cmtxdim = np.array([mtxsz_xy],dtype=np.int64)
-              sdcset = sd.oned_sdc(crds[set,:],wates[set,:],cmtxdim,numiter,taper)
-            if crds.shape[-1] == 2:
-              cmtxdim = np.array([mtxsz_xy,mtxsz_xy],dtype=np.int64)
-              sdcset = sd.twod_sdc(crds[set,:],wates[set,:],cmtxdim,numiter,taper)
-            if crds.shape[-1] == 3:
-              cmtxdim = np.array([mtxsz_xy,mtxsz_xy,mtxsz_z],dtype=np.int64)
-              sdcset = sd.threed_sdc(crds[set,:],wates[set,:],cmtxdim,numiter,taper,kradscale)
-            if set == 0:
-              sdc = np.expand_dims(sdcset,0)
-            else:
-              sdc = np.append(sdc,np.expand_dims(sdcset,0),axis=0)
+          import gpi_core.gridding.sdccache as sc
+          if crds.shape[-1] == 1:
+            cmtxdim = np.array([mtxsz_xy],dtype=np.int64)
+          if crds.shape[-1] == 2:
+            cmtxdim = np.array([mtxsz_xy,mtxsz_xy],dtype=np.int64)
+          if crds.shape[-1] == 3:
+            cmtxdim = np.array([mtxsz_xy,mtxsz_xy,mtxsz_z],dtype=np.int64)
+
+          maxbytes = self.getVal('Disk Cache (MB)')*2**20
+          sdc = None
+          if maxbytes > 0:
+            key = sc.sdc_key(crds,inwates,cmtxdim,numiter,taper,kradscale)
+            sdc = sc.load(key)
+            if sdc is not None and sdc.shape != wates.shape:
+              sdc = None
+          if sdc is None:
+            sdc = sd.sdc_sets(crds,wates,cmtxdim,numiter,taper,
+                              kradscale=kradscale, nthreads=self.getVal('Threads'))
+            if maxbytes > 0:
+              sc.save(key,sdc,maxbytes)
 
           # Reshape sdc weights to match that of incoming coordinates
           self.setData('sdc', np.reshape(sdc,sdshape))
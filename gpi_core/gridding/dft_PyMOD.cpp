@@ -44,8 +44,11 @@
  **/
 
 #include "PyFI/PyFI.h"
+#include "multiproc/threads.c"
 using namespace PyFI;
 
+#include <vector>
+using namespace std;
 #include "dft_core.cpp"
 
 PYFI_FUNC(dftgrid)
@@ -60,14 +63,40 @@ PYFI_FUNC(dftgrid)
     PYFI_POSARG(Array<int64_t>, outdim);
     PYFI_POSARG(int64_t, effmtx);
 
+    PYFI_KWARG(int64_t, nseg, 0); // "off-resonance time segments, 0 for exact (default:0)"
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+
     PYFI_SETOUTPUT_ALLOC(Array<complex<double> >, outdata, DA(*outdim));
 
-    if (do_dft(*image, *offres, *crds, *time, *outdata, *effmtx))
+    if (do_dft(*image, *offres, *crds, *time, *outdata, *effmtx, *nseg, *nthreads))
         PYFI_ERROR("griddat() has failed");
 
     PYFI_END(); /* This must be the last line */
 } /* dftgrid */
 
+PYFI_FUNC(dftgrid_single)
+{
+    PYFI_START(); /* This must be the first line */
+
+    /* input */
+    PYFI_POSARG(Array<complex<float> >, image);
+    PYFI_POSARG(Array<double>, offres);
+    PYFI_POSARG(Array<double>, crds);
+    PYFI_POSARG(Array<double>, time);
+    PYFI_POSARG(Array<int64_t>, outdim);
+    PYFI_POSARG(int64_t, effmtx);
+
+    PYFI_KWARG(int64_t, nseg, 0); // "off-resonance time segments, 0 for exact (default:0)"
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+
+    PYFI_SETOUTPUT_ALLOC(Array<complex<float> >, outdata, DA(*outdim));
+
+    if (do_dft(*image, *offres, *crds, *time, *outdata, *effmtx, *nseg, *nthreads))
+        PYFI_ERROR("griddat() has failed");
+
+    PYFI_END(); /* This must be the last line */
+} /* dftgrid_single */
+
 PYFI_FUNC(dft_grid)
 {
     PYFI_START(); /* This must be the first line */
@@ -79,17 +108,42 @@ PYFI_FUNC(dft_grid)
     PYFI_POSARG(int64_t, effmtx);
     PYFI_POSARG(Array<double>, wghts);
 
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+
     PYFI_SETOUTPUT_ALLOC(Array<complex<double> >, outdata, DA(*outdim));
 
     (*outdata) = complex<double>(0.,0.);
-    do_dft_grid(*data, *crds, *outdata, *effmtx, *wghts);
+    do_dft_grid(*data, *crds, *outdata, *effmtx, *wghts, *nthreads);
 
     PYFI_END(); /* This must be the last line */
-} /* dftgrid */
+} /* dft_grid */
+
+PYFI_FUNC(dft_grid_single)
+{
+    PYFI_START(); /* This must be the first line */
+
+    /* input */
+    PYFI_POSARG(Array<complex<float> >, data);
+    PYFI_POSARG(Array<double>, crds);
+    PYFI_POSARG(Array<int64_t>, outdim);
+    PYFI_POSARG(int64_t, effmtx);
+    PYFI_POSARG(Array<double>, wghts);
+
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+
+    PYFI_SETOUTPUT_ALLOC(Array<complex<float> >, outdata, DA(*outdim));
+
+    (*outdata) = complex<float>(0.,0.);
+    do_dft_grid(*data, *crds, *outdata, *effmtx, *wghts, *nthreads);
+
+    PYFI_END(); /* This must be the last line */
+} /* dft_grid_single */
 
 
 
 PYFI_LIST_START_
     PYFI_DESC(dftgrid, "DFT Gridding calculation")
+    PYFI_DESC(dftgrid_single, "DFT Gridding calculation, single precision")
     PYFI_DESC(dft_grid, "To Cartesian")
+    PYFI_DESC(dft_grid_single, "To Cartesian, single precision")
 PYFI_LIST_END_
@@ -35,73 +35,229 @@
 
 
 /*   DFT Gridding Module */
+// The DFTs are written for either precision (T = float or double).  The phase of
+// each sample is separable, exp(i(kx*x + ky*y)) = exp(i*kx*x)*exp(i*ky*y), so for
+// each sample a table of exp(i*kx*x) over x and one of exp(i*ky*y) over y are made
+// (in double precision) and combined by multiplication, rather than calling exp()
+// for every pixel.  Samples (or image columns) are shared out between threads.
+
+//========================================================================
+// PHASE TABLES
+//========================================================================
+
+// tab(i) = exp(sign*i*k*(i-n/2)), i = 0..n-1
+template<class T>
+void phasetable(vector<complex<T> > &tab, int n, double k, double sign)
+{
+  int i, i2;
+  i2 = n/2;
+  for (i=0;i<n;i++)
+    tab[i] = complex<T>(polar(1., sign*k*(double)(i-i2)));
+}
 
 //========================================================================
 // DO_DFT
 // To Non-Cartesian (Degrid) with off-resonance
 //========================================================================
+// Off-resonance is handled either exactly (nseg = 0), which needs an exp() per
+// pixel per sample, or by time segmentation (nseg >= 1): the image is phase
+// evolved by the off-resonance map to nseg evenly spaced times spanning the
+// sample times, and each sample is linearly interpolated between the DFTs of
+// the two segment images either side of it.  If there is no off-resonance the
+// image is transformed as it is.
+
+template<class T>
+struct dftjob {
+  Array<double> *offres;
+  Array<double> *crds;
+  Array<double> *time;
+  Array<double> *wghts;
+  double mtxnorm;
+  int nseg;              // 0: exact off-resonance, else the number of time segments
+  double tmin, dt;       // time of the first segment, and between segments
+  vector<complex<T> > seg; // segment images, one after the other
+};
 
-int do_dft(Array<complex<double> > &image, Array<double> &offres, Array<double> &crds, Array<double> &time, Array<complex<double> > &data, int64_t effmtx)
+template<class T>
+void do_dft_thread(int *num_threads, int *cur_thread, Array<complex<T> > &image,
+                   Array<complex<T> > &data, dftjob<T> *job)
 {
-  int i,j,k;
-  int i2, j2;
-  double kx,ky,xx,yy,t;
+  int64_t i, j, k, l, nx, ny, start, stop;
+  double kx, ky, t, a;
+  complex<T> s0, s1, sum0, sum1, v;
   complex<double> _I_ = complex<double>(0, -1);
-  double mtxnorm;
+  complex<T> *img0, *img1;
+
+  nx = image.size(0);
+  ny = image.size(1);
+  vector<complex<T> > ex(nx), ey(ny);
 
-  i2 = image.size(0)/2;
-  j2 = image.size(1)/2;
-  mtxnorm = 2.*M_PI*float(effmtx)/float(image.size(0));
-
-  for (k=0;k<data.size();k++) {
-    data(k) = 0.;
-    kx = crds(0,k)*mtxnorm;
-    ky = crds(1,k)*mtxnorm;
-    t = time(k)*2.*M_PI;
-    for (i=0;i<image.size(0);i++) {
-      xx = i-i2;
-      for (j=0;j<image.size(1);j++) {
-        yy = j-j2;
-        // data  = image      FT basis                 off-resonance term
-        data(k) += image(i,j)*exp(_I_*(kx*xx + ky*yy + offres(i,j)*t));
-    } } } // i j k
+  start = (*cur_thread * (int64_t)data.size()) / *num_threads;
+  stop = ((*cur_thread+1) * (int64_t)data.size()) / *num_threads;
+
+  for (k=start;k<stop;k++) {
+    kx = (*job->crds)(0,k)*job->mtxnorm;
+    ky = (*job->crds)(1,k)*job->mtxnorm;
+    phasetable(ex, nx, kx, -1.);
+    phasetable(ey, ny, ky, -1.);
+
+    // exact off-resonance
+    if (job->nseg == 0) {
+      t = (*job->time)(k)*2.*M_PI;
+      sum0 = 0.;
+      for (j=0;j<ny;j++) {
+        s0 = 0.;
+        for (i=0;i<nx;i++)
+          s0 += image(i,j)*ex[i]*complex<T>(exp(_I_*((*job->offres)(i,j)*t)));
+        sum0 += ey[j]*s0;
+        }
+      data(k) = sum0;
+      }
+
+    // no off-resonance, or a single segment
+    else if (job->nseg == 1) {
+      img0 = (job->seg.size() > 0) ? &job->seg[0] : image.data();
+      sum0 = 0.;
+      for (j=0;j<ny;j++) {
+        s0 = 0.;
+        for (i=0;i<nx;i++)
+          s0 += img0[i + nx*j]*ex[i];
+        sum0 += ey[j]*s0;
+        }
+      data(k) = sum0;
+      }
+
+    // interpolate between the two segments either side of the sample time
+    else {
+      a = ((*job->time)(k) - job->tmin)/job->dt;
+      l = min((int64_t)job->nseg-2, max((int64_t)0, (int64_t)floor(a)));
+      a -= l;
+      img0 = &job->seg[l*nx*ny];
+      img1 = &job->seg[(l+1)*nx*ny];
+      sum0 = 0.;
+      sum1 = 0.;
+      for (j=0;j<ny;j++) {
+        s0 = 0.;
+        s1 = 0.;
+        for (i=0;i<nx;i++) {
+          s0 += img0[i + nx*j]*ex[i];
+          s1 += img1[i + nx*j]*ex[i];
+          }
+        sum0 += ey[j]*s0;
+        sum1 += ey[j]*s1;
+        }
+      v = sum0*(T)(1.-a) + sum1*(T)a;
+      data(k) = v;
+      }
+    } // k
+}
+
+template<class T>
+int do_dft(Array<complex<T> > &image, Array<double> &offres, Array<double> &crds, Array<double> &time,
+           Array<complex<T> > &data, int64_t effmtx, int64_t nseg=0, int64_t nthreads=1)
+{
+  int64_t i, j, k, l, nx, ny;
+  int anyoffres;
+  double tmax;
+  complex<double> _I_ = complex<double>(0, -1);
+  dftjob<T> job;
+
+  nx = image.size(0);
+  ny = image.size(1);
+
+  job.offres = &offres;
+  job.crds = &crds;
+  job.time = &time;
+  job.wghts = NULL;
+  job.mtxnorm = 2.*M_PI*float(effmtx)/float(image.size(0));
+
+  anyoffres = 0;
+  for (i=0;i<(int64_t)offres.size();i++)
+    if (offres(i) != 0.) anyoffres = 1;
+
+  if (!anyoffres)
+    job.nseg = 1; // no segment images, transform the image itself
+  else if (nseg <= 0)
+    job.nseg = 0;
+  else {
+    job.nseg = nseg;
+    job.tmin = time(0);
+    tmax = time(0);
+    for (k=0;k<(int64_t)time.size();k++) {
+      job.tmin = min(job.tmin, time(k));
+      tmax = max(tmax, time(k));
+      }
+    if (nseg == 1 || tmax == job.tmin) {
+      job.nseg = 1;
+      job.tmin = 0.5*(job.tmin+tmax);
+      }
+    job.dt = (job.nseg > 1) ? (tmax-job.tmin)/(job.nseg-1) : 1.;
+
+    // image phase evolved to each segment time
+    job.seg.resize(job.nseg*nx*ny);
+    for (l=0;l<job.nseg;l++)
+      for (j=0;j<ny;j++)
+        for (i=0;i<nx;i++)
+          job.seg[(l*ny + j)*nx + i] = image(i,j)*
+            complex<T>(exp(_I_*(offres(i,j)*2.*M_PI*(job.tmin + l*job.dt))));
+    }
+
+  nthreads = max((int64_t)1, min(nthreads, (int64_t)data.size()));
+  create_threads3 (nthreads, do_dft_thread<T>, &image, &data, &job);
 
   return (0);
 }
 
 
 /* To Cartesian (Grid)
+ * Each thread makes its own share of the image columns (y), from every sample.
  */
-void do_dft_grid(Array<complex<double> > &data, Array<double> &crds, Array<complex<double> > &image, int64_t effmtx, Array<double> &wghts)
+template<class T>
+void do_dft_grid_thread(int *num_threads, int *cur_thread, Array<complex<T> > &data,
+                        Array<complex<T> > &image, dftjob<T> *job)
 {
-    int i,j,k;
-    int i2, j2;
-    double kx,ky,xx,yy;
-    complex<double> _I_ = complex<double>(0, 1);
-    double mtxnorm;
+    int64_t i, j, k, nx, ny, jstart, jstop;
+    double kx, ky;
+    complex<T> v, vy;
 
-    i2 = image.size(0)/2;
-    j2 = image.size(1)/2;
-    mtxnorm = 2.*M_PI*float(effmtx)/float(image.size(0));
+    nx = image.size(0);
+    ny = image.size(1);
+    vector<complex<T> > ex(nx), ey(ny);
 
-    for (i=0;i<image.size(0);i++) 
-    {
-        xx = i-i2;
-        for (j=0;j<image.size(1);j++) 
-        {
-            yy = j-j2;
-            for (k=0;k<data.size();k++) 
-            {
+    jstart = (*cur_thread * ny) / *num_threads;
+    jstop = ((*cur_thread+1) * ny) / *num_threads;
 
-                kx = crds(0,k)*mtxnorm;
-                ky = crds(1,k)*mtxnorm;
+    for (k=0;k<(int64_t)data.size();k++)
+    {
+        kx = (*job->crds)(0,k)*job->mtxnorm;
+        ky = (*job->crds)(1,k)*job->mtxnorm;
+        phasetable(ex, nx, kx, 1.);
+        phasetable(ey, ny, ky, 1.);
 
-                get2(image,i,j) += get1(data,k)*get1(wghts,k)*exp(_I_*(kx*xx + ky*yy));
-            }
+        v = get1(data,k)*(T)get1(*job->wghts,k);
+        for (j=jstart;j<jstop;j++)
+        {
+            vy = v*ey[j];
+            for (i=0;i<nx;i++)
+                get2(image,i,j) += vy*ex[i];
         }
     }
+}
+
+template<class T>
+void do_dft_grid(Array<complex<T> > &data, Array<double> &crds, Array<complex<T> > &image, int64_t effmtx,
+                 Array<double> &wghts, int64_t nthreads=1)
+{
+    dftjob<T> job;
+
+    job.crds = &crds;
+    job.wghts = &wghts;
+    job.mtxnorm = 2.*M_PI*float(effmtx)/float(image.size(0));
+
+    nthreads = max((int64_t)1, min(nthreads, (int64_t)image.size(1)));
+    create_threads3 (nthreads, do_dft_grid_thread<T>, &data, &image, &job);
 
-    complex<double> scale = 1.0/image.size();
+    complex<T> scale = (T)1.0/(T)image.size();
     image *= scale;
 
 }
@@ -36,39 +36,104 @@
 
 /*   Standard Gridding Module */
 #define KERNSIZE 250
+#define KERNRAD 2.5
+
+// Gridding kernels
+#define GRIDKERN_HANNGAUSS 0
+#define GRIDKERN_KAISERBESSEL 1
 
 //========================================================================
-// GRIDDAT
+// GRIDKERNEL
 //========================================================================
+// The kernel is tabulated from its center out to its radius, with 100 table
+// points per grid point, so a table of 100*radius+1 points.  The gridding
+// routines take the radius from the size of the table.
 
-int griddat(Array<float> &crds, Array<complex<float> > &data, Array<float> &wates, Array<complex<float> > &outdata,
-            double dx, double dy, double dz)
+// Number of table points (less one) for a kernel width in grid points
+int kernsize(double width)
 {
-  int i,j,k,d;
-  int mtx0, mtx1, mtx2;
-  float fmtx0, fmtx1, fmtx2, fi,fj,fk;
-  int di,dj,dk;
-  int mini,maxi,minj,maxj,mink,maxk;
-  int dj0, dk0;
+  return ((int)(50.*width + 0.5));
+}
+
+// Kernel radius in grid points
+double kernrad(Array<float> &kernel)
+{
+  return ((double)(kernel.size()-1)/100.);
+}
+
+// Modified Bessel function of the first kind, order 0, by its power series
+double bessi0(double x)
+{
+  int k;
+  double term, sum, q;
+
+  q = 0.25*x*x;
+  term = 1.;
+  sum = 1.;
+  for (k=1;k<1000;k++) {
+    term *= q/((double)k*(double)k);
+    sum += term;
+    if (term < 1e-17*sum) break;
+    }
+  return (sum);
+}
+
+// Fill the kernel table.  The width of the kernel is set by the table size,
+// and the oversampling factor (osf) sets the shape of the Kaiser-Bessel kernel.
+void gridkernel(Array<float> &kernel, int64_t kerntype, double osf)
+{
+  int i, size;
   float x;
-  complex<float> theta;
-  complex<float> val0,val1,val2;
-  complex<float> eye = sqrt( complex<float>(-1) ) ; // there must be a better way?
+  double width, beta;
 
-  Array<float> kernel(KERNSIZE+1);
+  size = kernel.size()-1;
 
 ////////////
 // KERNEL //
 ////////////
+  if (kerntype == GRIDKERN_KAISERBESSEL) {
+// Kaiser-Bessel kernel, with the shape parameter of
+//   Beatty et al., IEEE TMI 24(6):799-808, 2005
+// which keeps the aliasing error low down to oversampling factors of about 1.25
+    width = 2.*kernrad(kernel);
+    beta = (width/osf)*(width/osf)*(osf-0.5)*(osf-0.5) - 0.8;
+    beta = (beta > 0) ? M_PI*sqrt(beta) : 0.;
+    for (i=0;i<=size;i++) {
+      x = (float)(i)/(float)(size); // goes from 0 to 1
+      kernel(i) = bessi0(beta*sqrt(max(0.,1.-(double)x*x)))/bessi0(beta);
+      }
+    }
+  else {
 // Create separable kernel, which has a radius-FOV product of 3.33
 // With an oversampling factor of 1.5, want the FOV to be 1.33, thus a radius of 2.5
 // We will make the kernel 250 points to make this easy calculatin'
 // The kernel is a full Hanning window times exp(-6 x^2)
 //   which is almost certainly not optimal but a lot easier to generate than a kaiser-bessel function
-  for (i=0;i<KERNSIZE;i++) {
-    x = (float)(i)/(float)(KERNSIZE); // goes from 0 to 1
-    kernel(i) = 0.5*(1.+cos(M_PI*x))*exp(-6.*x*x);
+// The last point (x = 1) is zero, and is filled in as well since |di| can reach KERNSIZE
+    for (i=0;i<=size;i++) {
+      x = (float)(i)/(float)(size); // goes from 0 to 1
+      kernel(i) = 0.5*(1.+cos(M_PI*x))*exp(-6.*x*x);
+      }
     }
+}
+
+//========================================================================
+// GRIDDAT
+//========================================================================
+
+int griddat(Array<float> &crds, Array<complex<float> > &data, Array<float> &wates, Array<complex<float> > &outdata,
+            Array<float> &kernel, double dx, double dy, double dz)
+{
+  int i,j,k,d;
+  int mtx0, mtx1, mtx2;
+  float fmtx0, fmtx1, fmtx2, fi,fj,fk;
+  int di,dj,dk;
+  int mini,maxi,minj,maxj,mink,maxk;
+  int dj0, dk0;
+  complex<float> theta;
+  complex<float> val0,val1,val2;
+  complex<float> eye = sqrt( complex<float>(-1) ) ; // there must be a better way?
+  double rad = kernrad(kernel);
 
 //////////////////
 // FLATTEN DATA //
@@ -96,8 +161,8 @@ int griddat(Array<float> &crds, Array<complex<float> > &data, Array<float> &wate
         else
           val0 = data(d)*wates(d)*exp(eye*theta);
         fi = (0.5+crds(0,d))*fmtx0;
-        mini = max(0,int(fi-2.5)+1);
-        maxi = min(mtx0-1,int(fi+2.5));
+        mini = max(0,int(fi-rad)+1);
+        maxi = min(mtx0-1,int(fi+rad));
         di = (floor)((100.*((float)(mini) - fi)) + 0.5);
         for (i=mini;i<=maxi;i++) {
           outdata(i) += kernel(abs(di))*val0;
@@ -128,10 +193,10 @@ int griddat(Array<float> &crds, Array<complex<float> > &data, Array<float> &wate
           val0 = data(d)*wates(d)*exp(eye*theta);
         fi = (0.5+crds(0,d))*fmtx0;
         fj = (0.5+crds(1,d))*fmtx1;
-        mini = max(0,int(fi-2.5)+1);
-        maxi = min(mtx0-1,int(fi+2.5));
-        minj = max(0,int(fj-2.5)+1);
-        maxj = min(mtx1-1,int(fj+2.5));
+        mini = max(0,int(fi-rad)+1);
+        maxi = min(mtx0-1,int(fi+rad));
+        minj = max(0,int(fj-rad)+1);
+        maxj = min(mtx1-1,int(fj+rad));
         di = (floor)((100.*((float)(mini) - fi)) + 0.5);
         // We are adding 100 to dj each step because the kernel size is 100 times the grid size
         dj0 = (floor)((100.*((float)(minj) - fj)) + 0.5);
@@ -172,12 +237,12 @@ int griddat(Array<float> &crds, Array<complex<float> > &data, Array<float> &wate
         fi = (0.5+crds(0,d))*fmtx0;
         fj = (0.5+crds(1,d))*fmtx1;
         fk = (0.5+crds(2,d))*fmtx2;
-        mini = max(0,int(fi-2.5)+1);
-        maxi = min(mtx0-1,int(fi+2.5));
-        minj = max(0,int(fj-2.5)+1);
-        maxj = min(mtx1-1,int(fj+2.5));
-        mink = max(0,int(fk-2.5)+1);
-        maxk = min(mtx2-1,int(fk+2.5));
+        mini = max(0,int(fi-rad)+1);
+        maxi = min(mtx0-1,int(fi+rad));
+        minj = max(0,int(fj-rad)+1);
+        maxj = min(mtx1-1,int(fj+rad));
+        mink = max(0,int(fk-rad)+1);
+        maxk = min(mtx2-1,int(fk+rad));
         di = (floor)((100.*((float)(mini) - fi)) + 0.5);
         // We are adding 100 to dj, dk each step because the kernel size is 100 times the grid size
         dj0 = (floor)((100.*((float)(minj) - fj)) + 0.5);
@@ -203,36 +268,632 @@ int griddat(Array<float> &crds, Array<complex<float> > &data, Array<float> &wate
    return (0);
 }
 
+//========================================================================
+// GRIDDAT_THREADED
+//========================================================================
+// Same result as griddat(), computed on several threads.
+// The output is split into slabs (tiles) along its last, i.e. slowest, dimension
+// and every sample is binned up front into each tile its kernel footprint overlaps.
+// Each thread then grids whole tiles, clipping the footprint to the tile, so no two
+// threads ever write the same output point and no locking is needed.  Samples are kept
+// in their original order within a tile, so every output point is summed in the same
+// order (and with the same arithmetic) as the serial griddat().
+
+struct gridtiles {
+  Array<float> *crds;
+  Array<complex<float> > *data;
+  Array<float> *wates;
+  double dx, dy, dz;
+  double rad;
+  int64_t ntiles;
+  vector<int> tilestart; // first index of each tile in the last dim, plus the end
+  vector<vector<int64_t> > bins; // samples that touch each tile
+};
+
+// Grid sample d into outdata, only touching indices lo..hi of the last dimension
+void gridsample(Array<float> &crds, Array<complex<float> > &data, Array<float> &wates,
+                Array<complex<float> > &outdata, Array<float> &kernel,
+                double rad, double dx, double dy, double dz, int64_t d, int lo, int hi)
+{
+  int i,j,k;
+  int mtx0, mtx1, mtx2;
+  float fmtx0, fmtx1, fmtx2, fi,fj,fk;
+  int di,dj,dk;
+  int mini,maxi,minj,maxj,mink,maxk;
+  int dj0, dk0;
+  complex<float> theta;
+  complex<float> val0,val1,val2;
+  complex<float> eye = sqrt( complex<float>(-1) ) ;
+
+  if (crds.size(0) == 1) {
+    mtx0 = outdata.size(0);
+    fmtx0 = outdata.size(0) & ~1;
+    theta = -2.*M_PI*crds(0,d)*dx;
+    if (abs(theta) == 0)
+      val0 = data(d)*wates(d);
+    else
+      val0 = data(d)*wates(d)*exp(eye*theta);
+    fi = (0.5+crds(0,d))*fmtx0;
+    mini = max(0,int(fi-rad)+1);
+    maxi = min(mtx0-1,int(fi+rad));
+    di = (floor)((100.*((float)(mini) - fi)) + 0.5);
+    // clip to this tile, stepping the kernel index as the serial loop would
+    if (mini < lo) {
+      di += 100*(lo-mini);
+      mini = lo;
+      }
+    maxi = min(maxi,hi);
+    for (i=mini;i<=maxi;i++) {
+      outdata(i) += kernel(abs(di))*val0;
+      di += 100;
+      } // i
+    } // crds.size == 1
+
+  else if (crds.size(0) == 2) {
+    mtx0 = outdata.size(0);
+    mtx1 = outdata.size(1);
+    fmtx0 = outdata.size(0) & ~1;
+    fmtx1 = outdata.size(1) & ~1;
+    theta = -2.*M_PI*(crds(0,d)*dx + crds(1,d)*dy);
+    if (abs(theta) == 0)
+      val0 = data(d)*wates(d);
+    else
+      val0 = data(d)*wates(d)*exp(eye*theta);
+    fi = (0.5+crds(0,d))*fmtx0;
+    fj = (0.5+crds(1,d))*fmtx1;
+    mini = max(0,int(fi-rad)+1);
+    maxi = min(mtx0-1,int(fi+rad));
+    minj = max(0,int(fj-rad)+1);
+    maxj = min(mtx1-1,int(fj+rad));
+    di = (floor)((100.*((float)(mini) - fi)) + 0.5);
+    dj0 = (floor)((100.*((float)(minj) - fj)) + 0.5);
+    if (minj < lo) {
+      dj0 += 100*(lo-minj);
+      minj = lo;
+      }
+    maxj = min(maxj,hi);
+    for (i=mini;i<=maxi;i++) {
+      val1 = kernel(abs(di))*val0;
+      dj = dj0;
+      for (j=minj;j<=maxj;j++) {
+        outdata(i,j) += kernel(abs(dj))*val1;
+        dj += 100;
+        } // j
+      di += 100;
+      } // i
+    } // crds.size == 2
+
+  else if (crds.size(0) == 3) {
+    mtx0 = outdata.size(0);
+    mtx1 = outdata.size(1);
+    mtx2 = outdata.size(2);
+    fmtx0 = outdata.size(0) & ~1;
+    fmtx1 = outdata.size(1) & ~1;
+    fmtx2 = outdata.size(2) & ~1;
+    theta = -2.*M_PI*(crds(0,d)*dx + crds(1,d)*dy + crds(2,d)*dz);
+    if (abs(theta) == 0)
+      val0 = data(d)*wates(d);
+    else
+      val0 = data(d)*wates(d)*exp(eye*theta);
+    fi = (0.5+crds(0,d))*fmtx0;
+    fj = (0.5+crds(1,d))*fmtx1;
+    fk = (0.5+crds(2,d))*fmtx2;
+    mini = max(0,int(fi-rad)+1);
+    maxi = min(mtx0-1,int(fi+rad));
+    minj = max(0,int(fj-rad)+1);
+    maxj = min(mtx1-1,int(fj+rad));
+    mink = max(0,int(fk-rad)+1);
+    maxk = min(mtx2-1,int(fk+rad));
+    di = (floor)((100.*((float)(mini) - fi)) + 0.5);
+    dj0 = (floor)((100.*((float)(minj) - fj)) + 0.5);
+    dk0 = (floor)((100.*((float)(mink) - fk)) + 0.5);
+    if (mink < lo) {
+      dk0 += 100*(lo-mink);
+      mink = lo;
+      }
+    maxk = min(maxk,hi);
+    for (i=mini;i<=maxi;i++) {
+      val1 = kernel(abs(di))*val0;
+      dj = dj0;
+      for (j=minj;j<=maxj;j++) {
+        val2 = kernel(abs(dj))*val1;
+        dk = dk0;
+        for (k=mink;k<=maxk;k++) {
+          outdata(i,j,k) += kernel(abs(dk))*val2;
+          dk += 100;
+          } // k
+        dj += 100;
+        } // j
+      di += 100;
+      } // i j
+    } // crds.size == 3
+}
+
+void griddat_thread(int *num_threads, int *cur_thread, Array<complex<float> > &outdata,
+                    Array<float> &kernel, gridtiles *gt)
+{
+  int64_t t;
+  uint64_t n;
+
+  // tiles are dealt out round-robin, which evens out the dense center of k-space
+  for (t = *cur_thread; t < gt->ntiles; t += *num_threads) {
+    vector<int64_t> &bin = gt->bins[t];
+    for (n = 0; n < bin.size(); n++)
+      gridsample(*gt->crds, *gt->data, *gt->wates, outdata, kernel,
+                 gt->rad, gt->dx, gt->dy, gt->dz, bin[n], gt->tilestart[t], gt->tilestart[t+1]-1);
+    }
+}
+
+int griddat_threaded(Array<float> &crds, Array<complex<float> > &data, Array<float> &wates,
+                     Array<complex<float> > &outdata, Array<float> &kernel,
+                     double dx, double dy, double dz, int64_t nthreads)
+{
+  int64_t d, t, ndim, mtxl;
+  float fmtxl, fl;
+  int inbounds, a, lo, hi;
+  int threads;
+  gridtiles gt;
+
+  gt.rad = kernrad(kernel);
+
+  ndim = crds.size(0);
+  if (ndim < 1 || ndim > 3)
+    return (1);
+
+  outdata = complex<float> (0.);
+
+/////////////////////////
+// SPLIT OUTPUT INTO TILES
+/////////////////////////
+// A few tiles per thread, but never thinner than the kernel diameter
+  mtxl = outdata.size(ndim-1);
+  fmtxl = outdata.size(ndim-1) & ~1;
+  gt.ntiles = min(4*nthreads, max((int64_t)1, mtxl/(2*(int64_t)gt.rad+1)));
+  gt.tilestart.resize(gt.ntiles+1);
+  for (t = 0; t <= gt.ntiles; t++)
+    gt.tilestart[t] = (t*mtxl)/gt.ntiles;
+
+  vector<int64_t> rowtile(mtxl);
+  for (t = 0; t < gt.ntiles; t++)
+    for (lo = gt.tilestart[t]; lo < gt.tilestart[t+1]; lo++)
+      rowtile[lo] = t;
+
+//////////////////
+// BIN SAMPLES  //
+//////////////////
+  gt.bins.resize(gt.ntiles);
+  for (d = 0; d < data.size(); d++) {
+    inbounds = 1;
+    for (a = 0; a < ndim; a++)
+      if ((crds(a,d) < -0.5) || (crds(a,d) > 0.5))
+        inbounds = 0;
+    if (!inbounds) continue; // only grid if crds inbounds
+
+    fl = (0.5+crds(ndim-1,d))*fmtxl;
+    lo = max(0,int(fl-gt.rad)+1);
+    hi = min((int)mtxl-1,int(fl+gt.rad));
+    if (lo > hi) continue;
+    for (t = rowtile[lo]; t <= rowtile[hi]; t++)
+      gt.bins[t].push_back(d);
+    } // d
+
+  gt.crds = &crds;
+  gt.data = &data;
+  gt.wates = &wates;
+  gt.dx = dx;
+  gt.dy = dy;
+  gt.dz = dz;
+
+  threads = min(nthreads, gt.ntiles);
+  create_threads3 (threads, griddat_thread, &outdata, &kernel, &gt);
+
+  return (0);
+}
+
+//========================================================================
+// GRIDDAT_BATCH
+//========================================================================
+// Grid several sets of data in one call, e.g. all the coils of a scan that
+// share one trajectory.
+//   crds(ndim, npts, ncsets), data(npts, ncsets, ndsets), wates(npts, ncsets)
+//   outdata(mtx0, [mtx1, [mtx2,]] ncsets, ndsets)
+// The kernel footprint of every sample (window, kernel offsets, phase shift)
+// only depends on the coordinates, so it is worked out once per coordinate set
+// and reused for every data set.  Each gridded image is then made by exactly
+// one thread, in the same order and with the same arithmetic as griddat().
+
+struct gridfoot {
+  int lo[3], hi[3];    // gridding window in each dim, hi[0] < lo[0] if out of bounds
+  int dk[3];           // kernel index at the start of the window
+  float wate;
+  complex<float> shift; // off-center FOV phase, 1 if none
+};
+
+struct gridbatch {
+  Array<float> *crds;
+  Array<complex<float> > *data;
+  Array<float> *wates;
+  double dx, dy, dz;
+  double rad;
+  int64_t ndim, npts, ncsets, ndsets;
+  int mtx[3];
+  vector<gridfoot> foot;
+};
+
+// Work out the gridding window, kernel offsets and phase shift of one sample
+// at coordinates c[0..ndim-1], with the same arithmetic as griddat()
+void gridfootprint(float *c, int64_t ndim, int *mtx, double rad, double dx, double dy, double dz,
+                   gridfoot &gf)
+{
+  int64_t a;
+  float fmtx, f;
+  double theta;
+  complex<float> eye = sqrt( complex<float>(-1) ) ;
+  complex<float> ctheta;
+
+  for (a = 0; a < ndim; a++)
+    if ((c[a] < -0.5) || (c[a] > 0.5)) { // only grid if crds inbounds
+      gf.lo[0] = 1;
+      gf.hi[0] = 0;
+      return;
+      }
+
+  if (ndim == 1)
+    ctheta = -2.*M_PI*c[0]*dx;
+  else if (ndim == 2)
+    ctheta = -2.*M_PI*(c[0]*dx + c[1]*dy);
+  else
+    ctheta = -2.*M_PI*(c[0]*dx + c[1]*dy + c[2]*dz);
+  theta = real(ctheta);
+  gf.shift = (theta == 0) ? complex<float> (1.) : exp(eye*ctheta);
+
+  for (a = 0; a < ndim; a++) {
+    fmtx = mtx[a] & ~1; // round down to nearest even integer
+    f = (0.5+c[a])*fmtx;
+    gf.lo[a] = max(0,int(f-rad)+1);
+    gf.hi[a] = min(mtx[a]-1,int(f+rad));
+    gf.dk[a] = (floor)((100.*((float)(gf.lo[a]) - f)) + 0.5);
+    }
+}
+
+// Fill in the footprints for a share of all ncsets*npts samples
+void gridfoot_thread(int *num_threads, int *cur_thread, Array<complex<float> > &outdata,
+                     Array<float> &kernel, gridbatch *gb)
+{
+  int64_t n, nfoot, start, stop;
+  float *crds = gb->crds->data();
+  float *wates = gb->wates->data();
+
+  nfoot = gb->npts*gb->ncsets;
+  start = (*cur_thread * nfoot) / *num_threads;
+  stop = ((*cur_thread+1) * nfoot) / *num_threads;
+
+  for (n = start; n < stop; n++) {
+    gridfootprint(crds + n*gb->ndim, gb->ndim, gb->mtx, gb->rad, gb->dx, gb->dy, gb->dz, gb->foot[n]);
+    gb->foot[n].wate = wates[n];
+    } // n
+}
+
+// Grid whole images, dealt out round-robin over (ncsets x ndsets)
+void gridbatch_thread(int *num_threads, int *cur_thread, Array<complex<float> > &outdata,
+                      Array<float> &kernel, gridbatch *gb)
+{
+  int64_t img, s, d, imgsize;
+  int i,j,k,di,dj,dk;
+  int64_t oj, ok;
+  complex<float> val0,val1,val2;
+  complex<float> *data, *out;
+  gridfoot *gf;
+
+  imgsize = (int64_t)gb->mtx[0]*gb->mtx[1]*gb->mtx[2];
+
+  for (img = *cur_thread; img < gb->ncsets*gb->ndsets; img += *num_threads) {
+    s = img % gb->ncsets;
+    data = gb->data->data() + img*gb->npts;
+    out = outdata.data() + img*imgsize;
+    gf = &gb->foot[s*gb->npts];
+
+    for (d = 0; d < gb->npts; d++, gf++) {
+      if (gf->hi[0] < gf->lo[0]) continue;
+      val0 = data[d]*gf->wate;
+      if (gf->shift != complex<float> (1.))
+        val0 = val0*gf->shift;
+
+      if (gb->ndim == 1) {
+        di = gf->dk[0];
+        for (i=gf->lo[0];i<=gf->hi[0];i++) {
+          out[i] += kernel(abs(di))*val0;
+          di += 100;
+          } // i
+        }
+
+      else if (gb->ndim == 2) {
+        di = gf->dk[0];
+        for (i=gf->lo[0];i<=gf->hi[0];i++) {
+          val1 = kernel(abs(di))*val0;
+          dj = gf->dk[1];
+          for (j=gf->lo[1];j<=gf->hi[1];j++) {
+            out[i + (int64_t)gb->mtx[0]*j] += kernel(abs(dj))*val1;
+            dj += 100;
+            } // j
+          di += 100;
+          } // i
+        }
+
+      else {
+        di = gf->dk[0];
+        for (i=gf->lo[0];i<=gf->hi[0];i++) {
+          val1 = kernel(abs(di))*val0;
+          dj = gf->dk[1];
+          for (j=gf->lo[1];j<=gf->hi[1];j++) {
+            val2 = kernel(abs(dj))*val1;
+            oj = i + (int64_t)gb->mtx[0]*j;
+            dk = gf->dk[2];
+            for (k=gf->lo[2];k<=gf->hi[2];k++) {
+              ok = oj + (int64_t)gb->mtx[0]*gb->mtx[1]*k;
+              out[ok] += kernel(abs(dk))*val2;
+              dk += 100;
+              } // k
+            dj += 100;
+            } // j
+          di += 100;
+          } // i
+        }
+      } // d
+    } // img
+}
+
+int griddat_batch(Array<float> &crds, Array<complex<float> > &data, Array<float> &wates,
+                  Array<complex<float> > &outdata, Array<float> &kernel,
+                  double dx, double dy, double dz, int64_t nthreads)
+{
+  int64_t a, threads;
+  gridbatch gb;
+
+  gb.rad = kernrad(kernel);
+
+  gb.ndim = crds.size(0);
+  if (gb.ndim < 1 || gb.ndim > 3)
+    return (1);
+  gb.npts = crds.size(1);
+  gb.ncsets = crds.size(2);
+  gb.ndsets = data.size()/(gb.npts*gb.ncsets);
+  if (gb.npts*gb.ncsets*gb.ndsets != (int64_t)data.size() ||
+      gb.npts*gb.ncsets != (int64_t)wates.size())
+    return (1);
+  for (a = 0; a < 3; a++)
+    gb.mtx[a] = (a < gb.ndim) ? outdata.size(a) : 1;
+
+  gb.crds = &crds;
+  gb.data = &data;
+  gb.wates = &wates;
+  gb.dx = dx;
+  gb.dy = dy;
+  gb.dz = dz;
+  gb.foot.resize(gb.npts*gb.ncsets);
+
+  outdata = complex<float> (0.);
+
+  threads = max((int64_t)1, nthreads);
+  create_threads3 (threads, gridfoot_thread, &outdata, &kernel, &gb);
+
+  threads = max((int64_t)1, min(nthreads, gb.ncsets*gb.ndsets));
+  create_threads3 (threads, gridbatch_thread, &outdata, &kernel, &gb);
+
+  return (0);
+}
+
+//========================================================================
+// DEGRIDDAT
+//========================================================================
+// Inverse gridding: resample gridded k-space at the coordinates, using the
+// same kernel, windows and off-center shift as griddat().  This is the exact
+// adjoint of griddat() with unit weights, i.e. each sample collects
+//   exp(-i theta) * sum_ijk kernel_i kernel_j kernel_k * data(i,j,k)
+// from the grid points griddat() would have spread it onto.
+//   crds(ndim, npts, ncsets), data(mtx0, [mtx1, [mtx2,]] ncsets, ndsets)
+//   outdata(npts, ncsets, ndsets)
+// Samples are shared out between threads; the footprint of each sample is
+// worked out once and used for all of its data sets.  Out of bounds samples
+// are set to zero.
+
+void degriddat_thread(int *num_threads, int *cur_thread, Array<complex<float> > &outdata,
+                      Array<float> &kernel, gridbatch *gb)
+{
+  int64_t n, nfoot, start, stop, s, d, c, imgsize;
+  int i,j,k,di,dj,dk;
+  int64_t oj, ok;
+  complex<float> sum0,sum1,sum2;
+  complex<float> *grid, *out;
+  float *crds = gb->crds->data();
+  gridfoot gf;
+
+  imgsize = (int64_t)gb->mtx[0]*gb->mtx[1]*gb->mtx[2];
+  nfoot = gb->npts*gb->ncsets;
+  start = (*cur_thread * nfoot) / *num_threads;
+  stop = ((*cur_thread+1) * nfoot) / *num_threads;
+
+  for (n = start; n < stop; n++) {
+    s = n / gb->npts;
+    d = n % gb->npts;
+    gridfootprint(crds + n*gb->ndim, gb->ndim, gb->mtx, gb->rad, gb->dx, gb->dy, gb->dz, gf);
+
+    for (c = 0; c < gb->ndsets; c++) {
+      out = outdata.data() + (c*gb->ncsets + s)*gb->npts + d;
+      if (gf.hi[0] < gf.lo[0]) {
+        *out = complex<float> (0.);
+        continue;
+        }
+      grid = gb->data->data() + (c*gb->ncsets + s)*imgsize;
+
+      sum0 = complex<float> (0.);
+      if (gb->ndim == 1) {
+        di = gf.dk[0];
+        for (i=gf.lo[0];i<=gf.hi[0];i++) {
+          sum0 += kernel(abs(di))*grid[i];
+          di += 100;
+          } // i
+        }
+
+      else if (gb->ndim == 2) {
+        di = gf.dk[0];
+        for (i=gf.lo[0];i<=gf.hi[0];i++) {
+          sum1 = complex<float> (0.);
+          dj = gf.dk[1];
+          for (j=gf.lo[1];j<=gf.hi[1];j++) {
+            sum1 += kernel(abs(dj))*grid[i + (int64_t)gb->mtx[0]*j];
+            dj += 100;
+            } // j
+          sum0 += kernel(abs(di))*sum1;
+          di += 100;
+          } // i
+        }
+
+      else {
+        di = gf.dk[0];
+        for (i=gf.lo[0];i<=gf.hi[0];i++) {
+          sum1 = complex<float> (0.);
+          dj = gf.dk[1];
+          for (j=gf.lo[1];j<=gf.hi[1];j++) {
+            sum2 = complex<float> (0.);
+            oj = i + (int64_t)gb->mtx[0]*j;
+            dk = gf.dk[2];
+            for (k=gf.lo[2];k<=gf.hi[2];k++) {
+              ok = oj + (int64_t)gb->mtx[0]*gb->mtx[1]*k;
+              sum2 += kernel(abs(dk))*grid[ok];
+              dk += 100;
+              } // k
+            sum1 += kernel(abs(dj))*sum2;
+            dj += 100;
+            } // j
+          sum0 += kernel(abs(di))*sum1;
+          di += 100;
+          } // i
+        }
+
+      *out = sum0*conj(gf.shift);
+      } // c
+    } // n
+}
+
+int degriddat(Array<float> &crds, Array<complex<float> > &data, Array<complex<float> > &outdata,
+              Array<float> &kernel, double dx, double dy, double dz, int64_t nthreads)
+{
+  int64_t a, threads;
+  gridbatch gb;
+
+  gb.rad = kernrad(kernel);
+
+  gb.ndim = crds.size(0);
+  if (gb.ndim < 1 || gb.ndim > 3)
+    return (1);
+  gb.npts = crds.size(1);
+  gb.ncsets = crds.size(2);
+  gb.ndsets = outdata.size()/(gb.npts*gb.ncsets);
+  for (a = 0; a < 3; a++)
+    gb.mtx[a] = (a < gb.ndim) ? data.size(a) : 1;
+  if (gb.npts*gb.ncsets*gb.ndsets != (int64_t)outdata.size() ||
+      (int64_t)gb.mtx[0]*gb.mtx[1]*gb.mtx[2]*gb.ncsets*gb.ndsets != (int64_t)data.size())
+    return (1);
+
+  gb.crds = &crds;
+  gb.data = &data;
+  gb.wates = NULL;
+  gb.dx = dx;
+  gb.dy = dy;
+  gb.dz = dz;
+
+  threads = max((int64_t)1, min(nthreads, gb.npts*gb.ncsets));
+  create_threads3 (threads, degriddat_thread, &outdata, &kernel, &gb);
+
+  return (0);
+}
+
 //========================================================================
 // ROLLOFFDAT
 //========================================================================
 
-int rolloffdat(Array<complex<float> > &data, Array<complex<float> > &outdata, int64_t isofov)
+// FFTW's planner is shared by every module loaded in the process and is not
+// thread safe, while the GPI_THREAD nodes (FFTW, Rolloff, NUFFT Adjoint, ...)
+// can plan at the same time; this makes all planning serialized (FFTW 3.3.5+).
+static pthread_once_t grid_fft_once = PTHREAD_ONCE_INIT;
+
+static void grid_fft_threadsafe_init()
+{
+  fftw_make_planner_thread_safe();
+  fftwf_make_planner_thread_safe();
+}
+
+// call before planning any transform here
+void grid_fft_threadsafe()
 {
-  int i, i0, i1, i2;
+  pthread_once(&grid_fft_once, grid_fft_threadsafe_init);
+}
+
+// Correction (deapodization) for one dimension, of size dmtx gridded and
+// omtx after cropping, i.e. one over the Fourier transform of the kernel.
+void rolloffcor(Array<float> &kernel, int64_t kerntype, int dmtx, int omtx,
+                Array<complex<float> > &cor)
+{
+  int i, i0, n, di, kernwidth, size;
+  double x, ft0, ft;
+
+  di = (dmtx - omtx + 1)/2;
+
+  if (kerntype == GRIDKERN_HANNGAUSS) {
+// Transform of the kernel sampled at the grid points
+    Array<complex<float> > ro(dmtx);
+    kernwidth = (kernel.size()-1)/100;
+
+    for (i=0;i<dmtx;i++)
+      ro(i) = 0.;
+    for (i = -kernwidth; i <= kernwidth; i++) {
+      i0 = (dmtx/2) + i;
+      if (i0 > 0 && i0 < dmtx)
+        ro(i0) = kernel(abs(100*i));
+      }
+
+    //R2UTILS::Cfft1(ro0,ro0,FFTW_BACKWARD);
+    //ro0 = Numpy::fft1(ro0, FFT_NUMPY_BACKWARD);
+    grid_fft_threadsafe();
+    FFTW::fft1(ro, ro, FFTW_BACKWARD);
+
+    for (i=0;i<omtx;i++) {
+      if (ro(i+di).real() > 0)
+        cor(i) = ro(dmtx/2).real()/ro(i+di).real();
+      else
+        cor(i) = 0.;
+      }
+    }
+  else {
+// Continuous transform of the kernel, integrated over its table (100 points per grid point),
+// which is what a low oversampling factor needs to be accurate out to the edge of the FOV
+    size = kernel.size()-1;
+    ft0 = kernel(0);
+    for (n=1;n<=size;n++)
+      ft0 += 2.*kernel(n);
+    for (i=0;i<omtx;i++) {
+      x = (double)(i + di - dmtx/2)/(100.*(double)dmtx);
+      ft = kernel(0);
+      for (n=1;n<=size;n++)
+        ft += 2.*kernel(n)*cos(2.*M_PI*x*n);
+      if (ft > 0)
+        cor(i) = ft0/ft;
+      else
+        cor(i) = 0.;
+      }
+    }
+}
+
+int rolloffdat(Array<complex<float> > &data, Array<complex<float> > &outdata, Array<float> &kernel,
+               int64_t kerntype, int64_t isofov)
+{
+  int i0, i1, i2;
   int dmtx0, dmtx1, dmtx2, omtx0, omtx1, omtx2;
   int di0, di1, di2;
-  int kernwidth;
-  float x;
   float rad0,rad1,rad2,sq1,sq2;
   float den0,den1,den2;
   complex<float> val;
-  Array<float> kernel(KERNSIZE+1);
-
-////////////
-// KERNEL //
-////////////
-// Create separable kernel, which has a radius-FOV product of 3.33
-// With an oversampling factor of 1.5, want the FOV to be 1.33, thus a radius of 2.5
-// We will make the kernel 250 points to make this easy calculatin'
-// The kernel is a full Hanning window times exp(-6 x^2)
-//   which is almost certainly not optimal but a lot easier to generate than a kaiser-bessel function
-  for (i=0;i<KERNSIZE;i++) {
-    x = (float)(i)/(float)(KERNSIZE); // goes from 0 to 1
-    kernel(i) = 0.5*(1.+cos(M_PI*x))*exp(-6.*x*x);
-    }
-
-  kernwidth = KERNSIZE/100;
 
 /////////////
 // 1D DATA //
@@ -243,31 +904,13 @@ int rolloffdat(Array<complex<float> > &data, Array<complex<float> > &outdata, in
 /////////////////////////////////
 // Calculate correction arrays //
 /////////////////////////////////
-    Array<complex<float> > ro0(data.size(0));
     Array<complex<float> > cor0(outdata.size(0));
     dmtx0 = data.size(0);
     omtx0 = outdata.size(0);
     den0 = 2./(float)(omtx0);
     di0 = (dmtx0 - omtx0 + 1)/2;
 
-    for (i=0;i<dmtx0;i++)
-      ro0(i) = 0.;
-    for (i = -kernwidth; i <= kernwidth; i++) {
-      i0 = (dmtx0/2) + i;
-      if (i0 > 0 && i0 < dmtx0)
-        ro0(i0) = kernel(abs(100*i));
-      }
-
-    //R2UTILS::Cfft1(ro0,ro0,FFTW_BACKWARD);
-    //ro0 = Numpy::fft1(ro0, FFT_NUMPY_BACKWARD);
-    FFTW::fft1(ro0, ro0, FFTW_BACKWARD);
-
-    for (i=0;i<omtx0;i++) {
-      if (ro0(i+di0).real() > 0)
-        cor0(i) = ro0(dmtx0/2).real()/ro0(i+di0).real();
-      else
-        cor0(i) = 0.;
-      }
+    rolloffcor(kernel, kerntype, dmtx0, omtx0, cor0);
 
 //////////////////////
 // Calculate output //
@@ -289,8 +932,6 @@ int rolloffdat(Array<complex<float> > &data, Array<complex<float> > &outdata, in
 /////////////////////////////////
 // Calculate correction arrays //
 /////////////////////////////////
-    Array<complex<float> > ro0(data.size(0));
-    Array<complex<float> > ro1(data.size(1));
     Array<complex<float> > cor0(outdata.size(0));
     Array<complex<float> > cor1(outdata.size(1));
     dmtx0 = data.size(0);
@@ -302,38 +943,8 @@ int rolloffdat(Array<complex<float> > &data, Array<complex<float> > &outdata, in
     di0 = (dmtx0 - omtx0 + 1)/2;
     di1 = (dmtx1 - omtx1 + 1)/2;
 
-    for (i=0;i<dmtx0;i++)
-      ro0(i) = 0.;
-    for (i=0;i<dmtx1;i++)
-      ro1(i) = 0.;
-    for (i = -kernwidth; i <= kernwidth; i++) {
-      i0 = (dmtx0/2) + i;
-      i1 = (dmtx1/2) + i;
-      if (i0 > 0 && i0 < dmtx0)
-        ro0(i0) = kernel(abs(100*i));
-      if (i1 > 0 && i1 < dmtx1)
-        ro1(i1) = kernel(abs(100*i));
-      }
-
-    //R2UTILS::Cfft1(ro0,ro0,FFTW_BACKWARD);
-    //ro0 = Numpy::fft1(ro0, FFT_NUMPY_BACKWARD);
-    FFTW::fft1(ro0, ro0, FFTW_BACKWARD);
-    //R2UTILS::Cfft1(ro1,ro1,FFTW_BACKWARD);
-    //ro1 = Numpy::fft1(ro1, FFT_NUMPY_BACKWARD);
-    FFTW::fft1(ro1, ro1, FFTW_BACKWARD);
-
-    for (i=0;i<omtx0;i++) {
-      if (ro0(i+di0).real() > 0)
-        cor0(i) = ro0(dmtx0/2).real()/ro0(i+di0).real();
-      else
-        cor0(i) = 0.;
-      }
-    for (i=0;i<omtx1;i++) {
-      if (ro1(i+di1).real() > 0)
-        cor1(i) = ro1(dmtx1/2).real()/ro1(i+di1).real();
-      else
-        cor1(i) = 0.;
-      }
+    rolloffcor(kernel, kerntype, dmtx0, omtx0, cor0);
+    rolloffcor(kernel, kerntype, dmtx1, omtx1, cor1);
 
 //////////////////////
 // Calculate output //
@@ -369,9 +980,6 @@ int rolloffdat(Array<complex<float> > &data, Array<complex<float> > &outdata, in
 /////////////////////////////////
 // Calculate correction arrays //
 /////////////////////////////////
-    Array<complex<float> > ro0(data.size(0));
-    Array<complex<float> > ro1(data.size(1));
-    Array<complex<float> > ro2(data.size(2));
     Array<complex<float> > cor0(outdata.size(0));
     Array<complex<float> > cor1(outdata.size(1));
     Array<complex<float> > cor2(outdata.size(2));
@@ -388,52 +996,9 @@ int rolloffdat(Array<complex<float> > &data, Array<complex<float> > &outdata, in
     di1 = (dmtx1 - omtx1 + 1)/2;
     di2 = (dmtx2 - omtx2 + 1)/2;
 
-    for (i=0;i<dmtx0;i++)
-      ro0(i) = 0.;
-    for (i=0;i<dmtx1;i++)
-      ro1(i) = 0.;
-    for (i=0;i<dmtx2;i++)
-      ro2(i) = 0.;
-    for (i = -kernwidth; i <= kernwidth; i++) {
-      i0 = (dmtx0/2) + i;
-      i1 = (dmtx1/2) + i;
-      i2 = (dmtx2/2) + i;
-      if (i0 > 0 && i0 < dmtx0)
-        ro0(i0) = kernel(abs(100*i));
-      if (i1 > 0 && i1 < dmtx1)
-        ro1(i1) = kernel(abs(100*i));
-      if (i2 > 0 && i2 < dmtx2)
-        ro2(i2) = kernel(abs(100*i));
-      }
-
-    //R2UTILS::Cfft1(ro0,ro0,FFTW_BACKWARD);
-    //ro0 = Numpy::fft1(ro0, FFT_NUMPY_BACKWARD);
-    FFTW::fft1(ro0, ro0, FFTW_BACKWARD);
-    //R2UTILS::Cfft1(ro1,ro1,FFTW_BACKWARD);
-    //ro1 = Numpy::fft1(ro1, FFT_NUMPY_BACKWARD);
-    FFTW::fft1(ro1, ro1, FFTW_BACKWARD);
-    //R2UTILS::Cfft1(ro2,ro2,FFTW_BACKWARD);
-    //ro2 = Numpy::fft1(ro2, FFT_NUMPY_BACKWARD);
-    FFTW::fft1(ro2, ro2, FFTW_BACKWARD);
-
-    for (i=0;i<omtx0;i++) {
-      if (ro0(i+di0).real() > 0)
-        cor0(i) = ro0(dmtx0/2).real()/ro0(i+di0).real();
-      else
-        cor0(i) = 0.;
-      }
-    for (i=0;i<omtx1;i++) {
-      if (ro1(i+di1).real() > 0)
-        cor1(i) = ro1(dmtx1/2).real()/ro1(i+di1).real();
-      else
-        cor1(i) = 0.;
-      }
-    for (i=0;i<omtx2;i++) {
-      if (ro2(i+di2).real() > 0)
-        cor2(i) = ro2(dmtx2/2).real()/ro2(i+di2).real();
-      else
-        cor2(i) = 0.;
-      }
+    rolloffcor(kernel, kerntype, dmtx0, omtx0, cor0);
+    rolloffcor(kernel, kerntype, dmtx1, omtx1, cor1);
+    rolloffcor(kernel, kerntype, dmtx2, omtx2, cor2);
 
 //////////////////////
 // Calculate output //
@@ -466,3 +1031,303 @@ int rolloffdat(Array<complex<float> > &data, Array<complex<float> > &outdata, in
 
    return (0);
 }
+
+//========================================================================
+// ROLLOFFDAT_BATCH
+//========================================================================
+
+// rolloffdat() for every set at once:
+//   data(dmtx0[,dmtx1[,dmtx2]], nsets) -> outdata(omtx0[,omtx1[,omtx2]], nsets)
+// The correction vectors only depend on the kernel and the sizes, so they are
+// kept in rolloff_cache between calls (emptied when it reaches ROLLOFF_CACHE_MAX
+// entries), and the correction, crop and isotropic FOV mask are one pass over
+// the data, shared between threads by rows.
+#define ROLLOFF_CACHE_MAX 64
+
+static map<vector<double>, vector<complex<float> > > rolloff_cache;
+static pthread_mutex_t rolloff_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+// (a copy of) the correction for one dimension, from the cache if it has been
+// made before
+vector<complex<float> > rolloffvec(Array<float> &kernel, int64_t kerntype, int dmtx, int omtx)
+{
+  uint64_t i;
+  vector<double> key;
+  key.push_back(kerntype);
+  key.push_back(dmtx);
+  key.push_back(omtx);
+  for (i = 0; i < kernel.size(); i++)
+    key.push_back(kernel(i));
+
+  pthread_mutex_lock(&rolloff_mutex);
+  map<vector<double>, vector<complex<float> > >::iterator it = rolloff_cache.find(key);
+  if (it == rolloff_cache.end()) {
+    Array<complex<float> > cor(omtx);
+    rolloffcor(kernel, kerntype, dmtx, omtx, cor);
+    if (rolloff_cache.size() >= ROLLOFF_CACHE_MAX)
+      rolloff_cache.clear();
+    it = rolloff_cache.insert(make_pair(key, vector<complex<float> >(cor.data(), cor.data()+omtx))).first;
+    }
+  vector<complex<float> > vec(it->second);
+  pthread_mutex_unlock(&rolloff_mutex);
+  return (vec);
+}
+
+struct rolloffbatch {
+  int64_t nd, nsets, isofov;
+  int64_t dmtx[3], omtx[3], di[3];
+  vector<complex<float> > cor[3];
+  complex<float> *in, *out;
+};
+
+// sizes, offsets and (cached) corrections for gridded dims dmtx cropped to omtx
+void rolloffsetup(rolloffbatch &rb, Array<float> &kernel, int64_t kerntype, int64_t isofov,
+                  int64_t nd, int64_t *dmtx, int64_t *omtx)
+{
+  int64_t d;
+
+  rb.nd = nd;
+  rb.isofov = isofov;
+  for (d = 0; d < 3; d++) {
+    if (d < nd) {
+      rb.dmtx[d] = dmtx[d];
+      rb.omtx[d] = omtx[d];
+      rb.di[d] = (rb.dmtx[d] - rb.omtx[d] + 1)/2;
+      rb.cor[d] = rolloffvec(kernel, kerntype, rb.dmtx[d], rb.omtx[d]);
+      }
+    else {
+      rb.dmtx[d] = 1;
+      rb.omtx[d] = 1;
+      rb.di[d] = 0;
+      rb.cor[d].clear();
+      }
+    }
+}
+
+void rolloffbatch_thread(int *num_threads, int *cur_thread, Array<complex<float> > &data,
+                         Array<complex<float> > &outdata, rolloffbatch *rb)
+{
+  int64_t i0, i1, i2, set, row, nrows, start, stop;
+  float rad0, rad1, rad2, sq1, sq2, den0, den1, den2;
+  complex<float> one(1.), c1, c2;
+  complex<float> *in, *out;
+
+  int64_t dm0 = rb->dmtx[0], dm1 = rb->dmtx[1], dm2 = rb->dmtx[2];
+  int64_t om0 = rb->omtx[0], om1 = rb->omtx[1], om2 = rb->omtx[2];
+  den0 = 2./(float)(om0);
+  den1 = 2./(float)(om1);
+  den2 = 2./(float)(om2);
+
+  // rows of dim 0, over the other output dims and the sets
+  nrows = om1*om2*rb->nsets;
+  start = (*cur_thread * nrows) / *num_threads;
+  stop = ((*cur_thread+1) * nrows) / *num_threads;
+
+  for (row = start; row < stop; row++) {
+    i1 = row % om1;
+    i2 = (row / om1) % om2;
+    set = row / (om1*om2);
+
+    in = rb->in + dm0*((i1+rb->di[1]) + dm1*((i2+rb->di[2]) + dm2*set)) + rb->di[0];
+    out = rb->out + om0*(i1 + om1*(i2 + om2*set));
+    c1 = (rb->nd > 1) ? rb->cor[1][i1] : one;
+    c2 = (rb->nd > 2) ? rb->cor[2][i2] : one;
+
+    // ignore isofov in 1D, means nothing there
+    if (rb->isofov == 1 && rb->nd > 1) {
+      rad1 = (float)(i1-om1/2)*den1;
+      rad2 = (rb->nd > 2) ? (float)(i2-om2/2)*den2 : 0.;
+      sq1 = rad1*rad1;
+      sq2 = rad2*rad2;
+      for (i0 = 0; i0 < om0; i0++) {
+        rad0 = (float)(i0-om0/2)*den0;
+        if (rad0*rad0 + sq1 + sq2 <= 1)
+          out[i0] = (rb->nd > 2) ? rb->cor[0][i0]*c1*c2*in[i0] : rb->cor[0][i0]*c1*in[i0];
+        else
+          out[i0] = 0;
+        }
+      }
+    else if (rb->nd > 2) {
+      for (i0 = 0; i0 < om0; i0++)
+        out[i0] = rb->cor[0][i0]*c1*c2*in[i0];
+      }
+    else if (rb->nd > 1) {
+      for (i0 = 0; i0 < om0; i0++)
+        out[i0] = rb->cor[0][i0]*c1*in[i0];
+      }
+    else {
+      for (i0 = 0; i0 < om0; i0++)
+        out[i0] = rb->cor[0][i0]*in[i0];
+      }
+    } // row
+}
+
+int rolloffdat_batch(Array<complex<float> > &data, Array<complex<float> > &outdata, Array<float> &kernel,
+                     int64_t kerntype, int64_t isofov, int64_t nthreads)
+{
+  int64_t d, nd, threads;
+  int64_t dmtx[3], omtx[3];
+  rolloffbatch rb;
+
+  nd = data.ndim() - 1;
+  if (nd < 1 || nd > 3 || outdata.ndim() != data.ndim())
+    return (1);
+  for (d = 0; d < nd; d++) {
+    dmtx[d] = data.size(d);
+    omtx[d] = outdata.size(d);
+    }
+  rolloffsetup(rb, kernel, kerntype, isofov, nd, dmtx, omtx);
+  rb.nsets = data.size(nd);
+  rb.in = data.data();
+  rb.out = outdata.data();
+
+  threads = max((int64_t)1, min(nthreads, rb.omtx[1]*rb.omtx[2]*rb.nsets));
+  create_threads3 (threads, rolloffbatch_thread, &data, &outdata, &rb);
+
+  return (0);
+}
+
+//========================================================================
+// NUFFTADJ
+//========================================================================
+
+// The centered, normalized inverse FFT of every dim of the grid, as
+// FFTW::fft1/2/3 with FFTW_BACKWARD, but planned once for a buffer that is
+// reused: the centering (DC at N/2) is a phase ramp along each dim before and
+// after the plan, with the 1/N folded into the ramp after dim 0.
+struct gridfft {
+  fftwf_plan plan;
+  vector<complex<float> > pre[3], post[3];
+};
+
+int gridfft_plan(gridfft &gf, Array<complex<float> > &grid)
+{
+  int64_t d, x, n, h, nd, stride;
+  double norm;
+  vector<fftwf_iodim64> dims;
+
+  nd = grid.ndim();
+  norm = 1.;
+  stride = 1;
+  dims.resize(nd);
+  for (d = 0; d < nd; d++) {
+    n = grid.size(d);
+    h = n/2;
+    // FFTW lists the slowest varying dim first
+    dims[nd-1-d].n = n;
+    dims[nd-1-d].is = stride;
+    dims[nd-1-d].os = stride;
+    stride *= n;
+    gf.pre[d].resize(n);
+    gf.post[d].resize(n);
+    for (x = 0; x < n; x++) {
+      gf.pre[d][x] = std::polar(1., -FFTW_BACKWARD*2.*M_PI*double((x*h) % n)/double(n));
+      gf.post[d][x] = std::polar(1., FFTW_BACKWARD*2.*M_PI*double((((h*h - x*h) % n) + n) % n)/double(n));
+      }
+    norm *= n;
+    }
+  for (d = nd; d < 3; d++) {
+    gf.pre[d].assign(1, complex<float>(1.));
+    gf.post[d].assign(1, complex<float>(1.));
+    }
+  for (x = 0; x < (int64_t)gf.post[0].size(); x++)
+    gf.post[0][x] /= norm;
+
+  // ESTIMATE does not touch the grid, so it can be planned before it is filled
+  grid_fft_threadsafe();
+  fftwf_complex *p = reinterpret_cast<fftwf_complex*>(grid.data());
+  gf.plan = fftwf_plan_guru64_dft(nd, &dims[0], 0, NULL, p, p, FFTW_BACKWARD, FFTW_ESTIMATE);
+  return (gf.plan == NULL);
+}
+
+// multiply each point of the grid by the ramps r along each dim
+void gridfft_ramp(Array<complex<float> > &grid, vector<complex<float> > *r)
+{
+  int64_t i0, i1, i2, n0, n1, n2;
+  complex<float> c;
+  complex<float> *g = grid.data();
+
+  n0 = r[0].size();
+  n1 = r[1].size();
+  n2 = r[2].size();
+  for (i2 = 0; i2 < n2; i2++)
+    for (i1 = 0; i1 < n1; i1++) {
+      c = r[1][i1]*r[2][i2];
+      for (i0 = 0; i0 < n0; i0++, g++)
+        *g *= c*r[0][i0];
+      }
+}
+
+void gridfft_execute(gridfft &gf, Array<complex<float> > &grid)
+{
+  gridfft_ramp(grid, gf.pre);
+  fftwf_execute(gf.plan);
+  gridfft_ramp(grid, gf.post);
+}
+
+// Grid -> inverse FFT -> rolloff in one call:
+//   crds(ndim, npts, ncsets), data(npts, ncsets, ndsets), wates(npts, ncsets)
+//   -> outdata(omtx0[,omtx1[,omtx2]], ncsets, ndsets)
+// Each set is gridded (griddat_threaded) onto the same oversampled buffer of
+// size mtx, transformed in place (with one plan for all of them), and rolled
+// off and cropped straight into outdata, so only one oversampled grid is ever
+// held.
+int nufftadj(Array<float> &crds, Array<complex<float> > &data, Array<float> &wates,
+             Array<complex<float> > &outdata, Array<float> &kernel, int64_t kerntype,
+             uint64_t *mtx, double dx, double dy, double dz, int64_t isofov, int64_t nthreads)
+{
+  int64_t i, d, a, cs, ds, ndim, npts, ncsets, ndsets, imgsize, threads;
+  int64_t dmtx[3], omtx[3];
+  rolloffbatch rb;
+  gridfft gf;
+
+  ndim = crds.size(0);
+  if (ndim < 1 || ndim > 3)
+    return (1);
+  npts = crds.size(1);
+  ncsets = crds.size(2);
+  ndsets = data.size(2);
+
+  Array<complex<float> > grid(ndim, mtx);
+  Array<float> c(ndim, npts);
+  Array<float> w(npts);
+  Array<complex<float> > dat(npts);
+
+  imgsize = 1;
+  for (d = 0; d < ndim; d++) {
+    dmtx[d] = mtx[d];
+    omtx[d] = outdata.size(d);
+    imgsize *= omtx[d];
+    }
+  rolloffsetup(rb, kernel, kerntype, isofov, ndim, dmtx, omtx);
+  rb.nsets = 1;
+  rb.in = grid.data();
+  threads = max((int64_t)1, min(nthreads, rb.omtx[1]*rb.omtx[2]));
+  if (gridfft_plan(gf, grid))
+    return (1);
+
+  for (cs = 0; cs < ncsets; cs++) {
+    for (i = 0; i < npts; i++) {
+      for (a = 0; a < ndim; a++)
+        c(a,i) = crds(a,i,cs);
+      w(i) = wates(i,cs);
+      }
+    for (ds = 0; ds < ndsets; ds++) {
+      for (i = 0; i < npts; i++)
+        dat(i) = data(i,cs,ds);
+
+      if (griddat_threaded(c, dat, w, grid, kernel, dx, dy, dz, nthreads)) {
+        fftwf_destroy_plan(gf.plan);
+        return (1);
+        }
+
+      gridfft_execute(gf, grid);
+
+      rb.out = outdata.data() + (cs + ncsets*ds)*imgsize;
+      create_threads3 (threads, rolloffbatch_thread, &grid, &outdata, &rb);
+      } // ds
+    } // cs
+
+  fftwf_destroy_plan(gf.plan);
+  return (0);
+}
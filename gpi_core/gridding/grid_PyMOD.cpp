@@ -44,9 +44,12 @@
  **/
 
 #include "PyFI/PyFI.h"
+#include "multiproc/threads.c"
 using namespace PyFI;
 
 #include <iostream>
+#include <vector>
+#include <map>
 using namespace std;
 #include "grid_123d.cpp"
 
@@ -63,14 +66,100 @@ PYFI_FUNC(grid)
     PYFI_POSARG(double, dy);
     PYFI_POSARG(double, dz);
 
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads, 1 for the serial code (default:1)"
+    PYFI_KWARG(int64_t, kernel, GRIDKERN_HANNGAUSS); // "gridding kernel, 0: Hanning-Gaussian, 1: Kaiser-Bessel (default:0)"
+    PYFI_KWARG(double, width, 2*KERNRAD); // "kernel width in grid points (default:5)"
+    PYFI_KWARG(double, osf, 1.5); // "grid oversampling factor, sets the Kaiser-Bessel shape (default:1.5)"
+
+    Array<float> kerntab(kernsize(*width)+1);
+    gridkernel(kerntab, *kernel, *osf);
+
     PYFI_SETOUTPUT_ALLOC_DIMS(Array<complex<float> >, outdata, outdim->size(), outdim->as_ULONG());
 
-    if (griddat(*crds,*data,*wates,*outdata,*dx,*dy,*dz))
+    if (*nthreads > 1)
+    {
+        if (griddat_threaded(*crds,*data,*wates,*outdata,kerntab,*dx,*dy,*dz,*nthreads))
+            PYFI_ERROR("griddat_threaded() has failed");
+    }
+    else if (griddat(*crds,*data,*wates,*outdata,kerntab,*dx,*dy,*dz))
         PYFI_ERROR("griddat() has failed");
 
     PYFI_END(); /* This must be the last line */
 } /* grid */
 
+PYFI_FUNC(grid_batch)
+{
+    PYFI_START(); /* This must be the first line */
+
+    /* input */
+    PYFI_POSARG(Array<float>, crds);             // (ncsets, npts, ndim)
+    PYFI_POSARG(Array<complex<float> >, data);   // (ndsets, ncsets, npts)
+    PYFI_POSARG(Array<float>, wates);            // (ncsets, npts)
+    PYFI_POSARG(Array<int64_t>, outdim);
+    PYFI_POSARG(double, dx);
+    PYFI_POSARG(double, dy);
+    PYFI_POSARG(double, dz);
+
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+    PYFI_KWARG(int64_t, kernel, GRIDKERN_HANNGAUSS); // "gridding kernel, 0: Hanning-Gaussian, 1: Kaiser-Bessel (default:0)"
+    PYFI_KWARG(double, width, 2*KERNRAD); // "kernel width in grid points (default:5)"
+    PYFI_KWARG(double, osf, 1.5); // "grid oversampling factor, sets the Kaiser-Bessel shape (default:1.5)"
+
+    Array<float> kerntab(kernsize(*width)+1);
+    gridkernel(kerntab, *kernel, *osf);
+
+    /* output is (ndsets, ncsets, outdim[::-1]) */
+    if (crds->ndim() != 3 || data->ndim() != 3 || wates->ndim() != 2)
+        PYFI_ERROR("grid_batch() expects crds(ncsets,npts,ndim), data(ndsets,ncsets,npts), wates(ncsets,npts)");
+    vector<uint64_t> dims;
+    for (uint64_t i=0; i<outdim->size(); i++)
+        dims.push_back((*outdim)(i));
+    dims.push_back(data->size(1));
+    dims.push_back(data->size(2));
+
+    PYFI_SETOUTPUT_ALLOC_DIMS(Array<complex<float> >, outdata, dims.size(), &dims[0]);
+
+    if (griddat_batch(*crds,*data,*wates,*outdata,kerntab,*dx,*dy,*dz,*nthreads))
+        PYFI_ERROR("griddat_batch() has failed");
+
+    PYFI_END(); /* This must be the last line */
+} /* grid_batch */
+
+PYFI_FUNC(degrid)
+{
+    PYFI_START(); /* This must be the first line */
+
+    /* input */
+    PYFI_POSARG(Array<float>, crds);             // (ncsets, npts, ndim)
+    PYFI_POSARG(Array<complex<float> >, data);   // (ndsets, ncsets, outdim[::-1])
+    PYFI_POSARG(double, dx);
+    PYFI_POSARG(double, dy);
+    PYFI_POSARG(double, dz);
+
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+    PYFI_KWARG(int64_t, kernel, GRIDKERN_HANNGAUSS); // "gridding kernel, 0: Hanning-Gaussian, 1: Kaiser-Bessel (default:0)"
+    PYFI_KWARG(double, width, 2*KERNRAD); // "kernel width in grid points (default:5)"
+    PYFI_KWARG(double, osf, 1.5); // "grid oversampling factor, sets the Kaiser-Bessel shape (default:1.5)"
+
+    Array<float> kerntab(kernsize(*width)+1);
+    gridkernel(kerntab, *kernel, *osf);
+
+    /* output is (ndsets, ncsets, npts) */
+    if (crds->ndim() != 3 || data->ndim() != crds->size(0)+2)
+        PYFI_ERROR("degrid() expects crds(ncsets,npts,ndim) and data(ndsets,ncsets,grid)");
+    vector<uint64_t> dims;
+    dims.push_back(crds->size(1));
+    dims.push_back(crds->size(2));
+    dims.push_back(data->size(data->ndim()-1));
+
+    PYFI_SETOUTPUT_ALLOC_DIMS(Array<complex<float> >, outdata, dims.size(), &dims[0]);
+
+    if (degriddat(*crds,*data,*outdata,kerntab,*dx,*dy,*dz,*nthreads))
+        PYFI_ERROR("degriddat() has failed");
+
+    PYFI_END(); /* This must be the last line */
+} /* degrid */
+
 PYFI_FUNC(rolloff)
 {
     PYFI_START(); /* This must be the first line */
@@ -80,16 +169,105 @@ PYFI_FUNC(rolloff)
     PYFI_POSARG(Array<int64_t>, outdim);
     PYFI_POSARG(int64_t, isofov);
 
+    PYFI_KWARG(int64_t, kernel, GRIDKERN_HANNGAUSS); // "gridding kernel, 0: Hanning-Gaussian, 1: Kaiser-Bessel (default:0)"
+    PYFI_KWARG(double, width, 2*KERNRAD); // "kernel width in grid points (default:5)"
+    PYFI_KWARG(double, osf, 1.5); // "grid oversampling factor, sets the Kaiser-Bessel shape (default:1.5)"
+
+    Array<float> kerntab(kernsize(*width)+1);
+    gridkernel(kerntab, *kernel, *osf);
+
     PYFI_SETOUTPUT_ALLOC_DIMS(Array<complex<float> >, outdata, outdim->size(), outdim->as_ULONG());
 
-    if (rolloffdat(*data,*outdata,*isofov))
+    if (rolloffdat(*data,*outdata,kerntab,*kernel,*isofov))
         PYFI_ERROR("rolloff() has failed");
 
     PYFI_END(); /* This must be the last line */
 } /* rolloff */
 
 
+PYFI_FUNC(rolloff_batch)
+{
+    PYFI_START(); /* This must be the first line */
+
+    /* input */
+    PYFI_POSARG(Array<complex<float> >, data);   // (nsets, gridded dims)
+    PYFI_POSARG(Array<int64_t>, outdim);         // rolled-off dims, as for rolloff()
+    PYFI_POSARG(int64_t, isofov);
+
+    PYFI_KWARG(int64_t, kernel, GRIDKERN_HANNGAUSS); // "gridding kernel, 0: Hanning-Gaussian, 1: Kaiser-Bessel (default:0)"
+    PYFI_KWARG(double, width, 2*KERNRAD); // "kernel width in grid points (default:5)"
+    PYFI_KWARG(double, osf, 1.5); // "grid oversampling factor, sets the Kaiser-Bessel shape (default:1.5)"
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+
+    if (data->ndim() != outdim->size()+1)
+        PYFI_ERROR("rolloff_batch() expects data of one more dimension (the sets) than outdim");
+
+    Array<float> kerntab(kernsize(*width)+1);
+    gridkernel(kerntab, *kernel, *osf);
+
+    vector<uint64_t> odims(outdim->size()+1);
+    for (uint64_t i = 0; i < outdim->size(); i++)
+        odims[i] = (*outdim)(i);
+    odims[outdim->size()] = data->size(outdim->size());
+    PYFI_SETOUTPUT_ALLOC_DIMS(Array<complex<float> >, outdata, odims.size(), &odims[0]);
+
+    if (rolloffdat_batch(*data,*outdata,kerntab,*kernel,*isofov,*nthreads))
+        PYFI_ERROR("rolloff_batch() has failed");
+
+    PYFI_END(); /* This must be the last line */
+} /* rolloff_batch */
+
+
+PYFI_FUNC(nufft_adjoint)
+{
+    PYFI_START(); /* This must be the first line */
+
+    /* input */
+    PYFI_POSARG(Array<float>, crds);             // (ncsets, npts, ndim)
+    PYFI_POSARG(Array<complex<float> >, data);   // (ndsets, ncsets, npts)
+    PYFI_POSARG(Array<float>, wates);            // (ncsets, npts)
+    PYFI_POSARG(Array<int64_t>, outdim);         // oversampled grid, as for grid()
+    PYFI_POSARG(Array<int64_t>, imgdim);         // cropped image, as for rolloff()
+    PYFI_POSARG(double, dx);
+    PYFI_POSARG(double, dy);
+    PYFI_POSARG(double, dz);
+    PYFI_POSARG(int64_t, isofov);
+
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+    PYFI_KWARG(int64_t, kernel, GRIDKERN_HANNGAUSS); // "gridding kernel, 0: Hanning-Gaussian, 1: Kaiser-Bessel (default:0)"
+    PYFI_KWARG(double, width, 2*KERNRAD); // "kernel width in grid points (default:5)"
+    PYFI_KWARG(double, osf, 1.5); // "grid oversampling factor, sets the Kaiser-Bessel shape (default:1.5)"
+
+    Array<float> kerntab(kernsize(*width)+1);
+    gridkernel(kerntab, *kernel, *osf);
+
+    /* output is (ndsets, ncsets, imgdim[::-1]) */
+    if (crds->ndim() != 3 || data->ndim() != 3 || wates->ndim() != 2)
+        PYFI_ERROR("nufft_adjoint() expects crds(ncsets,npts,ndim), data(ndsets,ncsets,npts), wates(ncsets,npts)");
+    if (outdim->size() != crds->size(0) || imgdim->size() != crds->size(0))
+        PYFI_ERROR("nufft_adjoint() expects outdim and imgdim of the coordinate dimensionality");
+    vector<uint64_t> mtx, dims;
+    for (uint64_t i=0; i<outdim->size(); i++) {
+        mtx.push_back((*outdim)(i));
+        dims.push_back((*imgdim)(i));
+    }
+    dims.push_back(data->size(1));
+    dims.push_back(data->size(2));
+
+    PYFI_SETOUTPUT_ALLOC_DIMS(Array<complex<float> >, outdata, dims.size(), &dims[0]);
+
+    if (nufftadj(*crds,*data,*wates,*outdata,kerntab,*kernel,&mtx[0],*dx,*dy,*dz,*isofov,*nthreads))
+        PYFI_ERROR("nufftadj() has failed");
+
+    PYFI_END(); /* This must be the last line */
+} /* nufft_adjoint */
+
+
 PYFI_LIST_START_
     PYFI_DESC(grid, "Standard Gridding calculation")
+    PYFI_DESC(grid_batch, "Standard Gridding of many data sets in one call")
+    PYFI_DESC(degrid, "Inverse Gridding, the adjoint of Standard Gridding")
     PYFI_DESC(rolloff, "Rolloff Correction for Standard Gridding calculation")
+    PYFI_DESC(rolloff_batch, "Rolloff Correction of many data sets in one call")
+    PYFI_DESC(nufft_adjoint, "Grid, inverse FFT and Rolloff in one call")
 PYFI_LIST_END_
@@ -0,0 +1,257 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+''' Precomputed gridding plans.
+
+    A GridPlan holds the interpolation between a fixed set of k-space
+    coordinates and the (oversampled) grid used by grid.grid(), as a sparse
+    matrix of (grid index, kernel weight) pairs for each sample.  The
+    neighbour search and kernel lookups are then done once per trajectory,
+    and gridding and degridding of each new frame are sparse matrix-vector
+    products.
+
+    The plan uses the same kernel, window and coordinate conventions as
+    griddat() in grid_123d.cpp, so GridPlan.grid() matches grid.grid() to
+    single precision rounding.
+
+    Plans can be kept in a module level cache (get_plan()), keyed on a hash
+    of the coordinates and gridding parameters and limited in total size.
+'''
+
+import hashlib
+import collections
+import numpy as np
+import scipy.sparse
+
+# gridding kernels, as in grid_123d.cpp
+KERNRAD = 2.5
+HANNGAUSS = 0
+KAISERBESSEL = 1
+
+
+def gridkernel(kerntype=HANNGAUSS, width=2*KERNRAD, osf=1.5):
+    '''The kernel table of gridkernel(), from the center out to the radius
+       (width/2) with 100 entries per grid point.
+    '''
+    size = int(50.*width + 0.5)
+    x = np.arange(size+1, dtype=np.float32) / np.float32(size)
+    x = x.astype(np.float64)
+    if kerntype == KAISERBESSEL:
+        w = 2.*size/100.
+        beta = (w/osf)**2*(osf-0.5)**2 - 0.8
+        beta = np.pi*np.sqrt(beta) if beta > 0 else 0.
+        return (np.i0(beta*np.sqrt(np.maximum(0., 1.-x*x)))/np.i0(beta)).astype(np.float32)
+    return (0.5*(1.+np.cos(np.pi*x))*np.exp(-6.*x*x)).astype(np.float32)
+
+
+class GridPlan(object):
+    '''Sparse gridding operator for a fixed set of coordinates.
+
+        crds:   (npts, ndim) or (ncsets, npts, ndim) coordinates in [-0.5,0.5]
+        outdim: grid size, in the same (fastest first) order as grid.grid()
+        dx, dy, dz: off-center shift in pixels
+        kerntype, width, osf: gridding kernel, as for grid.grid()
+    '''
+
+    def __init__(self, crds, outdim, dx=0., dy=0., dz=0.,
+                 kerntype=HANNGAUSS, width=2*KERNRAD, osf=1.5):
+        crds = np.asarray(crds, dtype=np.float32)
+        if crds.ndim == 2:
+            crds = crds[np.newaxis, ...]
+        self.ncsets, self.npts, self.ndim = crds.shape
+        if self.ndim not in (1, 2, 3):
+            raise ValueError('GridPlan: coordinates must be 1, 2 or 3 dimensional')
+
+        self.outdim = np.array(outdim, dtype=np.int64)[:self.ndim]
+        self.shape = tuple(int(m) for m in self.outdim[::-1])  # numpy order
+        self.imgsize = int(np.prod(self.outdim))
+
+        # one row per sample (across all coordinate sets), one column per grid
+        # point of each set, so the columns of set s start at s*imgsize
+        crds = crds.reshape(-1, self.ndim)
+        nrows = crds.shape[0]
+        ncols = self.ncsets*self.imgsize
+        kernel = gridkernel(kerntype, width, osf)
+        size = kernel.size-1
+        rad = size/100.
+        nwin = int(2*rad)+1
+
+        # only grid if crds inbounds
+        inbounds = np.all((crds >= -0.5) & (crds <= 0.5), axis=1)
+        rows = np.nonzero(inbounds)[0]
+        c = crds[rows]
+
+        # off-center FOV correction as a phase on each sample
+        theta = np.zeros(nrows, dtype=np.float64)
+        for a, shift in enumerate((dx, dy, dz)[:self.ndim]):
+            theta -= 2.*np.pi*crds[:, a]*shift
+        self.shift = np.exp(1j*theta).astype(np.complex64)
+        self.shift[~inbounds] = 0
+
+        # kernel weights and grid indices of the window in each dim
+        wts = np.ones((rows.size, 1), dtype=np.float32)
+        idx = np.zeros((rows.size, 1), dtype=np.int64)
+        stride = 1
+        for a in range(self.ndim):
+            mtx = int(self.outdim[a])
+            fmtx = float(mtx & ~1)  # round down to nearest even integer
+            f = ((0.5+c[:, a].astype(np.float64))*fmtx).astype(np.float32)
+            lo = np.maximum(0, np.trunc(f.astype(np.float64)-rad).astype(np.int64)+1)
+            hi = np.minimum(mtx-1, np.trunc(f.astype(np.float64)+rad).astype(np.int64))
+            dk = np.floor(100.*(lo.astype(np.float32)-f).astype(np.float64)+0.5)
+            dk = dk.astype(np.int64)
+
+            i = lo[:, np.newaxis] + np.arange(nwin)
+            k = np.abs(dk[:, np.newaxis] + 100*np.arange(nwin))
+            valid = i <= hi[:, np.newaxis]
+            w = np.where(valid, kernel[np.minimum(k, size)], 0)
+
+            # separable kernel: outer product with the dims done so far
+            nw = wts.shape[1]*nwin
+            wts = (wts[:, :, np.newaxis]*w[:, np.newaxis, :]).reshape(rows.size, nw)
+            idx = (idx[:, :, np.newaxis] + stride*np.where(valid, i, 0)[:, np.newaxis, :])
+            idx = idx.reshape(rows.size, nw)
+            stride *= mtx
+        idx += self.imgsize*(rows // self.npts)[:, np.newaxis]
+
+        keep = wts != 0
+        counts = np.zeros(nrows, dtype=np.int64)
+        counts[rows] = keep.sum(axis=1)
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        self.interp = scipy.sparse.csr_matrix((wts[keep], idx[keep], indptr),
+                                              shape=(nrows, ncols))
+
+    @property
+    def nbytes(self):
+        '''Memory held by the plan, in bytes.
+        '''
+        m = self.interp
+        return m.data.nbytes + m.indices.nbytes + m.indptr.nbytes + self.shift.nbytes
+
+    def grid(self, data, wates=None):
+        '''Grid data (..., [ncsets,] npts) with optional density weights
+           ([ncsets,] npts).  Returns complex64 (..., [ncsets,] *shape).
+        '''
+        data = np.asarray(data)
+        lead = data.shape[:data.ndim-1] if self.ncsets == 1 else data.shape[:data.ndim-2]
+        vals = data.reshape(-1, self.ncsets*self.npts).astype(np.complex64)
+        if wates is not None:
+            vals = vals*np.asarray(wates, dtype=np.float32).reshape(-1)
+        vals = vals*self.shift
+
+        # (nsamp, nout)^T x (nsamp, nsets)
+        out = self.interp.T.dot(vals.T).T
+        if self.ncsets == 1:
+            return out.reshape(lead + self.shape)
+        return out.reshape(lead + (self.ncsets,) + self.shape)
+
+    def degrid(self, data):
+        '''Resample grids (..., [ncsets,] *shape) at the coordinates, i.e. the
+           adjoint of grid() without density weights.  Returns complex64
+           (..., [ncsets,] npts).
+        '''
+        data = np.asarray(data)
+        lead = data.shape[:data.ndim-self.ndim]
+        if self.ncsets > 1:
+            lead = lead[:-1]
+        vals = data.reshape(-1, self.ncsets*self.imgsize).astype(np.complex64)
+
+        out = self.interp.dot(vals.T).T*np.conj(self.shift)
+        if self.ncsets == 1:
+            return out.reshape(lead + (self.npts,))
+        return out.reshape(lead + (self.ncsets, self.npts))
+
+
+###############################################################################
+# Plan cache
+###############################################################################
+
+_plans = collections.OrderedDict()  # key: GridPlan, least recently used first
+_seen = collections.OrderedDict()   # keys of trajectories gridded without a plan
+MAXSEEN = 64
+
+
+def plan_key(crds, outdim, dx=0., dy=0., dz=0., kerntype=HANNGAUSS, width=2*KERNRAD, osf=1.5):
+    '''Hash of the coordinates and gridding parameters that define a plan.
+    '''
+    crds = np.ascontiguousarray(crds, dtype=np.float32)
+    h = hashlib.sha1(crds.view(np.uint8))
+    h.update(repr((crds.shape, [int(m) for m in outdim],
+                   float(dx), float(dy), float(dz),
+                   int(kerntype), float(width), float(osf))).encode())
+    return h.hexdigest()
+
+
+def cache_nbytes():
+    '''Total size of the cached plans, in bytes.
+    '''
+    return sum(p.nbytes for p in _plans.values())
+
+
+def clear_cache():
+    _plans.clear()
+    _seen.clear()
+
+
+def get_plan(crds, outdim, dx=0., dy=0., dz=0., kerntype=HANNGAUSS, width=2*KERNRAD, osf=1.5,
+             maxbytes=512*2**20, on_repeat=False):
+    '''Return the plan for these coordinates and parameters, from the cache if
+       it has been made before.  Least recently used plans are evicted to keep
+       the cache under maxbytes; a plan larger than that is not cached.
+       If on_repeat, no plan is made the first time a trajectory is seen
+       (None is returned, to grid it directly), only when it comes again.
+    '''
+    key = plan_key(crds, outdim, dx, dy, dz, kerntype, width, osf)
+    if key in _plans:
+        _plans.move_to_end(key)
+        return _plans[key]
+    if on_repeat and key not in _seen:
+        _seen[key] = True
+        while len(_seen) > MAXSEEN:
+            _seen.popitem(last=False)
+        return None
+    _seen.pop(key, None)
+
+    plan = GridPlan(crds, outdim, dx, dy, dz, kerntype, width, osf)
+    if plan.nbytes <= maxbytes:
+        while _plans and cache_nbytes() + plan.nbytes > maxbytes:
+            _plans.popitem(last=False)
+        _plans[key] = plan
+    return plan
+
+
+def plan_estimate(npts, ndim, width=2*KERNRAD):
+    '''Rough upper bound on the size of a plan for npts samples, in bytes.
+    '''
+    return int(npts*(8*(width+1)**ndim + 16))
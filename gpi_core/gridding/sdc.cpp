@@ -510,6 +510,259 @@ int threedsdc(Array<double> &crds, Array<double> &wates, Array<double> &sdc,
 
 } // threedsdc()
 
+/*******************************/
+/* THREADED SDC, ALL SETS */
+/*******************************/
+// The 1D, 2D and 3D iterations above, for many sets of coordinates in one call
+// and on several threads:
+//   crds(ndim, npts, nsets), wates(npts, nsets), sdc(npts, nsets)
+// The sets are done one after the other, re-using cmtx.  Within each iteration
+// - crds -> cmtx is split into slabs along the last dimension of cmtx.  Each point is
+//   binned up front into the slabs its kernel reaches, and each thread convolves whole
+//   slabs, so no two threads write the same cmtx point.
+// - cmtx -> crds only reads cmtx, so the points are just shared out between threads.
+// The kernel is tabulated against the squared radius, so no sqrt is needed per neighbour.
+
+#define SDCKERN2SIZE 65536
+
+struct sdcjob {
+  int64_t ndim, npts;
+  int64_t mtx[3];
+  double krad, krad2, k2norm;
+  vector<double> kern2;   // kernel by squared radius
+  vector<double> crds;    // coordinates of this set, in cmtx units
+  vector<double> taper;
+  double *sdc;            // sdc of this set
+  int64_t ntiles;
+  vector<int64_t> tilestart;
+  vector<vector<int64_t> > bins;
+};
+
+// kernel window of point i in each dimension, clipped to cmtx; unused dims are 0..0
+void sdcwindow(sdcjob *job, int64_t i, int64_t *lo, int64_t *hi)
+{
+  int64_t a;
+  double c;
+  for (a = 0; a < 3; a++) {
+    if (a < job->ndim) {
+      c = job->crds[i*job->ndim + a];
+      lo[a] = max((int64_t)0, (int64_t)ceil(c-job->krad));
+      hi[a] = min(job->mtx[a]-1, (int64_t)floor(c+job->krad));
+      }
+    else {
+      lo[a] = 0;
+      hi[a] = 0;
+      }
+    }
+}
+
+// Convolve point i onto cmtx (scatter), or cmtx back onto point i (gather, returned),
+// only touching lo..hi of the last dimension
+double sdcconv(sdcjob *job, Array<double> &cmtx, int64_t i, int scatter, int64_t tlo, int64_t thi)
+{
+  int64_t ii,jj,kk,a;
+  int64_t lo[3], hi[3];
+  double c[3], d, dx2, dxy2, rad2, val, sum;
+  double dy2[20], dz2[20];
+  double *cm = cmtx.data();
+
+  sdcwindow(job, i, lo, hi);
+  lo[job->ndim-1] = max(lo[job->ndim-1], tlo);
+  hi[job->ndim-1] = min(hi[job->ndim-1], thi);
+  for (a = 0; a < 3; a++)
+    c[a] = (a < job->ndim) ? job->crds[i*job->ndim + a] : 0.;
+
+  for (jj = lo[1]; jj <= hi[1]; jj++) {
+    d = c[1]-double(jj);
+    dy2[jj-lo[1]] = d*d;
+    }
+  for (kk = lo[2]; kk <= hi[2]; kk++) {
+    d = c[2]-double(kk);
+    dz2[kk-lo[2]] = d*d;
+    }
+
+  val = job->sdc[i];
+  sum = 0.;
+  for (kk = lo[2]; kk <= hi[2]; kk++) {
+    for (jj = lo[1]; jj <= hi[1]; jj++) {
+      dxy2 = dy2[jj-lo[1]] + dz2[kk-lo[2]];
+      if (dxy2 >= job->krad2) continue;
+      for (ii = lo[0]; ii <= hi[0]; ii++) {
+        d = c[0]-double(ii);
+        dx2 = d*d;
+        rad2 = dxy2 + dx2;
+        if (rad2 < job->krad2) {
+          if (scatter)
+            cm[ii + job->mtx[0]*(jj + job->mtx[1]*kk)] += val*job->kern2[(int64_t)(rad2*job->k2norm)];
+          else
+            sum += cm[ii + job->mtx[0]*(jj + job->mtx[1]*kk)]*job->kern2[(int64_t)(rad2*job->k2norm)];
+          } // if rad2 < krad2
+      } } } // kk,jj,ii
+  return (sum);
+}
+
+void sdcscatter_thread(int *num_threads, int *cur_thread, Array<double> &cmtx, Array<double> &sdc,
+                       sdcjob *job)
+{
+  int64_t t;
+  uint64_t n;
+
+  for (t = *cur_thread; t < job->ntiles; t += *num_threads) {
+    vector<int64_t> &bin = job->bins[t];
+    for (n = 0; n < bin.size(); n++)
+      sdcconv(job, cmtx, bin[n], 1, job->tilestart[t], job->tilestart[t+1]-1);
+    }
+}
+
+void sdcgather_thread(int *num_threads, int *cur_thread, Array<double> &cmtx, Array<double> &sdc,
+                      sdcjob *job)
+{
+  int64_t i, start, stop;
+  double sdcdenom;
+
+  start = (*cur_thread * job->npts) / *num_threads;
+  stop = ((*cur_thread+1) * job->npts) / *num_threads;
+  for (i = start; i < stop; i++) {
+    sdcdenom = sdcconv(job, cmtx, i, 0, 0, job->mtx[job->ndim-1]-1);
+    if (sdcdenom > 0)
+      job->sdc[i] *= job->taper[i]/sdcdenom;
+    } // i
+}
+
+int sdc_threaded(Array<double> &crds, Array<double> &wates, Array<double> &sdc,
+                 Array<double> &cmtx, int64_t numiter, double taper0, double kradscale,
+                 int64_t nthreads)
+{
+  int64_t i, a, m, t, set, nsets, count, mtxl, threads;
+  int64_t lo[3], hi[3];
+  double c0,c1,c2,c3,c4,c5;
+  double x, x2,x3,x4,x5;
+  double maxcrd,crdedge,crdmag,crdnorm,r2,mtxsize;
+  sdcjob job;
+
+  job.ndim = crds.size(0);
+  if (job.ndim < 1 || job.ndim > 3)
+    return (1);
+  job.npts = crds.size(1);
+  nsets = crds.size(2);
+  for (a = 0; a < 3; a++)
+    job.mtx[a] = (a < job.ndim) ? cmtx.size(a) : 1;
+
+/////////////////
+// 1. make kernel, by squared radius
+/////////////////
+// Same fitted kernels and radii as onedsdc(), twodsdc() and threedsdc()
+  if (job.ndim == 3) {
+    c0 = 1.;
+    c1 = 0.04522831;
+    c2 = -3.36020304;
+    c3 = 1.12417012;
+    c4 = 2.82448025;
+    c5 = -1.63447764;
+    job.krad = kradscale*1.93;
+    }
+  else {
+    c0 = 1.;
+    c1 = 0.03056504;
+    c2 = -3.01961845;
+    c3 = 0.6679865;
+    c4 = 2.77924058;
+    c5 = -1.45923643;
+    job.krad = 1.5*1.65;
+    }
+  job.krad2 = job.krad*job.krad;
+  job.k2norm = SDCKERN2SIZE/job.krad2;
+  job.kern2.resize(SDCKERN2SIZE+1);
+  for (m = 0; m <= SDCKERN2SIZE; m++) {
+    // same steps of 1/1000 in radius as the kernel tables above
+    x = floor(1000.*sqrt((m+0.5)/job.k2norm)/job.krad)/1000.;
+    x2 = x*x;
+    x4 = x2*x2;
+    x3 = x*x2;
+    x5 = x*x4;
+    job.kern2[m] = c0 + c1*x + c2*x2 + c3*x3 + c4*x4 + c5*x5;
+    }
+
+// tiles along the last dimension, never thinner than the kernel diameter
+  mtxl = job.mtx[job.ndim-1];
+  job.ntiles = min(4*nthreads, max((int64_t)1, mtxl/(2*(int64_t)job.krad+1)));
+  job.tilestart.resize(job.ntiles+1);
+  for (t = 0; t <= job.ntiles; t++)
+    job.tilestart[t] = (t*mtxl)/job.ntiles;
+  vector<int64_t> rowtile(mtxl);
+  for (t = 0; t < job.ntiles; t++)
+    for (i = job.tilestart[t]; i < job.tilestart[t+1]; i++)
+      rowtile[i] = t;
+
+  job.crds.resize(job.ndim*job.npts);
+  job.taper.resize(job.npts);
+  job.bins.resize(job.ntiles);
+
+  for (set = 0; set < nsets; set++) {
+
+///////////
+// 2. Calculate taper mask, and scale coords to cmtx, as in twodsdc()
+///////////
+    maxcrd = 0;
+    for (i = 0; i < job.npts; i++) {
+      r2 = 0;
+      for (a = 0; a < job.ndim; a++)
+        r2 += crds(a,i,set)*crds(a,i,set);
+      maxcrd = max(maxcrd, r2);
+      }
+    maxcrd = sqrt(maxcrd);
+    crdedge = (1.-taper0)*maxcrd;
+    crdnorm = (taper0 > 0.) ? 1./(maxcrd-crdedge) : 0.;
+    for (i = 0; i < job.npts; i++) {
+      r2 = 0;
+      for (a = 0; a < job.ndim; a++)
+        r2 += crds(a,i,set)*crds(a,i,set);
+      if (r2 > crdedge*crdedge) {
+        crdmag = sqrt(r2);
+        job.taper[i] = (maxcrd-crdmag)*crdnorm;
+        }
+      else
+        job.taper[i] = 1.;
+      }
+    for (i = 0; i < job.npts; i++)
+      for (a = 0; a < job.ndim; a++) {
+        mtxsize = (a < 2) ? cmtx.size(0)-6 : cmtx.size(2)-6;
+        job.crds[i*job.ndim + a] = 3.+((min(max(-.5,crds(a,i,set)),0.5)+0.5)*mtxsize);
+        }
+
+    // bin the points into the tiles they reach
+    for (t = 0; t < job.ntiles; t++)
+      job.bins[t].clear();
+    for (i = 0; i < job.npts; i++) {
+      sdcwindow(&job, i, lo, hi);
+      if (lo[job.ndim-1] > hi[job.ndim-1]) continue;
+      for (t = rowtile[lo[job.ndim-1]]; t <= rowtile[hi[job.ndim-1]]; t++)
+        job.bins[t].push_back(i);
+      }
+
+/////////////
+// 3. Iteratively convolve onto and off of cmtx
+/////////////
+    job.sdc = sdc.data() + set*job.npts;
+    for (i = 0; i < job.npts; i++)
+      job.sdc[i] = wates(i,set);
+
+    for (count=0;count<numiter;count++) {
+      cmtx = 0.;
+
+      // crds -> cmtx
+      threads = max((int64_t)1, min(nthreads, job.ntiles));
+      create_threads3 (threads, sdcscatter_thread, &cmtx, &sdc, &job);
+
+      // cmtx -> crds
+      threads = max((int64_t)1, min(nthreads, job.npts));
+      create_threads3 (threads, sdcgather_thread, &cmtx, &sdc, &job);
+      } // count
+    } // set
+
+  return (0);
+} // sdc_threaded()
+
 /*******************************/
 /* 2D SDC SPIRAL */
 /*******************************/
@@ -40,9 +40,11 @@ Date 2013 Sep
 ***************/
 
 #include "PyFI/PyFI.h"
+#include "multiproc/threads.c"
 using namespace PyFI;
 
 #include <iostream>
+#include <vector>
 using namespace std;
 #include "sdc.cpp"
 
@@ -117,6 +119,36 @@ PYFI_FUNC(threed_sdc)
     PYFI_END(); /* This must be the last line */
 } /* threed_sdc */
 
+/**************************/
+PYFI_FUNC(sdc_sets)
+/**************************/
+{
+    PYFI_START(); /* This must be the first line */
+
+    /* input */
+    PYFI_POSARG(Array<double>, crds);   // (nsets, npts, ndim)
+    PYFI_POSARG(Array<double>, wates);  // (nsets, npts)
+    PYFI_POSARG(Array<int64_t>, mtxdim);
+    PYFI_POSARG(int64_t, numiter);
+    PYFI_POSARG(double, taper);
+
+    PYFI_KWARG(double, kradscale, 1.0); // "kernel radius scale, 3D only (default:1)"
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+
+    if (crds->ndim() != 3 || wates->ndim() != 2 ||
+        crds->size(1) != wates->size(0) || crds->size(2) != wates->size(1))
+        PYFI_ERROR("sdc_sets() expects crds(nsets,npts,ndim) and wates(nsets,npts)");
+
+    Array<double> cmtx(mtxdim->size(), mtxdim->as_ULONG());
+
+    PYFI_SETOUTPUT_ALLOC(Array<double>, sdc, wates->dims_object());
+
+    if (sdc_threaded(*crds,*wates,*sdc,cmtx, *numiter,*taper, *kradscale, *nthreads))
+        PYFI_ERROR("sdc_threaded() has failed");
+
+    PYFI_END(); /* This must be the last line */
+} /* sdc_sets */
+
 /**************************/
 PYFI_FUNC(twod_sdcsp)
 /**************************/
@@ -165,6 +197,7 @@ PYFI_LIST_START_
     PYFI_DESC(oned_sdc, "1D SDC calculation")
     PYFI_DESC(twod_sdc, "2D SDC calculation")
     PYFI_DESC(threed_sdc, "3D SDC calculation")
+    PYFI_DESC(sdc_sets, "1D, 2D or 3D SDC calculation of many sets, threaded")
     PYFI_DESC(twod_sdcsp, "2D SDC spiral calculation")
     PYFI_DESC(threed_sdcsp, "3D SDC spiral calculation")
 PYFI_LIST_END_
@@ -0,0 +1,155 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+''' On-disk cache of sampling density correction weights.
+
+    Iterative SDC of a 3D trajectory can take longer than the reconstruction
+    it is for, while trajectories are usually repeated from a few parameter
+    sets.  The weights from sdc.sdc_sets() are saved here as .npy files, named
+    by a hash of the coordinates, input weights and SDC parameters, so a repeat
+    run only has to load them.
+
+    The cache directory is $GPI_SDC_CACHE if it is set, or else gpi_core/sdc
+    under the user cache directory ($XDG_CACHE_HOME or ~/.cache).  Files are
+    evicted least recently used first to keep the directory under a size cap.
+'''
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+# bump this when sdc_sets() changes its results, so old weights are not reused
+VERSION = 1
+
+
+def cache_dir():
+    '''The directory holding the cached weights.
+    '''
+    path = os.environ.get('GPI_SDC_CACHE')
+    if not path:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(base, 'gpi_core', 'sdc')
+    return path
+
+
+def sdc_key(crds, wates, mtxdim, numiter, taper, kradscale=1.0):
+    '''Hash of the coordinates, weights and parameters that define the SDC.
+    '''
+    crds = np.ascontiguousarray(crds, dtype=np.float64)
+    h = hashlib.sha1(crds.view(np.uint8))
+    if wates is not None:
+        h.update(np.ascontiguousarray(wates, dtype=np.float64).view(np.uint8))
+    h.update(repr((VERSION, crds.shape, wates is None,
+                   [int(m) for m in mtxdim], int(numiter),
+                   float(taper), float(kradscale))).encode())
+    return h.hexdigest()
+
+
+def _entries(path):
+    '''(mtime, size, file) of each cached file, least recently used first.
+    '''
+    entries = []
+    for name in os.listdir(path):
+        if not name.endswith('.npy'):
+            continue
+        fname = os.path.join(path, name)
+        try:
+            st = os.stat(fname)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, fname))
+    entries.sort()
+    return entries
+
+
+def cache_nbytes():
+    '''Total size of the cached weights, in bytes.
+    '''
+    path = cache_dir()
+    if not os.path.isdir(path):
+        return 0
+    return sum(e[1] for e in _entries(path))
+
+
+def clear_cache():
+    path = cache_dir()
+    if not os.path.isdir(path):
+        return
+    for e in _entries(path):
+        try:
+            os.remove(e[2])
+        except OSError:
+            pass
+
+
+def load(key):
+    '''The cached weights for key, or None if there are none.  Loading marks
+       the file as recently used.
+    '''
+    fname = os.path.join(cache_dir(), key + '.npy')
+    try:
+        sdc = np.load(fname)
+        os.utime(fname, None)
+    except (IOError, OSError, ValueError):
+        return None
+    return sdc
+
+
+def save(key, sdc, maxbytes=1024*2**20):
+    '''Store the weights for key, then evict least recently used files until
+       the cache is under maxbytes.  Weights larger than that are not stored.
+    '''
+    sdc = np.asarray(sdc)
+    if sdc.nbytes > maxbytes:
+        return
+    path = cache_dir()
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        # write to a temporary file first, so a half written file is never loaded
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=path)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, sdc)
+        os.replace(tmp, os.path.join(path, key + '.npy'))
+
+        entries = _entries(path)
+        total = sum(e[1] for e in entries)
+        for e in entries:
+            if total <= maxbytes:
+                break
+            os.remove(e[2])
+            total -= e[1]
+    except (IOError, OSError):
+        # the cache is only an optimization
+        pass
@@ -53,10 +53,15 @@ class ExternalNode(gpi.NodeAPI):
     int_out - integer output, given as round(float_out)
     dict_for_reduce - passes the widget type necessary to hook IntegerLoop up to Reduce widget InPort
     float_out - floating point output
+    values_out - in Batch mode, the values of all steps at once (float64, in step order), for nodes that
+                 can process the whole sweep in one vectorised call
+    sweep - current step, number of steps and value, for the Collect node to gather results at
 
     WIDGETS:
     Dimension - when in_array populated, lets user pick dimension to for step to span
     Randomize - output value is either RANDOM or LINEAR, the latter = Minimum + step*(Step Size)
+    Batch - when selected, values_out gets every value of the sweep in one event instead of stepping
+            one value per event cycle (LOOP is ignored)
     LOOP - when selected, step runs from 0 to "Number of Steps"-1
     Continuous - when selected, step returns to 0 after reaching "Number of Steps" and continues to run
     Minimum - value corresponding to step=0 for LINEAR mode, or minimum range of output for RANDOM mode
@@ -76,6 +81,7 @@ class ExternalNode(gpi.NodeAPI):
         # Widgets
         self.addWidget('Slider', 'Dimension', val=0, visible = False)
         self.addWidget('PushButton', 'Randomize', button_title='LINEAR', toggle=True)
+        self.addWidget('PushButton', 'Batch', button_title='OFF', val=0, toggle=True)
         self.addWidget('PushButton', 'LOOP', button_title='OFF', val=0, toggle=True)
         self.addWidget('PushButton', 'Continuous', button_title='OFF', val=0, toggle=True)
         self.addWidget('DoubleSpinBox', 'Minimum', val=0, decimals=5)
@@ -90,12 +96,19 @@ class ExternalNode(gpi.NodeAPI):
         self.addOutPort('int_out', 'INT')
         self.addOutPort('dict_for_Reduce', 'DICT')
         self.addOutPort('float_out', 'FLOAT')
+        self.addOutPort('values_out', 'NPYarray')
+        self.addOutPort('sweep', 'DICT')
 
     def validate(self):
 
         # change button Titles with toggle
         status = self.getVal('LOOP')
         loop_over = self.getVal('Continuous')
+        batch = self.getVal('Batch')
+
+        self.setAttr('Batch', button_title=['OFF', 'ON'][bool(batch)])
+        self.setAttr('LOOP', visible=not batch)
+        self.setAttr('Continuous', visible=not batch)
 
         if status:
           self.setAttr('LOOP', button_title='ON')
@@ -164,6 +177,9 @@ class ExternalNode(gpi.NodeAPI):
         status = self.getVal('LOOP')
         cstep = self.getVal('step')
         loop_over = self.getVal('Continuous')
+        batch = self.getVal('Batch')
+        if batch:
+          status = False
 
         # Mode depends on whether input port is populated
         if indat is None:
@@ -225,6 +241,17 @@ class ExternalNode(gpi.NodeAPI):
         dict_reduce['center'] = round(cvalue)
         dict_reduce['floor'] = round(cvalue)
         self.setData('dict_for_Reduce', dict_reduce)
+        self.setData('sweep', {'step': int(cstep), 'nsteps': int(nstep), 'value': cvalue})
+
+        # the whole sweep at once
+        if batch:
+          if random:
+            values = minv + (maxv-minv)*np.random.random(nstep)
+          else:
+            values = minv + np.arange(nstep)*stepsize
+          self.setData('values_out', values)
+        else:
+          self.setData('values_out', None)
 
         # logic for looping
         if status and (cstep <= nstep-1):
@@ -0,0 +1,132 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Date: 2026oct17
+# Brief: CG / CGNR run to completion in one compute, on an operator.
+
+import gpi
+import numpy as np
+
+
+class ExternalNode(gpi.NodeAPI):
+    """Solves A x = b by conjugate gradients, running all iterations in one compute
+    instead of one per event cycle as the cyclic ConjugateGradient node does.
+    A is applied in-process (see gpi_core.iterate.solvers), so no data goes around the graph.
+
+    INPUTS:
+    A - the operator: a dense matrix (2D array) from any node, or, from a custom node, a
+        gpi_core.iterate.solvers.Operator (forward and adjoint callables, composable with @) or any
+        Python callable.  The core library has no nodes that output operators.
+        CGNR needs the adjoint, which matrices and Operators given one have
+    b - right hand side: for CG, A x = b with A Hermitian positive definite (e.g. the gridded image
+        for A^H A), for CGNR, the measured data
+    x0 - optional initial guess, zero if not connected
+    M - optional preconditioner for CG, an approximation of the inverse of A: an array is a diagonal,
+        multiplied elementwise with the residual (e.g. density compensation weights), anything
+        else is taken as an operator like A
+
+    OUTPUTS:
+    x - the solution
+    residuals - norm of the residual (of the normal equations for CGNR) at each iteration,
+                starting with the initial one; iterations x right hand sides with Batch
+
+    WIDGETS:
+    Status - iterations done and the final relative residual
+    Method - CG for Hermitian positive definite A, CGNR for least squares (A^H A x = A^H b)
+    Max Iterations - stop after this many iterations
+    Tolerance - stop early once the residual falls below this fraction of the initial one (0: never)
+    Batch - the first dimension of b (and x0) indexes separate right hand sides (e.g. coils or slices),
+            solved together with one application of A per iteration, each with its own step sizes
+            and stopping once it converges; A (and M) must then act on the whole stack
+    """
+
+    def initUI(self):
+        # Widgets
+        self.addWidget('TextBox', 'Status', val='')
+        self.addWidget('ExclusivePushButtons', 'Method', buttons=['CG', 'CGNR'], val=0)
+        self.addWidget('SpinBox', 'Max Iterations', min=0, max=100000, val=20)
+        self.addWidget('DoubleSpinBox', 'Tolerance', min=0., max=1., val=0., decimals=8,
+                       singlestep=0.0001)
+        self.addWidget('PushButton', 'Batch', toggle=True)
+
+        # IO Ports
+        self.addInPort('A', 'PASS', obligation=gpi.REQUIRED)
+        self.addInPort('b', 'NPYarray', obligation=gpi.REQUIRED)
+        self.addInPort('x0', 'NPYarray', obligation=gpi.OPTIONAL)
+        self.addInPort('M', 'PASS', obligation=gpi.OPTIONAL)
+        self.addOutPort('x', 'NPYarray')
+        self.addOutPort('residuals', 'NPYarray')
+
+    def validate(self):
+        import gpi_core.iterate.solvers as so
+
+        try:
+            A = so.aslinear(self.getData('A'))
+            so.aspreconditioner(self.getData('M'))
+        except (TypeError, ValueError) as e:
+            self.log.warn(str(e))
+            return 1
+        if self.getVal('Method') == 1 and A.adjoint is None:
+            self.log.warn("CGNR needs an operator with an adjoint")
+            return 1
+        if self.getVal('Method') == 1 and self.getData('M') is not None:
+            self.log.warn("the preconditioner is only used by CG")
+
+        return 0
+
+    def compute(self):
+
+        import gpi_core.iterate.solvers as so
+
+        method = ['CG', 'CGNR'][self.getVal('Method')]
+        kwargs = {'batch': self.getVal('Batch')}
+        if method == 'CG':
+            kwargs['M'] = self.getData('M')
+        x, resids = so.SOLVERS[method](self.getData('A'), self.getData('b'),
+                                       x0=self.getData('x0'),
+                                       maxiter=self.getVal('Max Iterations'),
+                                       tol=self.getVal('Tolerance'), **kwargs)
+
+        # the worst of the right hand sides with Batch
+        r0 = np.atleast_1d(resids[0])
+        rel = np.max(np.where(r0 > 0, np.atleast_1d(resids[-1])/np.where(r0 > 0, r0, 1.), 0.))
+        self.setAttr('Status', val='%d iterations, residual %.3g' % (len(resids)-1, rel))
+        self.setData('x', x)
+        self.setData('residuals', resids)
+
+        return 0
+
+    def execType(self):
+        # operators may be closures over in-memory data, which don't cross processes
+        return gpi.GPI_THREAD
@@ -0,0 +1,138 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+
+# Date: 2026oct17
+# Brief: Gathers the results of a parameter sweep into a preallocated array.
+
+import gpi
+import numpy as np
+
+
+class ExternalNode(gpi.NodeAPI):
+    """Collects the result of each step of a parameter sweep (e.g. driven by AutoNum) into one array,
+    with the sweep as a new first dimension.  Unlike Glue, the output is allocated once for all the
+    points, rather than copied to grow by one point per step, and by default it is only sent on when
+    every point has arrived, so downstream nodes run once for the whole sweep.
+
+    INPUTS:
+    in - the result of one sweep step; all steps must have the same shape
+    sweep - optional, the sweep output of AutoNum: each result is stored at the current step and the
+            number of points follows the Number of Steps; without it results are stored in arrival order
+
+    OUTPUT:
+    out - the collected results, (points,) + shape of in
+
+    WIDGETS:
+    Collected - how many points have arrived so far
+    Number of Points - length of the sweep
+    Output - When Full: send the output once every point has arrived, Every Point: send the points
+             up to the last one collected after each one (points that have not arrived are zero)
+    Clear - discard the collected results and start again
+    """
+
+    def initUI(self):
+        # Widgets
+        self.addWidget('TextBox', 'Collected', val='0')
+        self.addWidget('SpinBox', 'Number of Points', min=1, max=2**31-1, val=2)
+        self.addWidget('ExclusivePushButtons', 'Output', buttons=['When Full', 'Every Point'], val=0)
+        self.addWidget('PushButton', 'Clear')
+
+        # IO Ports
+        self.addInPort('in', 'NPYarray')
+        self.addInPort('sweep', 'DICT', obligation=gpi.OPTIONAL)
+        self.addOutPort('out', 'NPYarray')
+
+        self.buf = None
+        self.filled = None
+        self.last = None
+
+    def validate(self):
+
+        sweep = self.getData('sweep')
+        if sweep is not None:
+            self.setAttr('Number of Points', val=sweep['nsteps'])
+        self.setAttr('Number of Points', visible=sweep is None)
+
+        return 0
+
+    def compute(self):
+
+        data = self.getData('in')
+        sweep = self.getData('sweep')
+        npts = self.getVal('Number of Points')
+
+        if self.getVal('Clear') or 'Number of Points' in self.widgetEvents():
+            self.buf = None
+            self.last = None
+
+        # AutoNum repeats the last step as it stops; sweeps start at step 0
+        if sweep is not None and self.buf is None and sweep['step'] == self.last != 0:
+            return 0
+        if self.buf is not None and (self.buf.shape != (npts,) + data.shape or
+                                     self.buf.dtype != data.dtype):
+            if self.filled.any():
+                self.log.warn("the shape of the results changed, starting again")
+            self.buf = None
+        if self.buf is None:
+            self.buf = np.zeros((npts,) + data.shape, dtype=data.dtype)
+            self.filled = np.zeros(npts, dtype=bool)
+
+        if sweep is not None:
+            i = sweep['step']
+        else:
+            # the next point in arrival order
+            i = int(np.argmin(self.filled))
+        if i >= npts:
+            self.log.warn("step %d is beyond the %d points" % (i, npts))
+            return 1
+        self.buf[i] = data
+        self.filled[i] = True
+
+        n = int(np.count_nonzero(self.filled))
+        self.setAttr('Collected', val=str(n))
+        if n == npts:
+            # a new array for the next sweep, so this one stays as sent
+            self.setData('out', self.buf)
+            self.buf = None
+            self.last = i
+        elif self.getVal('Output') == 1:
+            # a copy, the buffer keeps filling while downstream nodes use it
+            self.setData('out', self.buf[:np.flatnonzero(self.filled)[-1]+1].copy())
+
+        return 0
+
+    def execType(self):
+        # the partly filled buffer is kept in this process between steps
+        return gpi.GPI_THREAD
@@ -36,7 +36,6 @@
 # Date: 2012dec10
 
 import gpi
-import numpy as np
 
 
 class ExternalNode(gpi.NodeAPI):
@@ -49,17 +48,23 @@ class ExternalNode(gpi.NodeAPI):
     The node will automatically step through a specified number of iterations
 
     So we are solving for Ax = b
-    INPUTS: The first four inputs are initialization, the last one is for iteration
-    d_in - initial guess for direction to move, equals b-Ax (Eq. 45)
-    r_in - initial guess, same as d_in, equals b-Ax (Eq. 45)
+    INPUTS: The first four inputs are initialization, Adloop_in is for iteration
+    d_in - initial guess for direction to move, equals b-Ax (Eq. 45), or M(b-Ax) with a preconditioner
+    r_in - initial guess, equals b-Ax (Eq. 45)
     x_in - initial guess for x
     Ad_in - matrix A times d_in
     Adloop_in - used during iterations, this takes A multiplied by d_out (below)
+    M_in - optional diagonal preconditioner (an approximation of the inverse of the diagonal of A,
+           e.g. density compensation weights), multiplied elementwise with the residual; with Batch
+           it applies to every vector
 
     OUTPUTS:
     d_out - multiply this vector by A and send back to Adloop_in
     r_out - not really used, just FYI
     x_out - the final answer
+    history - record array of the iterations since Reset (iteration 0 is the initial guess): residual
+              norm |r|, step size |x(i+1)-x(i)|, wall time of the iteration (the whole trip around the
+              network) and since Reset in seconds, and peak memory in MB
 
     WIDGETS:
     Current Iteration - lets you know which iteration is being performed
@@ -67,6 +72,14 @@ class ExternalNode(gpi.NodeAPI):
     Start/Stop - click on to start, click off to stop before iterations are done
     Step - click to step through one more iteration
     Reset - click to reset iteration count and begin with initial conditions
+    Tolerance - stop once |r| falls below this fraction of the initial |r|, even before Max Iteration
+                (0: always run Max Iteration)
+    Log File - optional .csv or .json file the history is written to after every iteration
+    Batch - the first dimension of the inputs indexes separate right hand sides (e.g. coils or
+            slices) solved together, each with its own step sizes; A must then act on the whole stack
+
+    CGSolve runs all iterations in one compute on an operator, which is much faster when the
+    operator can be given as a Python callable
     """
 
     def initUI(self):
@@ -76,6 +89,11 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget(wdg='PushButton', title='Start/Stop', toggle=True)
         self.addWidget(wdg='PushButton', title='Step')
         self.addWidget(wdg='PushButton', title='Reset')
+        self.addWidget(wdg='DoubleSpinBox', title='Tolerance', min=0., max=1., val=0., decimals=8,
+                       singlestep=0.0001)
+        self.addWidget(wdg='SaveFileBrowser', title='Log File', button_title='Browse',
+                       caption='Save File (*.csv, *.json)', filter='csv (*.csv);;json (*.json)')
+        self.addWidget(wdg='PushButton', title='Batch', toggle=True)
 
         # IO Ports
         self.addInPort(title='d_in', type='NPYarray')
@@ -83,10 +101,16 @@ class ExternalNode(gpi.NodeAPI):
         self.addInPort(title='x_in', type='NPYarray')
         self.addInPort(title='Ad_in', type='NPYarray')
         self.addInPort(title='Adloop_in', type='NPYarray', obligation=gpi.OPTIONAL, cyclic=True)
+        self.addInPort(title='M_in', type='NPYarray', obligation=gpi.OPTIONAL)
 
         self.addOutPort(title='d_out', type='NPYarray')
         self.addOutPort(title='r_out', type='NPYarray')
         self.addOutPort(title='x_out', type='NPYarray')
+        self.addOutPort(title='history', type='NPYarray')
+
+        import gpi_core.iterate.monitor as monitor
+        self.history = monitor.History()
+        self.URI = gpi.TranslateFileURI
 
     def validate(self):
         '''This function runs before compute() as a GPI_APPLOOP exec-type.
@@ -97,7 +121,8 @@ class ExternalNode(gpi.NodeAPI):
         '''
 
         # if init changes then reset the count and stop iteration
-        if set(self.portEvents()).intersection(set(['d_in', 'r_in', 'x_in', 'Ad_in'])):
+        if set(self.portEvents()).intersection(set(['d_in', 'r_in', 'x_in', 'Ad_in', 'M_in'])) \
+           or 'Batch' in self.widgetEvents():
             self.setAttr('Reset', val=True)
 
         return 0
@@ -105,6 +130,8 @@ class ExternalNode(gpi.NodeAPI):
     def compute(self):
         '''This is where the main algorithm should be implemented.
         '''
+        import gpi_core.iterate.monitor as monitor
+
         reset = self.getVal('Reset')
         on = self.getVal('Start/Stop')
         iternum = int(self.getVal('Current Iteration'))
@@ -126,9 +153,11 @@ class ExternalNode(gpi.NodeAPI):
             self.setData('d_out', d_in)
             self.setData('r_out', r_in)
             self.setData('x_out', x_in)
+            self.history.start(monitor.norm(r_in))
+            self.setData('history', self.history.array)
 
         elif on:
-            if iternum >= maxiter:
+            if iternum >= maxiter or self.history.converged(self.getVal('Tolerance')):
                 self.setAttr('Start/Stop', val=False)
                 return 0
             elif iternum == 0:
@@ -144,6 +173,7 @@ class ExternalNode(gpi.NodeAPI):
                 self.setData('d_out', d_out)
                 self.setData('r_out', r_out)
                 self.setData('x_out', x_out)
+                self.log_iteration(r_out, x_out, x_in)
 
             else:
                 self.setAttr('Current Iteration', val=str(iternum+1))
@@ -160,6 +190,7 @@ class ExternalNode(gpi.NodeAPI):
                 self.setData('d_out', d_out)
                 self.setData('r_out', r_out)
                 self.setData('x_out', x_out)
+                self.log_iteration(r_out, x_out, x_in)
         else:
             self.setData('d_out', None)
             self.setData('r_out', None)
@@ -172,34 +203,21 @@ class ExternalNode(gpi.NodeAPI):
         return gpi.GPI_THREAD
 
 
-    def do_cg(self, d_in, r_in, x_in, Ad_in):
-
-        d_out = np.zeros_like(d_in)
-        r_out = np.zeros_like(r_in)
-        x_out = np.zeros_like(x_in)
-
-        # Calculate alpha
-        # r^H r / (d^H Ad)
-        rHr = np.dot(np.conj(r_in.flatten()), r_in.flatten()) 
-        dHAd = np.dot(np.conj(d_in.flatten()), Ad_in.flatten())
-        alpha = rHr/dHAd
-
-        # Calculate x(i+1)
-        # x(i) + alpha d(i)
-        x_out = x_in + alpha * d_in
+    def log_iteration(self, r_out, x_out, x_in):
+        import gpi_core.iterate.monitor as monitor
 
-        # Calculate r(i+1)
-        # r(i) - alpha Ad(i)
-        r_out = r_in - alpha * Ad_in
+        self.history.record(monitor.norm(r_out), monitor.norm(x_out - x_in))
+        self.setData('history', self.history.array)
 
-        # Calculate beta
-        # r(i+1)^H r(i+1) / (r(i)^H r(i))
-        r1Hr1 = np.dot(np.conj(r_out.flatten()), r_out.flatten()) 
-        beta = r1Hr1 / rHr
+        fname = self.URI(self.getVal('Log File') or '')
+        if fname:
+            self.history.write(fname)
 
-        # Calculate d(i+1)
-        # r(i+1) + beta d(i)
-        d_out = r_out + beta * d_in
-
-        return (d_out, r_out, x_out)
+    def do_cg(self, d_in, r_in, x_in, Ad_in):
+        import gpi_core.iterate.solvers as so
 
+        # alpha = r^H M r / (d^H Ad), x(i+1) = x(i) + alpha d(i), r(i+1) = r(i) - alpha Ad(i)
+        # beta = r(i+1)^H M r(i+1) / (r(i)^H M r(i)), d(i+1) = M r(i+1) + beta d(i)
+        # per vector with Batch
+        return so.cg_step(d_in, r_in, x_in, Ad_in, M=self.getData('M_in'),
+                          batch=self.getVal('Batch'))
@@ -36,6 +36,7 @@
 # Date: 2012dec10
 
 import gpi
+import numpy as np
 
 
 class ExternalNode(gpi.NodeAPI):
@@ -46,14 +47,21 @@ class ExternalNode(gpi.NodeAPI):
     n+1 - input for iterations, typically data taken from output "n" and processed 
     n_0 - initial condition
 
-    OUTPUT:
+    OUTPUTS:
     n - value of data at nth iteration
+    history - record array of the iterations since the start: as 'residual' the relative change
+              |n(i+1)-n(i)|/|n(i)| and as 'step' the change |n(i+1)-n(i)| (NaN unless the data are
+              arrays), wall time of the iteration (the whole trip around the network) and since the
+              start in seconds, and peak memory in MB
 
     WIDGETS:
     Current Iteration - reports current iteration index
     Max Iteration - enter number of desired iterations
     Start/Stop - starts/stops iterations
     Reset - resets iteration count to zero and data to initial condition (at input n_0)
+    Tolerance - stop once the relative change of the data falls below this, even before
+                Max Iteration (0: always run Max Iteration)
+    Log File - optional .csv or .json file the history is written to after every iteration
     """
 
     def initUI(self):
@@ -62,11 +70,20 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget(wdg='SpinBox', title='Max Iteration', min=0)
         self.addWidget(wdg='PushButton', title='Start/Stop', toggle=True)
         self.addWidget(wdg='PushButton', title='Reset')
+        self.addWidget(wdg='DoubleSpinBox', title='Tolerance', min=0., max=1., val=0., decimals=8,
+                       singlestep=0.0001)
+        self.addWidget(wdg='SaveFileBrowser', title='Log File', button_title='Browse',
+                       caption='Save File (*.csv, *.json)', filter='csv (*.csv);;json (*.json)')
 
         # IO Ports
         self.addInPort(title='n+1', type='PASS', obligation=gpi.OPTIONAL, cyclic=True)
         self.addInPort(title='n_0', type='PASS', obligation=gpi.REQUIRED)
         self.addOutPort(title='n', type='PASS')
+        self.addOutPort(title='history', type='NPYarray')
+
+        import gpi_core.iterate.monitor as monitor
+        self.history = monitor.History()
+        self.URI = gpi.TranslateFileURI
 
     def validate(self):
         '''This function runs before compute() as a GPI_APPLOOP exec-type.
@@ -85,28 +102,43 @@ class ExternalNode(gpi.NodeAPI):
     def compute(self):
         '''This is where the main algorithm should be implemented.
         '''
+        import gpi_core.iterate.monitor as monitor
+
         reset = self.getVal('Reset')
         on = self.getVal('Start/Stop')
         iternum = int(self.getVal('Current Iteration'))
         maxiter = self.getVal('Max Iteration')
         np1 = self.getData('n+1')
         init = self.getData('n_0')
+        n = self.getData('n')
 
         if reset:
             self.setAttr('Start/Stop', val=False)
             self.setAttr('Current Iteration', val='0')
             self.setData('n', init)
+            self.history.start()
+            self.setData('history', self.history.array)
 
         elif on:
-            if iternum >= maxiter:
+            if iternum >= maxiter or self.history.converged(self.getVal('Tolerance'), relative=False):
                 self.setAttr('Start/Stop', val=False)
                 return 0
             elif iternum == 0:
                 self.setAttr('Current Iteration', val=str(iternum+1))
                 self.setData('n', init)
+                self.history.start()
             else:
                 self.setAttr('Current Iteration', val=str(iternum+1))
+                step, size = np.nan, np.nan
+                if self.comparable(np1, n):
+                    step, size = monitor.norm(np1 - n), monitor.norm(n)
+                self.history.record(step/size if size > 0 else np.nan, step)
                 self.setData('n', np1)
+            self.setData('history', self.history.array)
+
+            fname = self.URI(self.getVal('Log File') or '')
+            if fname:
+                self.history.write(fname)
 
         else:
             self.setData('n', None)
@@ -116,6 +148,9 @@ class ExternalNode(gpi.NodeAPI):
 
         return 0
 
+    def comparable(self, a, b):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.shape == b.shape
+
     def execType(self):
         '''Could be GPI_THREAD, GPI_PROCESS, GPI_APPLOOP'''
         return gpi.GPI_THREAD
@@ -0,0 +1,132 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+''' Convergence history of iterative nodes.
+
+    A History collects one record per iteration: the residual norm, the size
+    of the step taken, the wall time of the iteration (for the cyclic nodes
+    this is the whole trip around the network) and the peak memory of the
+    process.  It is returned as a NumPy record array for the 'history' ports
+    and can be written to .csv or .json files for tuning iteration counts.
+'''
+
+import time
+import numpy as np
+
+# peak resident memory, in kilobytes on Linux but bytes on OS X
+try:
+    import resource
+    import sys
+    _RSS_SCALE = 2.**-20 if sys.platform == 'darwin' else 2.**-10
+except ImportError:
+    resource = None
+
+HISTORY_DTYPE = np.dtype([('iteration', np.int64), ('residual', np.float64),
+                          ('step', np.float64), ('time', np.float64),
+                          ('elapsed', np.float64), ('memory', np.float64)])
+
+
+def peak_memory():
+    '''Peak resident memory of this process in MB (NaN where unknown).
+    '''
+    if resource is None:
+        return np.nan
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*_RSS_SCALE
+
+
+def norm(x):
+    '''2-norm of an array, NaN for anything else.
+    '''
+    if not isinstance(x, np.ndarray):
+        return np.nan
+    return np.sqrt(np.vdot(x, x).real)
+
+
+class History(object):
+    '''Records of the iterations since the last start().  time is the wall time
+       since the previous record (or start()), elapsed since start(), both in
+       seconds; memory is the peak memory in MB.
+    '''
+
+    def __init__(self):
+        self.start()
+
+    def start(self, residual=np.nan):
+        '''Clear the history, with the residual of the initial guess as
+           iteration 0.
+        '''
+        self._t0 = self._t = time.time()
+        self._records = []
+        self.record(residual, np.nan)
+
+    def record(self, residual, step):
+        t = time.time()
+        self._records.append((len(self._records), residual, step, t-self._t,
+                              t-self._t0, peak_memory()))
+        self._t = t
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def array(self):
+        return np.rec.array(self._records, dtype=HISTORY_DTYPE)
+
+    def converged(self, tol, relative=True):
+        '''Whether the last residual is at most tol times the initial one, or
+           tol itself if not relative (never for tol 0, or if the residuals
+           are unknown).
+        '''
+        r = self._records[-1][1]
+        if relative:
+            r0 = self._records[0][1]
+            return tol > 0. and len(self) > 1 and r <= tol*r0
+        return tol > 0. and len(self) > 1 and r <= tol
+
+    def write(self, fname):
+        '''Write the history to a .json file (a list of records) or else
+           a .csv file with a header line.
+        '''
+        if fname.lower().endswith('.json'):
+            import json
+            recs = [dict(zip(HISTORY_DTYPE.names, [r[0]] + [None if np.isnan(v) else v for v in r[1:]]))
+                    for r in self._records]
+            with open(fname, 'w') as f:
+                json.dump(recs, f, indent=1)
+        else:
+            import csv
+            with open(fname, 'w') as f:
+                w = csv.writer(f)
+                w.writerow(HISTORY_DTYPE.names)
+                w.writerows(self._records)
@@ -0,0 +1,322 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+''' In-process iterative solvers.
+
+    cg() and cgnr() run the whole iteration in one call, on an Operator (or
+    anything aslinear() can make one of: a callable, a dense matrix).  The
+    vectors are updated in place, with BLAS axpy when scipy is available,
+    and the iteration stops early once the residual norm falls below
+    tol times its starting value.
+
+    Both can solve a stack of right hand sides at once (batch=True), so that
+    each application of the operator serves every vector, and cg() takes a
+    diagonal or operator preconditioner.
+
+    CG follows the nomenclature of Jonathan Richard Shewchuk, An Introduction
+    to the Conjugate Gradient Method Without the Agonizing Pain (eqs. 45-49),
+    as the ConjugateGradient node does; CGNR is CG on the normal equations
+    A^H A x = A^H b, without forming A^H A.
+'''
+
+import numpy as np
+
+
+class Operator(object):
+    '''A linear operator given by its forward (and optionally adjoint)
+       callables.  Operators compose with @, e.g. B @ A applies A, then B.
+    '''
+
+    def __init__(self, forward, adjoint=None, name=None):
+        self.forward = forward
+        self.adjoint = adjoint
+        self.name = name or getattr(forward, '__name__', 'A')
+
+    def __call__(self, x):
+        return self.forward(x)
+
+    @property
+    def H(self):
+        if self.adjoint is None:
+            raise ValueError("operator '%s' has no adjoint" % self.name)
+        return Operator(self.adjoint, self.forward, self.name+'^H')
+
+    def __matmul__(self, other):
+        other = aslinear(other)
+        adjoint = None
+        if self.adjoint is not None and other.adjoint is not None:
+            adjoint = lambda y: other.adjoint(self.adjoint(y))
+        return Operator(lambda x: self.forward(other.forward(x)), adjoint,
+                        self.name+' '+other.name)
+
+    def normal(self):
+        '''A^H A'''
+        return self.H @ self
+
+
+def aslinear(a):
+    '''An Operator of a (an Operator, a callable or a dense matrix).  A matrix
+       acts on the last axis, so it also applies to a stack of vectors.
+    '''
+    if isinstance(a, Operator):
+        return a
+    if isinstance(a, np.ndarray):
+        if a.ndim != 2:
+            raise ValueError("a matrix operator must be 2 dimensional")
+        return Operator(lambda x: np.dot(x, a.T), lambda y: np.dot(y, a.conj()), 'matrix')
+    if callable(a):
+        return Operator(a)
+    raise TypeError("can't make a linear operator of %s" % type(a).__name__)
+
+
+def norm2(x):
+    '''Squared 2-norm of x, without flattening copies.
+    '''
+    return float(np.vdot(x, x).real)
+
+
+def _axpy_blas(x):
+    try:
+        from scipy.linalg.blas import get_blas_funcs
+    except ImportError:
+        return None
+    if x.dtype.char not in 'fdFD' or not x.flags.c_contiguous:
+        return None
+    return get_blas_funcs('axpy', (x,))
+
+
+def axpy(a, x, y, tmp=None):
+    '''y += a*x, in place.  tmp is scratch of the shape of x, used when
+       BLAS is not available.
+    '''
+    blas = _axpy_blas(y)
+    if blas is not None and x.dtype == y.dtype and x.flags.c_contiguous:
+        blas(x.reshape(-1), y.reshape(-1), a=a)
+        return y
+    if tmp is None:
+        y += a*x
+    else:
+        np.multiply(x, a, out=tmp)
+        y += tmp
+    return y
+
+
+def aspreconditioner(M):
+    '''A callable applying the preconditioner M (an approximation of A^-1):
+       an array is a diagonal, applied elementwise (e.g. density compensation
+       weights), anything else is made an Operator.
+    '''
+    if M is None:
+        return None
+    if isinstance(M, np.ndarray):
+        return lambda r: r*M
+    return aslinear(M)
+
+
+def _start(b, x0):
+    b = np.asarray(b)
+    dtype = np.result_type(b.dtype, np.float32)
+    if x0 is None:
+        return np.zeros(b.shape, dtype=dtype)
+    return np.array(x0, dtype=np.result_type(np.asarray(x0).dtype, dtype), copy=True, order='C')
+
+
+def _stack(v, batch):
+    '''v as a stack of vectors along axis 0 (a view).
+    '''
+    return v if batch else v[np.newaxis]
+
+
+def _dots(u, v):
+    '''Real part of the inner product of each pair of vectors in the stacks.
+    '''
+    return np.array([np.vdot(u[k], v[k]).real for k in range(len(u))])
+
+
+def _result(x, resids, batch):
+    resids = np.array(resids)
+    return x, (resids if batch else resids[:, 0])
+
+
+def cg(A, b, x0=None, maxiter=100, tol=0., callback=None, M=None, batch=False):
+    '''Solve A x = b for Hermitian positive definite A by (preconditioned)
+       conjugate gradients.  Returns x and the residual norms |r| of each
+       iteration, starting with the initial one.
+
+       M is an optional preconditioner (see aspreconditioner()).  If batch,
+       axis 0 of b (and x0) indexes right hand sides that share the operator:
+       A (and M) are applied to the whole stack, each vector has its own
+       alpha and beta and stops updating once it has converged, and the
+       residuals are (iterations+1, nrhs).  callback(i, x, |r|) is called
+       after every iteration and stops it if it returns True.
+    '''
+    A = aslinear(A)
+    M = aspreconditioner(M)
+    x = _start(b, x0)
+    r = np.array(b, dtype=x.dtype, copy=True, order='C')
+    if x0 is not None:
+        Ax = np.asarray(A(x))
+        r = r.astype(np.result_type(r.dtype, Ax.dtype), copy=False)
+        r -= Ax
+    z = r if M is None else np.asarray(M(r))
+    d = np.array(z, dtype=np.result_type(r.dtype, z.dtype), copy=True, order='C')
+
+    # a complex A (or M) makes the vectors complex for real data, as the
+    # first application of A shows
+    Ad = np.asarray(A(d))
+    dtype = np.result_type(x.dtype, d.dtype, Ad.dtype)
+    x, r, d = [v.astype(dtype, copy=False) for v in (x, r, d)]
+    z = r if M is None else z.astype(dtype, copy=False)
+    tmp = np.empty_like(x)
+    X, R, Z, D, T = [_stack(v, batch) for v in (x, r, z, d, tmp)]
+
+    rz = _dots(R, Z)
+    rr = rz if M is None else _dots(R, R)
+    resids = [np.sqrt(rr)]
+    stop = (tol*resids[0])**2
+    for i in range(maxiter):
+        active = (rr > stop) & (rr > 0.)
+        if not active.any():
+            break
+        if Ad is None:
+            Ad = np.asarray(A(d), dtype=x.dtype)
+        AD = _stack(Ad.astype(x.dtype, copy=False), batch)
+        Ad = None
+        dAd = _dots(D, AD)
+        alpha = np.where(active, rz/np.where(active, dAd, 1.), 0.)     # Eq. 46
+        for k in np.flatnonzero(active):
+            axpy(alpha[k], D[k], X[k], T[k])                          # Eq. 47
+            axpy(-alpha[k], AD[k], R[k], T[k])                        # Eq. 48
+        if M is not None:
+            z = np.asarray(M(r), dtype=x.dtype)
+            Z = _stack(z, batch)
+        rz1 = _dots(R, Z)
+        beta = np.where(active, rz1/np.where(rz > 0., rz, 1.), 0.)
+        for k in range(len(D)):                                       # Eq. 49
+            D[k] *= beta[k]
+            D[k] += Z[k]
+        rz = rz1
+        rr = rz if M is None else _dots(R, R)
+        resids.append(np.sqrt(rr))
+        if callback is not None and callback(i+1, x, resids[-1] if batch else resids[-1][0]):
+            break
+
+    return _result(x, resids, batch)
+
+
+def cgnr(A, b, x0=None, maxiter=100, tol=0., callback=None, batch=False):
+    '''Least squares solution of A x = b by conjugate gradients on the normal
+       equations, A^H A x = A^H b.  A needs an adjoint.  Returns x and the
+       normal residual norms |A^H r| of each iteration, starting with the
+       initial one.  batch and callback(i, x, |A^H r|) are as for cg().
+    '''
+    A = aslinear(A)
+    AH = A.H
+    b = np.asarray(b)
+    r = np.array(b, dtype=np.result_type(b.dtype, np.float32), copy=True, order='C')
+    if x0 is None:
+        z = np.asarray(AH(r))
+        x = np.zeros(z.shape, dtype=np.result_type(z.dtype, r.dtype))
+    else:
+        x = _start(r, x0)
+        Ax = np.asarray(A(x))
+        r = r.astype(np.result_type(r.dtype, Ax.dtype), copy=False)
+        r -= Ax
+        z = np.asarray(AH(r))
+        x = x.astype(np.result_type(x.dtype, z.dtype), copy=False)
+    # a complex A makes the residual complex for real data
+    r = r.astype(np.result_type(r.dtype, x.dtype), copy=False)
+    z = np.array(z, dtype=x.dtype, copy=True, order='C')
+    p = z.copy()
+    tmpx = np.empty_like(x)
+    tmpr = np.empty_like(r)
+    X, Rs, Z, P, TX, TR = [_stack(v, batch) for v in (x, r, z, p, tmpx, tmpr)]
+
+    zz = _dots(Z, Z)
+    resids = [np.sqrt(zz)]
+    stop = (tol*resids[0])**2
+    for i in range(maxiter):
+        active = (zz > stop) & (zz > 0.)
+        if not active.any():
+            break
+        W = _stack(np.asarray(A(p), dtype=r.dtype), batch)
+        ww = _dots(W, W)
+        alpha = np.where(active, zz/np.where(active, ww, 1.), 0.)
+        for k in np.flatnonzero(active):
+            axpy(alpha[k], P[k], X[k], TX[k])
+            axpy(-alpha[k], W[k], Rs[k], TR[k])
+        Z = _stack(np.asarray(AH(r), dtype=x.dtype), batch)
+        zz1 = _dots(Z, Z)
+        beta = np.where(active, zz1/np.where(zz > 0., zz, 1.), 0.)
+        for k in range(len(P)):
+            P[k] *= beta[k]
+            P[k] += Z[k]
+        zz = zz1
+        resids.append(np.sqrt(zz))
+        if callback is not None and callback(i+1, x, resids[-1] if batch else resids[-1][0]):
+            break
+
+    return _result(x, resids, batch)
+
+
+def cg_step(d, r, x, Ad, M=None, batch=False):
+    '''One (preconditioned) CG iteration, as the cyclic ConjugateGradient node
+       takes it: given the direction d, residual r, estimate x and A d,
+       returns the next d, r and x (new arrays).  With a preconditioner the
+       first direction is M r.  alpha and beta are per vector if batch.
+    '''
+    M = aspreconditioner(M)
+    dtype = np.result_type(d, r, x, Ad)
+    z = r if M is None else M(r)
+    D, R, Z, AD = [_stack(np.asarray(v), batch) for v in (d, r, z, Ad)]
+
+    rz = _dots(R, Z)                                                  # Eq. 46
+    dAd = _dots(D, AD)
+    alpha = np.where(dAd != 0., rz/np.where(dAd != 0., dAd, 1.), 0.)
+    shape = (len(D),) + (1,)*(D.ndim-1)
+    alpha = alpha.reshape(shape)
+
+    X = _stack(np.asarray(x), batch) + alpha*D                        # Eq. 47
+    R1 = R - alpha*AD                                                 # Eq. 48
+    r1 = R1 if batch else R1[0]
+    Z1 = R1 if M is None else _stack(M(r1), batch)
+    rz1 = _dots(R1, Z1)
+    beta = np.where(rz != 0., rz1/np.where(rz != 0., rz, 1.), 0.)
+    D1 = Z1 + beta.reshape(shape)*D                                   # Eq. 49
+
+    if not batch:
+        D1, R1, X = D1[0], R1[0], X[0]
+    return D1.astype(dtype, copy=False), R1.astype(dtype, copy=False), X.astype(dtype, copy=False)
+
+
+SOLVERS = {'CG': cg, 'CGNR': cgnr}
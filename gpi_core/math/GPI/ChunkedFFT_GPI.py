@@ -0,0 +1,172 @@
+# Copyright (c) 2014, Dignity Health
+#
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+#
+#     Under either license, the following additional term applies:
+#
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+#
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+#
+#         This file is part of the GPI core node library.
+#
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+#
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Date: 2026oct17
+# Brief: FFT of .npy or HDF5 files too large to hold in memory.
+
+import gpi
+import os
+import numpy as np
+
+class ExternalNode(gpi.NodeAPI):
+    """Centered FFT of a data set on disk that is too large for memory, e.g. 4D flow or high
+    resolution 3D data.  The input file is read a slab at a time, each slab is transformed
+    in memory and the result is written to a memory-mapped .npy file, so memory use is
+    bounded by 'Memory (MB)' rather than the size of the data.  Slabs are taken along an axis
+    that is not transformed; if all are, it takes two passes over the data.
+
+    OUTPUT - the transformed data, complex64, as a read-only memory map of the output file.
+             DC is at index N/2 (starting at 0)
+
+    WIDGETS:
+    I/O Info - shape and type of the input
+    Input File - .npy file, or HDF5 file (*.h5, *.hdf5)
+    dataset - the dataset to transform, for HDF5 files
+    Output File - .npy file for the result (must not be the input file)
+    Dimension i - transform the ith dimension
+    inverse - inverse FFT (scaled by 1/N) instead of forward
+    Memory (MB) - memory budget for the slabs; if one index along an untransformed axis does not fit,
+                  the transform takes two passes, and a warning is given if it cannot be met at all
+    Threads - threads for the transform of each slab; 0 uses all cores
+    compute - compute
+    """
+
+    def execType(self):
+        # the output is a memory map of the file, not to be copied between processes
+        return gpi.GPI_THREAD
+
+    def initUI(self):
+
+        # Widgets
+        self.addWidget('TextBox', 'I/O Info:')
+        self.addWidget('OpenFileBrowser', 'Input File', button_title='Browse',
+                       caption='Open File', filter='numpy (*.npy);;hdf5 (*.h5 *.hdf5)')
+        self.addWidget('ComboBox', 'dataset')
+        self.addWidget('SaveFileBrowser', 'Output File', button_title='Browse',
+                       caption='Save File (*.npy)', filter='numpy (*.npy)')
+        self.dim_base_name = 'Dimension['
+        self.ndim = 10
+        for i in range(self.ndim):
+            self.addWidget('PushButton', self.dim_base_name+str(-i-1)+']', toggle=True)
+        self.addWidget('PushButton', 'inverse', toggle=True)
+        self.addWidget('SpinBox', 'Memory (MB)', min=16, max=2**20, val=1024)
+        self.addWidget('SpinBox', 'Threads', min=0, max=256, val=0)
+        self.addWidget('PushButton', 'compute', toggle=True)
+
+        # IO Ports
+        self.addOutPort('out', 'NPYarray')
+
+        self.URI = gpi.TranslateFileURI
+
+    def isHDF5(self, fname):
+        return os.path.splitext(fname)[1].lower() in ['.h5', '.hdf5']
+
+    def validate(self):
+        import gpi_core.math.chunkedfft as cf
+
+        fname = self.URI(self.getVal('Input File'))
+        self.setDetailLabel(fname)
+        if not os.path.exists(fname):
+            return 0
+
+        hdf5 = self.isHDF5(fname)
+        self.setAttr('dataset', visible=hdf5)
+        if hdf5 and 'Input File' in self.widgetEvents():
+            import h5py
+            names = []
+            def append_if_dataset(name, obj):
+                if isinstance(obj, h5py.Dataset):
+                    names.append(name)
+            with h5py.File(fname, 'r') as f:
+                f.visititems(append_if_dataset)
+            self.setAttr('dataset', items=names)
+
+        dataset = self.getVal('dataset') if hdf5 else None
+        if hdf5 and dataset is None:
+            return 0
+        src, f = cf.open_input(fname, dataset)
+        shape, dtype = src.shape, src.dtype
+        if f is not None:
+            f.close()
+
+        for i in range(self.ndim):
+            self.setAttr(self.dim_base_name+str(-i-1)+']', visible=i < len(shape))
+        info = "dimensions: "+str(list(shape))+"\n" \
+               "type: "+str(dtype)+"\n" \
+               "output size (bytes): "+str(8*int(np.prod(shape)))+"\n"
+        self.setAttr('I/O Info:', val=info)
+
+        return 0
+
+    def compute(self):
+
+        import gpi_core.math.chunkedfft as cf
+
+        if not self.getVal('compute'):
+            return 0
+
+        fname = self.URI(self.getVal('Input File'))
+        oname = self.URI(self.getVal('Output File'))
+        if not os.path.exists(fname):
+            self.log.node("Path does not exist: "+str(fname))
+            return 0
+        if not oname.endswith('.npy'):
+            oname += '.npy'
+        if oname == '.npy':
+            return 0
+        if os.path.abspath(oname) == os.path.abspath(fname):
+            self.log.warn("The output file must not be the input file")
+            return 1
+
+        dataset = self.getVal('dataset') if self.isHDF5(fname) else None
+        src, f = cf.open_input(fname, dataset)
+
+        axes = [-i-1 for i in range(min(self.ndim, src.ndim))
+                if self.getVal(self.dim_base_name+str(-i-1)+']')]
+
+        maxbytes = self.getVal('Memory (MB)')*2**20
+        if cf.over_budget(src.shape, cf.passes(src.shape, axes, maxbytes), maxbytes):
+            self.log.warn("The slabs will not fit in 'Memory (MB)' for this shape and these dimensions")
+
+        dst = cf.open_output(oname, src.shape)
+        cf.chunked_fftn(src, dst, axes, inverse=self.getVal('inverse'),
+                        maxbytes=maxbytes,
+                        nthreads=self.getVal('Threads'))
+        del dst
+        if f is not None:
+            f.close()
+
+        self.setData('out', np.load(oname, mmap_mode='r'))
+
+        return 0
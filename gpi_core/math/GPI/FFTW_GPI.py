@@ -161,8 +161,9 @@ class ExternalNode(gpi.NodeAPI):
     Cropping and zero-padding only work on transformed dimensions.
 
     INPUT - data to be transformed, can be real or complex.  DC is assumed to be at index N/2 (starting at 0)
+            Real input is transformed with a real-to-complex FFT, for half the memory and work.
 
-    OUTPUT - transformed data, complex.  DC is at index N/2 (starting at 0)
+    OUTPUT - transformed data, complex (or real, see 'real output').  DC is at index N/2 (starting at 0)
 
     WIDGETS:
     Dimension i - button turns off/on tranform in ith dimension
@@ -172,11 +173,19 @@ class ExternalNode(gpi.NodeAPI):
                   factors > 1 result in zero-padding before transformation
     compute - compute
     direction - select whether you want a Forward or Inverse FFT
+    real output - for complex input that is Hermitian about N/2 (e.g. the FFT of real data), use a
+                  complex-to-real FFT and output the real result, for half the memory and work
+    Planner - how hard FFTW works to find a fast plan.  Estimate plans instantly; Measure and Patient time
+              candidate plans the first time each shape/direction is seen, which is then remembered for later
+              runs (and other nodes) and saved as wisdom in $GPI_FFTW_WISDOM (default
+              ~/.cache/gpi_core/fftwf.wisdom).  Worthwhile when the same sizes are transformed repeatedly.
+    Threads - number of threads; 0 uses $GPI_FFTW_THREADS if set, otherwise all cores
     """
 
     def execType(self):
-        # default executable type
-        # return GPI_THREAD
+        # the record of planned shapes has to live in this process between runs
+        if self.getVal('Planner') > 0:
+            return gpi.GPI_THREAD
         return gpi.GPI_PROCESS
         # return GPI_APPLOOP
 
@@ -190,10 +199,14 @@ class ExternalNode(gpi.NodeAPI):
 
         self.addWidget('PushButton', 'inverse', toggle=True)
         self.addWidget('PushButton', 'compute', toggle=True)
+        self.addWidget('PushButton', 'real output', toggle=True)
+        self.addWidget('ExclusivePushButtons', 'Planner',
+                       buttons=['Estimate', 'Measure', 'Patient'], val=0)
+        self.addWidget('SpinBox', 'Threads', min=0, max=256, val=0)
 
         # IO Ports
         self.addInPort('in', 'NPYarray', obligation=gpi.REQUIRED)
-        self.addOutPort('out', 'NPYarray', dtype=np.complex64)
+        self.addOutPort('out', 'NPYarray', dtype=[np.complex64, np.float32])
 
     def validate(self):
         '''update the widget bounds based on the input data
@@ -227,7 +240,10 @@ class ExternalNode(gpi.NodeAPI):
     def compute(self):
 
         data = self.getData('in')
-        data = np.require(data, dtype=np.complex64, requirements='C')
+        if np.iscomplexobj(data):
+            data = np.require(data, dtype=np.complex64, requirements='C')
+        else:
+            data = np.require(data, dtype=np.float32, requirements='C')
 
         if self.getVal('compute'):
 
@@ -240,6 +256,10 @@ class ExternalNode(gpi.NodeAPI):
             else:
                 kwargs['dir'] = 0
 
+            # FFTW planner effort | 1:ESTIMATE, 2:MEASURE, 3:PATIENT
+            kwargs['effort'] = self.getVal('Planner') + 1
+            kwargs['nthreads'] = self.getVal('Threads')
+
             out_dims = np.array([], np.int64)
 
             # load up the dimension args
@@ -255,7 +275,12 @@ class ExternalNode(gpi.NodeAPI):
             # import in thread to save namespace
             import gpi_core.math.fft as ft
 
-            out = ft.fftw(data, out_dims, **kwargs)
+            if not np.iscomplexobj(data):
+                out = ft.fftw_r2c(data, out_dims, **kwargs)
+            elif self.getVal('real output'):
+                out = ft.fftw_c2r(data, out_dims, **kwargs)
+            else:
+                out = ft.fftw(data, out_dims, **kwargs)
 
             self.setData('out', out)
 
@@ -171,6 +171,7 @@ class ExternalNode(gpi.NodeAPI):
                   factors > 1 result in zero-padding before transformation
     compute - compute
     direction - select whether you want a Forward or Inverse FFT
+    Threads - number of threads used by scipy.fft (when available, numpy.fft otherwise); 0 uses all cores
     """
 
     def initUI(self):
@@ -184,6 +185,7 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget('PushButton', 'compute', toggle=True)
         self.addWidget(
             'PushButton', 'direction', button_title='FORWARD', toggle=True)
+        self.addWidget('SpinBox', 'Threads', min=0, max=256, val=0)
 
         # IO Ports
         self.addInPort('in', 'NPYarray', obligation=gpi.REQUIRED)
@@ -218,6 +220,46 @@ class ExternalNode(gpi.NodeAPI):
 
         return(0)
 
+    def centeredCopy(self, data, outshape, fftAxes):
+        '''Zero-pad or crop data to outshape about N/2, with the transformed
+        axes already ifftshift()ed, in a single new array.
+        '''
+        import itertools
+
+        # the output is single precision for single precision input
+        dtype = np.result_type(data.dtype, np.complex64)
+        out = np.zeros(outshape, dtype=dtype)
+
+        # per axis: the (source, destination) slices to copy
+        pieces = []
+        for ax in range(data.ndim):
+            n_in = data.shape[ax]
+            n = outshape[ax]
+            zpad_length = n - n_in
+            if zpad_length >= 0:
+                zpad_before = int(zpad_length / 2.0 + 0.5)
+            else:
+                zpad_before = int(zpad_length / 2.0 - 0.5)
+            length = min(n, n_in)
+            src0 = max(0, -zpad_before)
+            dst0 = max(0, zpad_before)
+            if ax - data.ndim not in fftAxes:
+                pieces.append([(slice(src0, src0+length), slice(dst0, dst0+length))])
+                continue
+            # ifftshift: output index i holds the padded index (i + n//2) % n
+            dst0 = (dst0 - n//2) % n
+            first = min(length, n - dst0)
+            ax_pieces = [(slice(src0, src0+first), slice(dst0, dst0+first))]
+            if first < length:
+                ax_pieces.append((slice(src0+first, src0+length), slice(0, length-first)))
+            pieces.append(ax_pieces)
+
+        for block in itertools.product(*pieces):
+            src = tuple(b[0] for b in block)
+            dst = tuple(b[1] for b in block)
+            out[dst] = data[src]
+        return out
+
     def compute(self):
 
         data = self.getData('in')
@@ -228,40 +270,46 @@ class ExternalNode(gpi.NodeAPI):
 
             # GET DIMENSION INFORMATION
             fftAxes = ()
-            temp = data
-            intype = data.dtype
+            outshape = list(data.shape)
             for i in range(data.ndim):
                 val = self.getVal(self.dim_base_name+str(-i-1)+']')
                 #DEFINE TRANSFORM AXES
                 if val['compute']:
                     fftAxes = fftAxes + (-i-1,)
-                    #ZERO PAD (this should eventually be independent of compute)
-                    zpad_length = val['length'] - data.shape[-i-1]
-                    if zpad_length >= 0:
-                        zpad_before = int(zpad_length / 2.0 + 0.5)
-                        zpad_after = int(zpad_length / 2.0)
-                    else:
-                        zpad_before = int(zpad_length / 2.0 - 0.5)
-                        zpad_after = int(zpad_length / 2.0)
-                    if zpad_after > 0:
-                        temp = np.insert(temp, (data.shape[-i-1] *
-                                         np.ones(zpad_after, dtype=int)), 0.0, (-i-1))
-                    elif zpad_after < 0:
-                        temp = np.delete(temp, list(range(data.shape[-i-1] +
-                                         zpad_after, data.shape[-i-1])), (-i-1))
-                    if zpad_before > 0:
-                        temp = np.insert(temp, np.zeros(zpad_before, dtype=int), 0.0,
-                                         (-i-1))
-                    elif zpad_before < 0:
-                        temp = np.delete(temp, list(range(-zpad_before)), (-i-1))
+                    #ZERO PAD or CROP (this should eventually be independent of compute)
+                    outshape[-i-1] = val['length']
+
+            # one copy, padded/cropped and shifted so DC is at 0
+            temp = self.centeredCopy(data, outshape, fftAxes)
+
+            # Move DC of the output to N/2 by modulating the input, in place
+            # instead of a second shifted copy:  X[k-N/2] = sum_m x[m] exp(+/-2pi*i*m*(N/2)/N)
+            sign = 1. if direction == 0 else -1.
+            for ax in fftAxes:
+                n = temp.shape[ax]
+                m = np.arange(n)
+                if n % 2 == 0:
+                    ramp = np.where(m % 2, -1., 1.)
+                else:
+                    ramp = np.exp(sign*2j*np.pi*((m*(n//2)) % n)/n)
+                shape = [1]*temp.ndim
+                shape[ax] = n
+                temp *= ramp.reshape(shape).astype(temp.dtype)
 
             # COMPUTE TRANSFORM
+            workers = self.getVal('Threads')
+            if workers == 0:
+                workers = -1  # all cores
+            try:
+                import scipy.fft as fft
+                kwargs = {'workers': workers, 'overwrite_x': True}
+            except ImportError:
+                import numpy.fft as fft
+                kwargs = {}
             if direction == 0:
-                out = np.fft.fftshift(np.fft.fftn(np.fft.ifftshift(temp),
-                                      axes=fftAxes))
+                out = fft.fftn(temp, axes=fftAxes, **kwargs)
             else:
-                out = np.fft.fftshift(np.fft.ifftn(np.fft.ifftshift(temp),
-                                      axes=fftAxes))
+                out = fft.ifftn(temp, axes=fftAxes, **kwargs)
 
             self.setData('out', out)
 
@@ -0,0 +1,199 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+''' Out-of-core centered FFTs.
+
+    For arrays too large to transform in memory, chunked_fftn() reads the
+    input (an np.memmap, h5py dataset or anything else that can be sliced)
+    a slab at a time, transforms the slab in memory and writes it to the
+    output, usually a memory-mapped .npy file from open_output().
+
+    If some axis is not transformed and one index along it fits in the
+    memory budget, the slabs are taken along it (the leading such axis) and
+    one pass does everything.  Otherwise a first pass transforms all but the
+    first transformed axis, and a second pass reads the output back and
+    transforms that axis, each with slabs along the leading axis that fits.
+
+    The slabs are transformed by fft.fftw() (the fft1n() path of
+    fft_PyMOD.cpp) when it is built, or numpy.fft otherwise, with the same
+    convention as FFTW: DC at index N/2, and the inverse scaled by 1/N.
+'''
+
+import numpy as np
+
+# the slab, its complex64 copy, the transform and its shifts
+SLAB_COPIES = 4
+
+
+def open_input(fname, dataset=None):
+    '''Open a .npy file (memory-mapped, read only) or an HDF5 dataset
+       without reading it.  Returns the array and the file to close, if any.
+    '''
+    if dataset is None:
+        return np.load(fname, mmap_mode='r'), None
+    import h5py
+    f = h5py.File(fname, 'r')
+    return f[dataset], f
+
+
+def open_output(fname, shape, dtype=np.complex64):
+    '''A new memory-mapped .npy file to write the transform to.
+    '''
+    return np.lib.format.open_memmap(fname, mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+def fft_slab(slab, axes, inverse=False, nthreads=0):
+    '''Centered FFT of an in-memory array along axes.
+    '''
+    slab = np.require(slab, dtype=np.complex64, requirements='C')
+    if len(axes) == 0:
+        return slab
+    try:
+        import gpi_core.math.fft as ft
+    except ImportError:
+        ft = None
+
+    if ft is not None and slab.ndim <= 10:
+        kwargs = {'dir': int(inverse), 'nthreads': nthreads}
+        for ax in axes:
+            kwargs['dim'+str(slab.ndim - ax)] = 1
+        return ft.fftw(slab, np.array(slab.shape[::-1], dtype=np.int64), **kwargs)
+
+    f = np.fft.ifftn if inverse else np.fft.fftn
+    out = f(np.fft.ifftshift(slab, axes=axes), axes=axes)
+    return np.fft.fftshift(out, axes=axes).astype(np.complex64)
+
+
+def index_bytes(shape, axis):
+    '''Working memory for one index along axis (all of it for None).
+    '''
+    n = SLAB_COPIES * np.dtype(np.complex64).itemsize * int(np.prod(shape))
+    return n if axis is None else n // shape[axis]
+
+
+def slab_axis(shape, axes, maxbytes):
+    '''The leading axis not in axes of which one index fits in maxbytes, or
+       None if there is none.
+    '''
+    for a in range(len(shape)):
+        if a not in axes and index_bytes(shape, a) <= maxbytes:
+            return a
+    return None
+
+
+def passes(shape, axes, maxbytes=1024*2**20):
+    '''The (slab axis, transformed axes) of each pass over the data.  One
+       pass if an axis that is not transformed can be cut into slabs that
+       fit in maxbytes, otherwise the transformed axes are split over two
+       passes.  If even that does not fit, the slabs are along the axis with
+       the smallest index, and over_budget() is true.
+    '''
+    ndim = len(shape)
+    axes = sorted(set(a % ndim for a in axes))
+    if not axes:
+        return []
+    if ndim == 1:
+        return [(None, axes)]
+
+    sax = slab_axis(shape, axes, maxbytes)
+    if sax is not None:
+        return [(sax, axes)]
+
+    # the first transformed axis on its own, the others first
+    first, others = axes[:1], axes[1:]
+    plan = []
+    for tax in [others, first]:
+        if not tax:
+            continue
+        sax = slab_axis(shape, tax, maxbytes)
+        if sax is None:
+            sax = max((a for a in range(ndim) if a not in tax), key=lambda a: shape[a])
+        plan.append((sax, tax))
+    return plan
+
+
+def over_budget(shape, plan, maxbytes):
+    '''Whether one index along the slab axis of some pass exceeds maxbytes.
+    '''
+    return any(index_bytes(shape, sax) > maxbytes for sax, _ in plan)
+
+
+def slab_step(shape, slab_axis, maxbytes):
+    '''Number of indices along slab_axis per slab, to keep the slabs and
+       their working copies under maxbytes (but at least one).
+    '''
+    if slab_axis is None:
+        return 1
+    per_index = index_bytes(shape, slab_axis)
+    return int(max(1, min(shape[slab_axis], maxbytes // max(1, per_index))))
+
+
+def chunked_fftn(src, dst, axes, inverse=False, maxbytes=1024*2**20, nthreads=0, progress=None):
+    '''Centered FFT of src along axes, written to dst (same shape), using
+       about maxbytes of memory.  progress(done, total) is called after
+       each slab.
+    '''
+    shape = tuple(src.shape)
+    if tuple(dst.shape) != shape:
+        raise ValueError('chunked_fftn(): output shape '+str(tuple(dst.shape)) +
+                         ' does not match input shape '+str(shape))
+    ndim = len(shape)
+
+    plan = passes(shape, axes, maxbytes)
+    if not plan:
+        # nothing to transform, but still copy in slabs within maxbytes
+        plan = [(0 if ndim else None, [])]
+
+    steps = [slab_step(shape, sax, maxbytes) for sax, _ in plan]
+    total = sum(1 if sax is None else -(-shape[sax] // step) for (sax, _), step in zip(plan, steps))
+    done = 0
+    for p, ((sax, tax), step) in enumerate(zip(plan, steps)):
+        data = src if p == 0 else dst
+        if sax is None:
+            dst[...] = fft_slab(data[...], tax, inverse, nthreads)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+            continue
+        for i0 in range(0, shape[sax], step):
+            idx = [slice(None)] * ndim
+            idx[sax] = slice(i0, min(i0+step, shape[sax]))
+            idx = tuple(idx)
+            dst[idx] = fft_slab(data[idx], tax, inverse, nthreads)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+
+    if hasattr(dst, 'flush'):
+        dst.flush()
+    return dst
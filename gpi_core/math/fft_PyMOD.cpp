@@ -54,85 +54,577 @@ using namespace PyFI::FFTW;
 #include <pthread.h>
 #include <math.h>   // for sqrt(), log(), and sin(), pow()
 #include <time.h>   // for getting sys time to the sec
+#include <stdlib.h> // getenv()
+#include <unistd.h> // sysconf()
+#include <sys/stat.h> // mkdir()
+#include <algorithm>
+#include <set>
+#include <string>
+#include <vector>
 
 #define NINT(x)  x>=0? (int)(x+0.5): (int)(x-0.5)
 
-/**
-	\warning WHILE THREADED, the planning is currently mutexed, so some speed improvements are not seen
-**/
-void fft1_thread (int *num_threads, int *cur_thread, Array<complex<float> >& in, Array<complex<float> >& out, int *fftDirection)	{
-	assert (in.data() != NULL && out.data() != NULL);
-	assert (num_threads > 0);
+/* CENTERED FFT OF ANY SET OF DIMS
+ *
+ * Every selected dim is transformed by one FFTW guru plan, with the remaining dims as its
+ * batch, instead of one fft1n() pass over memory per dim.  The centering (DC at N/2) that
+ * fft1n() gets by shifting is applied here as a phase ramp along each transformed dim, before
+ * and after the transform:
+ *     X(k) = sum_x x(x) exp(s*2pi*i*(k-h)*(x-h)/N),  h = N/2,  s = FFTW sign
+ * with the 1/N of the inverse folded into the ramp after.  That is one pass over memory each
+ * however many dims are transformed.
+ */
+static pthread_mutex_t fft_plan_mutex = PTHREAD_MUTEX_INITIALIZER;
 
-	uint64_t total_size = in.size();
-	uint64_t numreps = total_size / in.size(0);
-	uint64_t start = *cur_thread * numreps / *num_threads;
-	uint64_t stop = (*cur_thread+1) * numreps / *num_threads;
-    uint64_t stride = in.size(0);
+/* the default thread count: $GPI_FFTW_THREADS, or else the number of cores */
+int fft_default_threads()
+{
+    const char *env = getenv("GPI_FFTW_THREADS");
+    if (env != NULL && atoi(env) > 0)
+        return atoi(env);
+    long ncpu = sysconf(_SC_NPROCESSORS_ONLN);
+    return (ncpu > 0) ? (int)ncpu : 1;
+}
 
-	Array<complex<float> > tmp(in.size(0));
+/* multiply each point by the product of ramp[d](index in d) over the dims in mask */
+void fft_ramp(Array<complex<float> > &a, uint64_t mask, std::vector<std::vector<complex<double> > > &ramp)
+{
+    uint64_t nd = a.ndim();
+    uint64_t n0 = a.size(0);
+    uint64_t rows = a.size() / n0;
+    std::vector<uint64_t> idx(nd, 0);
+    complex<float> *p = a.data();
 
-	for (uint64_t i=start; i<stop; i++)	
+    for (uint64_t r = 0; r < rows; r++, p += n0)
     {
-        memcpy(tmp.data(), in.data() + stride * i, stride * sizeof(complex<float> ));
-		fft1 (tmp, tmp, *fftDirection);
-        memcpy(out.data() + stride * i, tmp.data(), stride * sizeof(complex<float> ));
-	}
+        complex<double> f = 1.;
+        for (uint64_t d = 1; d < nd; d++)
+            if (mask & (1 << d))
+                f *= ramp[d][idx[d]];
+
+        if (mask & 1)
+            for (uint64_t x = 0; x < n0; x++)
+                p[x] *= complex<float>(f * ramp[0][x]);
+        else
+        {
+            complex<float> ff(f);
+            for (uint64_t x = 0; x < n0; x++)
+                p[x] *= ff;
+        }
+
+        // next row
+        for (uint64_t d = 1; d < nd; d++)
+        {
+            if (++idx[d] < a.size(d))
+                break;
+            idx[d] = 0;
+        }
+    }
 }
-void fft1_threaded (int num_threads, Array<complex<float> > *in, Array<complex<float> > *out, int fftDirection)	
+
+/* centered, in-place fft of the dims in mask (bit d for dim d), planned with flags; if
+ * scratch, out may be overwritten by planning, as fft_warmup() does to gather wisdom */
+int fftn_guru(Array<complex<float> > &out, uint64_t mask, int direction, int nthreads,
+              unsigned flags, bool scratch = false)
 {
-	create_threads3 (num_threads, fft1_thread, in, out, &fftDirection);
+    std::vector<fftwf_iodim64> dims, loops;
+    std::vector<std::vector<complex<double> > > pre(out.ndim()), post(out.ndim());
+    double norm = 1.;
+    int64_t stride = 1;
+
+    for (uint64_t d = 0; d < out.ndim(); d++)
+    {
+        fftwf_iodim64 io;
+        io.n = out.size(d);
+        io.is = stride;
+        io.os = stride;
+        stride *= io.n;
+        if (mask & (1 << d))
+        {
+            int64_t n = io.n;
+            int64_t h = n/2;
+            pre[d].resize(n);
+            post[d].resize(n);
+            for (int64_t x = 0; x < n; x++)
+            {
+                pre[d][x] = std::polar(1., -direction * 2.*M_PI * double((x*h) % n) / double(n));
+                post[d][x] = std::polar(1., direction * 2.*M_PI * double((((h*h - x*h) % n) + n) % n) / double(n));
+            }
+            norm *= n;
+            dims.push_back(io);
+        }
+        else
+            loops.push_back(io);
+    }
+    if (dims.empty())
+        return 0;
+
+    // inverse is normalized, as in fft1n()
+    if (direction == FFTW_BACKWARD)
+    {
+        uint64_t d0 = 0;
+        while (!(mask & (1 << d0))) d0++;
+        for (uint64_t x = 0; x < post[d0].size(); x++)
+            post[d0][x] /= norm;
+    }
+
+    // FFTW lists the slowest varying dim first
+    std::reverse(dims.begin(), dims.end());
+    std::reverse(loops.begin(), loops.end());
+
+    // out already holds the data, which MEASURE and above would overwrite, so only
+    // use a plan from wisdom (e.g. from fft_warmup()) and estimate one otherwise
+    fftwf_complex *data = reinterpret_cast<fftwf_complex*>(out.data());
+    pthread_mutex_lock(&fft_plan_mutex);
+    fftwf_plan_with_nthreads(nthreads);
+    fftwf_plan plan = NULL;
+    if (flags != FFTW_ESTIMATE)
+        plan = fftwf_plan_guru64_dft(dims.size(), &dims[0], loops.size(),
+                                     loops.empty() ? NULL : &loops[0], data, data, direction,
+                                     scratch ? flags : (flags | FFTW_WISDOM_ONLY));
+    if (plan == NULL)
+        plan = fftwf_plan_guru64_dft(dims.size(), &dims[0], loops.size(),
+                                     loops.empty() ? NULL : &loops[0],
+                                     data, data, direction, FFTW_ESTIMATE);
+    fftwf_plan_with_nthreads(1);
+    pthread_mutex_unlock(&fft_plan_mutex);
+    if (plan == NULL)
+        return 1;
+
+    fft_ramp(out, mask, pre);
+    fftwf_execute(plan);
+    fft_ramp(out, mask, post);
+
+    pthread_mutex_lock(&fft_plan_mutex);
+    fftwf_destroy_plan(plan);
+    pthread_mutex_unlock(&fft_plan_mutex);
+    return 0;
 }
-void fft2_thread (int *num_threads, int *cur_thread, Array<complex<float> >& in, Array<complex<float> >& out, int *fftDirection)	
+
+
+/* PLANS AND WISDOM
+ *
+ * FFTW keeps the wisdom of every plan made in this process, so planning a transform it has
+ * seen before at the same effort is only a lookup.  The wisdom is also kept in a file
+ * ($GPI_FFTW_WISDOM, or ~/.cache/gpi_core/fftwf.wisdom), read on the first call in each
+ * process and rewritten whenever new transforms have been planned.
+ *
+ * With MEASURE and above the planner overwrites the arrays it plans for, unless it already
+ * has wisdom for the problem.  So the first time a transform is seen (shape, direction,
+ * transformed dims and effort) it is planned and run on a scratch array of the same shape,
+ * and recorded in fft_planned.
+ */
+static bool fft_initialized = false;    // both guarded by fft_plan_mutex
+static std::set<std::vector<int64_t> > fft_planned;
+
+std::string fft_wisdom_file()
 {
-	assert (in.data() != NULL && out.data() != NULL);
-	assert (num_threads > 0);
+    const char *env = getenv("GPI_FFTW_WISDOM");
+    if (env != NULL)
+        return std::string(env);
+    const char *home = getenv("HOME");
+    if (home == NULL)
+        return std::string();
+    std::string path = std::string(home) + "/.cache";
+    mkdir(path.c_str(), 0755);
+    path += "/gpi_core";
+    mkdir(path.c_str(), 0755);
+    return path + "/fftwf.wisdom";
+}
 
-	uint64_t total_size = in.size();
-	uint64_t numreps = total_size / (in.size(0) * in.size(1));
-	uint64_t start = *cur_thread * numreps / *num_threads;
-	uint64_t stop = (*cur_thread+1) * numreps / *num_threads;
-    uint64_t stride = in.size(0) * in.size(1);
+/* create threading and import wisdom, once per process; returns the wisdom file */
+std::string fft_init(int threads)
+{
+	std::string wisdom_file = fft_wisdom_file();
+	pthread_mutex_lock(&fft_plan_mutex);
+	if (!fft_initialized)
+    {
+		fftw_init_threads();
+		fftw_plan_with_nthreads(threads);
+		fftwf_init_threads();
+		// the planner is shared with every other module in the process (e.g. gridding)
+		// that may plan from another thread, which fft_plan_mutex does not cover
+		fftw_make_planner_thread_safe();
+		fftwf_make_planner_thread_safe();
+		if (!wisdom_file.empty())
+        {
+			// if the file could not be opened, that's ok we will write it later
+			FILE *wis_import;
+			wis_import = fopen(wisdom_file.c_str(),"r");
+			if (wis_import != NULL)
+            {
+				fftwf_import_wisdom_from_file(wis_import);
+				fclose(wis_import);
+			}
+		}
+		fft_initialized = true;
+	}
+	pthread_mutex_unlock(&fft_plan_mutex);
+	return wisdom_file;
+}
 
-	Array<complex<float> > tmp(in.size(0), in.size(1));
+void fft_export_wisdom(std::string &wisdom_file)
+{
+	if (wisdom_file.empty())
+		return;
+	FILE *wis_export;
+	wis_export = fopen(wisdom_file.c_str(),"w");
+	if (wis_export != NULL)	{
+		pthread_mutex_lock(&fft_plan_mutex);
+		fftwf_export_wisdom_to_file(wis_export);
+		pthread_mutex_unlock(&fft_plan_mutex);
+		fclose(wis_export);
+	}
+	else
+    {
+        printf("wisdom file could not be written\n");
+	}
+}
 
-	for (uint64_t i=start; i<stop; i++)	
+/* the planner flags for 1:ESTIMATE, 2:MEASURE, 3:PATIENT, 4:EXHAUSTIVE, passed to each plan
+ * rather than set in global_fftFlags, which another thread may be planning with */
+int fft_effort_flags(int64_t effort, unsigned *flags)
+{
+    switch ( effort )
     {
-        memcpy(tmp.data(), in.data() + stride * i, stride * sizeof(complex<float> ));
-		fft2 (tmp, tmp, *fftDirection);
-        memcpy(out.data() + stride * i, tmp.data(), stride * sizeof(complex<float> ));
+	    case 1:
+		    *flags = FFTW_ESTIMATE;
+		    break;
+	    case 2:
+		    *flags = FFTW_MEASURE;
+		    break;
+	    case 3:
+		    *flags = FFTW_PATIENT;
+		    break;
+	    case 4:
+		    *flags = FFTW_EXHAUSTIVE;
+		    break;
+	    default:
+		return 1;
 	}
+	return 0;
 }
-void fft2_threaded (int num_threads, Array<complex<float> > *in, Array<complex<float> > *out, int fftDirection)	
+
+/* the dims to transform, bit d for dim d */
+uint64_t fft_mask(int64_t **dimflags, uint64_t ndim)
 {
-	create_threads3 (num_threads, fft2_thread, in, out, &fftDirection);
+	uint64_t mask = 0;
+	for (uint64_t d = 0; d < 10 && d < ndim; d++)
+		if (*dimflags[d] == 1)
+			mask |= (1 << d);
+	return mask;
 }
-void fft3_thread (int *num_threads, int *cur_thread, Array<complex<float> >& in, Array<complex<float> >& out, int *fftDirection)	
+
+/* true the first time a transform (kind, shape, direction, effort, threads) is seen */
+template<class T>
+bool fft_new_plan(int kind, Array<T> &a, uint64_t ndim, int direction, int nthreads, unsigned flags)
 {
-	assert (in.data() != NULL && out.data() != NULL);
-	assert (num_threads > 0);
+    std::vector<int64_t> key;
+    key.push_back(flags);
+    key.push_back(direction);
+    key.push_back(kind);
+    key.push_back(nthreads);
+    for (uint64_t i = 0; i < ndim; i++)
+        key.push_back(a.size(i));
+    pthread_mutex_lock(&fft_plan_mutex);
+    bool is_new = fft_planned.insert(key).second;
+    pthread_mutex_unlock(&fft_plan_mutex);
+    return is_new;
+}
+
+/* plan fftn_guru() of the dims in mask on a scratch array, so it is in wisdom for out */
+bool fft_warmup(uint64_t mask, Array<complex<float> > &out, int direction, int nthreads, unsigned flags)
+{
+    if (!fft_new_plan(100+mask, out, out.ndim(), direction, nthreads, flags))
+        return false;
+
+    if (flags != FFTW_ESTIMATE)
+    {
+        std::vector<uint64_t> dims(out.ndim());
+        for (uint64_t i = 0; i < out.ndim(); i++)
+            dims[i] = out.size(i);
+        Array<complex<float> > tmp(out.ndim(), &dims[0]);
+        fftn_guru (tmp, mask, direction, nthreads, flags, true);
+    }
+    return (flags != FFTW_ESTIMATE);
+}
 
-	uint64_t total_size = in.size();
-	uint64_t numreps = total_size / (in.size(0) * in.size(1) * in.size(2));
-	uint64_t start = *cur_thread * numreps / *num_threads;
-	uint64_t stop = (*cur_thread+1) * numreps / *num_threads;
-    uint64_t stride = in.size(0) * in.size(1) * in.size(2);
 
-	Array<complex<float> > tmp(in.size(0), in.size(1), in.size(2));
+/* REAL TRANSFORMS
+ *
+ * The transform of real data is Hermitian, X(-k) = conj(X(k)), so FFTW only computes the half
+ * of it along the fastest transformed dim (r2c), for half the work and memory of the complex
+ * transform.  fftn_r2c() fills in the full centered output from that half; fftn_c2r() goes the
+ * other way, from the half of a Hermitian centered input to real output.  The centering is a
+ * phase ramp along each transformed dim, as in fftn_guru().
+ */
 
-	for (uint64_t i=start; i<stop; i++)	
+/* FFTW dims and batch loops for the dims in mask, for real dims n and its half spectrum */
+void fft_real_iodims(std::vector<uint64_t> &n, uint64_t mask, bool r2c,
+                     std::vector<fftwf_iodim64> &dims, std::vector<fftwf_iodim64> &loops,
+                     std::vector<uint64_t> &hn, std::vector<int64_t> &hs)
+{
+    uint64_t d0 = 0;
+    while (!(mask & (1 << d0))) d0++;
+
+    int64_t rstride = 1, hstride = 1;
+    hn = n;
+    hn[d0] = n[d0]/2 + 1;
+    hs.resize(n.size());
+    for (uint64_t d = 0; d < n.size(); d++)
     {
-        memcpy(tmp.data(), in.data() + stride * i, stride * sizeof(complex<float> ));
-		fft3 (tmp, tmp, *fftDirection);
-        memcpy(out.data() + stride * i, tmp.data(), stride * sizeof(complex<float> ));
-	}
+        fftwf_iodim64 io;
+        io.n = n[d];
+        io.is = r2c ? rstride : hstride;
+        io.os = r2c ? hstride : rstride;
+        hs[d] = hstride;
+        rstride *= n[d];
+        hstride *= hn[d];
+        if (mask & (1 << d))
+            dims.push_back(io);
+        else
+            loops.push_back(io);
+    }
+    // FFTW lists the slowest varying dim first, and halves the last one
+    std::reverse(dims.begin(), dims.end());
+    std::reverse(loops.begin(), loops.end());
+}
+
+/* exp(s*2pi*i*j*h/N) along each dim in mask, h = N/2 */
+void fft_real_ramps(std::vector<uint64_t> &n, uint64_t mask, double s,
+                    std::vector<std::vector<complex<double> > > &ramp)
+{
+    ramp.resize(n.size());
+    for (uint64_t d = 0; d < n.size(); d++)
+    {
+        if (!(mask & (1 << d)))
+            continue;
+        int64_t nn = n[d], h = nn/2;
+        ramp[d].resize(nn);
+        for (int64_t j = 0; j < nn; j++)
+            ramp[d][j] = std::polar(1., s * 2.*M_PI * double((j*h) % nn) / double(nn));
+    }
 }
-void fft3_threaded (int num_threads, Array<complex<float> > *in, Array<complex<float> > *out, int fftDirection)	
+
+/* centered fft of the dims in mask of real input, inserted into out */
+int fftn_r2c(Array<float> &in, Array<complex<float> > &out, uint64_t mask, int direction, int nthreads,
+             unsigned flags)
 {
-	create_threads3 (num_threads, fft3_thread, in, out, &fftDirection);
+    uint64_t nd = out.ndim();
+    std::vector<uint64_t> n(nd), hn;
+    std::vector<int64_t> hs;
+    for (uint64_t d = 0; d < nd; d++)
+        n[d] = out.size(d);
+
+    Array<float> rin(nd, &n[0]);
+    if (mask == 0)
+    {
+        rin = 0.f;
+        rin.insert(in);
+        for (uint64_t i = 0; i < out.size(); i++)
+            out.data()[i] = rin.data()[i];
+        return 0;
+    }
+
+    std::vector<fftwf_iodim64> dims, loops;
+    fft_real_iodims(n, mask, true, dims, loops, hn, hs);
+    Array<complex<float> > half(nd, &hn[0]);
+
+    // plan before the input is copied in, MEASURE and above overwrite the arrays
+    pthread_mutex_lock(&fft_plan_mutex);
+    fftwf_plan_with_nthreads(nthreads);
+    fftwf_plan plan = fftwf_plan_guru64_dft_r2c(dims.size(), &dims[0], loops.size(),
+                                                loops.empty() ? NULL : &loops[0], rin.data(),
+                                                reinterpret_cast<fftwf_complex*>(half.data()),
+                                                flags);
+    fftwf_plan_with_nthreads(1);
+    pthread_mutex_unlock(&fft_plan_mutex);
+    if (plan == NULL)
+        return 1;
+
+    rin = 0.f;
+    rin.insert(in);
+    fftwf_execute(plan);
+
+    pthread_mutex_lock(&fft_plan_mutex);
+    fftwf_destroy_plan(plan);
+    pthread_mutex_unlock(&fft_plan_mutex);
+
+    // the centered forward transform at k is ramp(j) * half(j), j = k-N/2, or conj(half(-j))
+    // where j is in the missing half; the inverse is its conjugate over N
+    std::vector<std::vector<complex<double> > > ramp;
+    fft_real_ramps(n, mask, 1., ramp);
+    double norm = 1.;
+    for (uint64_t d = 0; d < nd; d++)
+        if (mask & (1 << d))
+            norm *= n[d];
+    bool inverse = (direction == FFTW_BACKWARD);
+
+    uint64_t d0 = 0;
+    while (!(mask & (1 << d0))) d0++;
+    int64_t n0 = n[0], h0 = n0/2;
+    uint64_t rows = out.size() / n0;
+    std::vector<uint64_t> idx(nd, 0);
+    complex<float> *o = out.data();
+    complex<float> *hp = half.data();
+
+    for (uint64_t r = 0; r < rows; r++, o += n0)
+    {
+        int64_t bj = 0, bn = 0;
+        complex<double> f = 1.;
+        bool direct = true;
+        for (uint64_t d = 1; d < nd; d++)
+        {
+            int64_t j = idx[d], jn = idx[d];
+            if (mask & (1 << d))
+            {
+                j = (idx[d] + n[d] - n[d]/2) % n[d];
+                jn = (n[d] - j) % n[d];
+                f *= ramp[d][j];
+                if (d == d0)
+                    direct = (j <= (int64_t)n[d]/2);
+            }
+            bj += j * hs[d];
+            bn += jn * hs[d];
+        }
+
+        for (int64_t k = 0; k < n0; k++)
+        {
+            complex<double> v;
+            if (d0 == 0)
+            {
+                int64_t j = (k + n0 - h0) % n0;
+                if (j <= n0/2)
+                    v = complex<double>(hp[bj + j]);
+                else
+                    v = conj(complex<double>(hp[bn + n0 - j]));
+                v *= f * ramp[0][j];
+            }
+            else
+            {
+                if (direct)
+                    v = complex<double>(hp[bj + k]);
+                else
+                    v = conj(complex<double>(hp[bn + k]));
+                v *= f;
+            }
+            if (inverse)
+                v = conj(v) / norm;
+            o[k] = complex<float>(v);
+        }
+
+        // next row
+        for (uint64_t d = 1; d < nd; d++)
+        {
+            if (++idx[d] < n[d])
+                break;
+            idx[d] = 0;
+        }
+    }
+    return 0;
 }
 
+/* centered fft of the dims in mask of Hermitian input, inserted into out, to real output */
+int fftn_c2r(Array<complex<float> > &in, Array<float> &out, uint64_t mask, int direction, int nthreads,
+             unsigned flags)
+{
+    uint64_t nd = out.ndim();
+    std::vector<uint64_t> n(nd), hn;
+    std::vector<int64_t> hs;
+    for (uint64_t d = 0; d < nd; d++)
+        n[d] = out.size(d);
+
+    Array<complex<float> > cin(nd, &n[0]);
+    cin = complex<float>(0.);
+    cin.insert(in);
+    if (mask == 0)
+    {
+        for (uint64_t i = 0; i < out.size(); i++)
+            out.data()[i] = real(cin.data()[i]);
+        return 0;
+    }
+
+    std::vector<fftwf_iodim64> dims, loops;
+    fft_real_iodims(n, mask, false, dims, loops, hn, hs);
+    Array<complex<float> > half(nd, &hn[0]);
+
+    // plan before half is filled, MEASURE and above overwrite the arrays
+    pthread_mutex_lock(&fft_plan_mutex);
+    fftwf_plan_with_nthreads(nthreads);
+    fftwf_plan plan = fftwf_plan_guru64_dft_c2r(dims.size(), &dims[0], loops.size(),
+                                                loops.empty() ? NULL : &loops[0],
+                                                reinterpret_cast<fftwf_complex*>(half.data()),
+                                                out.data(), flags);
+    fftwf_plan_with_nthreads(1);
+    pthread_mutex_unlock(&fft_plan_mutex);
+    if (plan == NULL)
+        return 1;
+
+    // half(j) = in(j+N/2) * exp(-2pi*i*j*h/N), conjugated for the forward transform, which puts
+    // DC back at N/2 in the output; the inverse is normalized
+    std::vector<std::vector<complex<double> > > ramp;
+    fft_real_ramps(n, mask, -1., ramp);
+    double norm = 1.;
+    for (uint64_t d = 0; d < nd; d++)
+        if (mask & (1 << d))
+            norm *= n[d];
+    bool inverse = (direction == FFTW_BACKWARD);
+
+    int64_t hn0 = hn[0];
+    uint64_t rows = half.size() / hn0;
+    std::vector<uint64_t> idx(nd, 0);
+    complex<float> *hp = half.data();
+    complex<float> *cp = cin.data();
+
+    for (uint64_t r = 0; r < rows; r++, hp += hn0)
+    {
+        int64_t bk = 0, stride = n[0];
+        complex<double> f = 1.;
+        for (uint64_t d = 1; d < nd; d++)
+        {
+            int64_t k = idx[d];
+            if (mask & (1 << d))
+            {
+                k = (idx[d] + n[d]/2) % n[d];
+                f *= ramp[d][idx[d]];
+            }
+            bk += k * stride;
+            stride *= n[d];
+        }
+        if (inverse)
+            f /= norm;
+
+        for (int64_t j = 0; j < hn0; j++)
+        {
+            complex<double> v;
+            if (mask & 1)
+                v = complex<double>(cp[bk + (j + n[0]/2) % n[0]]);
+            else
+                v = complex<double>(cp[bk + j]);
+            if (!inverse)
+                v = conj(v);
+            v *= f;
+            if (mask & 1)
+                v *= ramp[0][j];
+            hp[j] = complex<float>(v);
+        }
+
+        // next row
+        for (uint64_t d = 1; d < nd; d++)
+        {
+            if (++idx[d] < hn[d])
+                break;
+            idx[d] = 0;
+        }
+    }
 
+    fftwf_execute(plan);
+
+    pthread_mutex_lock(&fft_plan_mutex);
+    fftwf_destroy_plan(plan);
+    pthread_mutex_unlock(&fft_plan_mutex);
+    return 0;
+}
 
 
 /* FFT
@@ -159,6 +651,8 @@ PYFI_FUNC(fftw)
     PYFI_KWARG(int64_t, dim8, 0);  //"toggle for fft perform"
     PYFI_KWARG(int64_t, dim9, 0);  //"toggle for fft perform"
     PYFI_KWARG(int64_t, dim10, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, effort, 1); // "planner effort 1:ESTIMATE, 2:MEASURE, 3:PATIENT, 4:EXHAUSTIVE (default:1)"
+    PYFI_KWARG(int64_t, nthreads, 0); // "number of threads, 0 for $GPI_FFTW_THREADS or the number of cores (default:0)"
 
     /***** ALLOCATE OUTPUT */
     PYFI_SETOUTPUT_ALLOC(Array<complex <float> >, out, DA(*outdim));
@@ -169,30 +663,14 @@ PYFI_FUNC(fftw)
 	double c0 = ttime.tv_sec + 0.000000001 * (uint64_t) ttime.tv_nsec;
 
     /* fft measurement type */
-    int fftMeasureType = 1;// "Measurements made before fft. 1:ESTIMATE, 2:MEASURE, 3:PATIENT, 4:EXHAUSTIVE (default:1)")
+    int fftMeasureType = *effort;// "Measurements made before fft. 1:ESTIMATE, 2:MEASURE, 3:PATIENT, 4:EXHAUSTIVE (default:1)")
 
     int verbose = 0;
-	int num_threads = 8;
+	int num_threads = (*nthreads > 0) ? *nthreads : fft_default_threads();
 	int threads = num_threads;
 
-	//char *choice_flags;
-	char *wisdom_file=NULL;
-
-	// create threading
-	fftw_init_threads();
-	fftw_plan_with_nthreads(threads);
-	// import wisdom from a file if specified
-	if (wisdom_file != NULL)	
-    {
-		FILE *wis_import;
-		wis_import = fopen(wisdom_file,"r");
-		// if the file could not be opened, that's ok we will write it later
-		if (wis_import != NULL)	
-        {
-			fftwf_import_wisdom_from_file(wis_import);
-			fclose(wis_import);
-		}
-	}
+	// create threading and import wisdom, once per process
+	std::string wisdom_file = fft_init(threads);
 
     // copy input data into output Array in centered manner
     *out = (complex<float>) 0;
@@ -204,21 +682,9 @@ PYFI_FUNC(fftw)
 		direction = FFTW_BACKWARD;
 	}
 
-    switch ( fftMeasureType )	
+    unsigned flags;
+    if (fft_effort_flags(fftMeasureType, &flags))
     {
-	    case 1:
-		    global_fftFlags = FFTW_ESTIMATE;
-		    break;
-	    case 2:
-		    global_fftFlags = FFTW_MEASURE;
-		    break;
-	    case 3:
-	    	global_fftFlags = FFTW_PATIENT;
-	    	break;
-	    case 4:
-	    	global_fftFlags = FFTW_EXHAUSTIVE;
-	    	break;
-	    default:
 		printf(_PYFI_RED "fft.c: error, flag choice not found\n" _PYFI_NOC);
 		exit(1);
 	}
@@ -226,61 +692,28 @@ PYFI_FUNC(fftw)
 	// more timing stuff
 	double cprep = ttime.tv_sec + 0.000000001 * (uint64_t) ttime.tv_nsec;
 
-	// do the fft in every lower direction specified
-	if (*dim1 == 1 && *dim2 == 1 && *dim3 == 1)	
-    {
- 		fft3_threaded (threads, out, out, direction);
-		//fft3 (*out, *out, direction);
-	}
-	else if (*dim1 == 1 && *dim2 == 1)
-    {
-		//fft2(*out, *out, direction);
-		fft2_threaded (threads, out, out, direction);
-    }
-	else	
+	// the dims to transform, bit d for dim d
+	int64_t *dimflags[10] = {dim1, dim2, dim3, dim4, dim5, dim6, dim7, dim8, dim9, dim10};
+	uint64_t mask = fft_mask(dimflags, out->ndim());
+
+	// plan any transforms not seen before, without touching the data, then do every
+	// combination of dims (the lowest 1-3 included) in a single batched plan, threaded
+	// by FFTW; it only plans on the data from wisdom, otherwise estimates
+	bool new_wisdom = false;
+	if (mask != 0)
     {
-		if (*dim1 == 1)
-			//fft1 (*out, *out, direction);
-			fft1_threaded (threads, out, out, direction);
-		if (*dim2 == 1)
-			fft1n (*out, *out, direction, 1);
-		if (*dim3 == 1)
-			fft1n (*out, *out, direction, 2);
+		new_wisdom = fft_warmup(mask, *out, direction, threads, flags);
+		if (fftn_guru (*out, mask, direction, threads, flags))
+			PYFI_ERROR("fftw: planning the transform failed");
 	}
 
-	// do the fft in upper directions as specified
-	if (*dim4 == 1)
-		fft1n (*out, *out, direction, 3);
-	if (*dim5 == 1)
-		fft1n (*out, *out, direction, 4);
-	if (*dim6 == 1)
-		fft1n (*out, *out, direction, 5);
-  if (*dim7 == 1)
-    fft1n (*out, *out, direction, 6);
-  if (*dim8 == 1)
-    fft1n (*out, *out, direction, 7);
-  if (*dim9 == 1)
-    fft1n (*out, *out, direction, 8);
-  if (*dim10 == 1)
-    fft1n (*out, *out, direction, 9);
-
 	// more timing stuff
 	//clock_gettime (CLOCK_MONOTONIC, &ttime);
 	double cpost = ttime.tv_sec + 0.000000001 * (uint64_t) ttime.tv_nsec;
 
-	// export wisdom to a file if specified
-	if (wisdom_file != NULL)	{
-		FILE *wis_export;
-		wis_export = fopen(wisdom_file,"w");
-		if (wis_export != NULL)	{
-			fftwf_export_wisdom_to_file(wis_export);
-			fclose(wis_export);
-		}
-		else	
-        {
-            printf("wisdom file could not be written\n");
-		}
-	}
+	// export wisdom to a file if anything new was planned
+	if (new_wisdom)
+		fft_export_wisdom(wisdom_file);
 
 	// print the timing stuff if necessary
 	double ctime = ttime.tv_sec + 0.000000001 * (uint64_t) ttime.tv_nsec;
@@ -293,6 +726,114 @@ PYFI_FUNC(fftw)
     PYFI_END(); /* This must be the last line */
 }
 
+/* FFT of real input
+ *
+ * Same as fftw() for real input, using the half spectrum of a real-to-complex transform.
+ */
+PYFI_FUNC(fftw_r2c)
+{
+    PYFI_START(); /* This must be the first line */
+
+    /***** POSITIONAL ARGS */
+    PYFI_POSARG(Array<float>, in);
+    PYFI_POSARG(Array<int64_t>, outdim);
+
+    /***** KEYWORD ARGS */
+    PYFI_KWARG(int64_t, dir, 0);  //"fft direction for all transformed dims (0:FORWARD, 1:BACKWARD) (default:0)"
+    /* these are the dims to actually perform transform on */
+    PYFI_KWARG(int64_t, dim1, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim2, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim3, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim4, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim5, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim6, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim7, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim8, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim9, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim10, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, effort, 1); // "planner effort 1:ESTIMATE, 2:MEASURE, 3:PATIENT, 4:EXHAUSTIVE (default:1)"
+    PYFI_KWARG(int64_t, nthreads, 0); // "number of threads, 0 for $GPI_FFTW_THREADS or the number of cores (default:0)"
+
+    /***** ALLOCATE OUTPUT */
+    PYFI_SETOUTPUT_ALLOC(Array<complex <float> >, out, DA(*outdim));
+
+    /***** PERFORM */
+	int threads = (*nthreads > 0) ? *nthreads : fft_default_threads();
+	std::string wisdom_file = fft_init(threads);
+	unsigned flags;
+	if (fft_effort_flags(*effort, &flags))
+		PYFI_ERROR("fftw_r2c: effort must be 1-4");
+	int direction = (*dir == 1) ? FFTW_BACKWARD : FFTW_FORWARD;
+
+	int64_t *dimflags[10] = {dim1, dim2, dim3, dim4, dim5, dim6, dim7, dim8, dim9, dim10};
+	uint64_t mask = fft_mask(dimflags, out->ndim());
+	bool new_wisdom = (mask != 0 && flags != FFTW_ESTIMATE &&
+	                   fft_new_plan(200+mask, *out, out->ndim(), direction, threads, flags));
+
+	if (fftn_r2c(*in, *out, mask, direction, threads, flags))
+		PYFI_ERROR("fftw_r2c: planning the transform failed");
+
+	if (new_wisdom)
+		fft_export_wisdom(wisdom_file);
+
+    PYFI_END(); /* This must be the last line */
+}
+
+/* FFT to real output
+ *
+ * Same as the real part of fftw() for input that is Hermitian about N/2, in the transformed
+ * dims (e.g. the centered transform of real data), using a complex-to-real transform of half
+ * of it.  Other input gives a real result that is not the real part of fftw().
+ */
+PYFI_FUNC(fftw_c2r)
+{
+    PYFI_START(); /* This must be the first line */
+
+    /***** POSITIONAL ARGS */
+    PYFI_POSARG(Array<complex <float> >, in);
+    PYFI_POSARG(Array<int64_t>, outdim);
+
+    /***** KEYWORD ARGS */
+    PYFI_KWARG(int64_t, dir, 0);  //"fft direction for all transformed dims (0:FORWARD, 1:BACKWARD) (default:0)"
+    /* these are the dims to actually perform transform on */
+    PYFI_KWARG(int64_t, dim1, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim2, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim3, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim4, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim5, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim6, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim7, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim8, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim9, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, dim10, 0);  //"toggle for fft perform"
+    PYFI_KWARG(int64_t, effort, 1); // "planner effort 1:ESTIMATE, 2:MEASURE, 3:PATIENT, 4:EXHAUSTIVE (default:1)"
+    PYFI_KWARG(int64_t, nthreads, 0); // "number of threads, 0 for $GPI_FFTW_THREADS or the number of cores (default:0)"
+
+    /***** ALLOCATE OUTPUT */
+    PYFI_SETOUTPUT_ALLOC(Array<float>, out, DA(*outdim));
+
+    /***** PERFORM */
+	int threads = (*nthreads > 0) ? *nthreads : fft_default_threads();
+	std::string wisdom_file = fft_init(threads);
+	unsigned flags;
+	if (fft_effort_flags(*effort, &flags))
+		PYFI_ERROR("fftw_c2r: effort must be 1-4");
+	int direction = (*dir == 1) ? FFTW_BACKWARD : FFTW_FORWARD;
+
+	int64_t *dimflags[10] = {dim1, dim2, dim3, dim4, dim5, dim6, dim7, dim8, dim9, dim10};
+	uint64_t mask = fft_mask(dimflags, out->ndim());
+	bool new_wisdom = (mask != 0 && flags != FFTW_ESTIMATE &&
+	                   fft_new_plan(300+mask, *out, out->ndim(), direction, threads, flags));
+
+	if (fftn_c2r(*in, *out, mask, direction, threads, flags))
+		PYFI_ERROR("fftw_c2r: planning the transform failed");
+
+	if (new_wisdom)
+		fft_export_wisdom(wisdom_file);
+
+    PYFI_END(); /* This must be the last line */
+}
+
 /* ##############################################################
  * ##############################################################
  *                  MODULE DESCRIPTION
@@ -304,4 +845,6 @@ PYFI_FUNC(fftw)
  */
 PYFI_LIST_START_
     PYFI_DESC(fftw, "FFT routine. Wraps fftw using fft_utils.")
+    PYFI_DESC(fftw_r2c, "FFT of real input, as fftw() with half the work.")
+    PYFI_DESC(fftw_c2r, "FFT of Hermitian input to real output.")
 PYFI_LIST_END_
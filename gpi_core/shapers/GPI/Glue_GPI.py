@@ -55,6 +55,9 @@ class ExternalNode(gpi.NodeAPI):
     Glue Dim Size: Reports back size along the gluing dimension
     Clear Output: Press twice in a row to clear output data (must press
         twice!).
+
+    For the results of a parameter sweep of known length, Collect fills a
+    preallocated array instead of copying the output to grow it every step.
     """
 
     def initUI(self):
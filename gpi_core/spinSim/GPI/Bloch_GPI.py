@@ -37,6 +37,7 @@
 
 import gpi
 import numpy as np
+import multiprocessing
 
 class ExternalNode(gpi.NodeAPI):
     """A Bloch simulator designed to work with the Spyn-node and optional
@@ -58,7 +59,10 @@ class ExternalNode(gpi.NodeAPI):
            if not connected, rf is considered constant for Duration
     Pars_in - accepts parameters to set other widgets (i.e. if external waveform is used
 
-    OUTPUTS - spin data
+    OUTPUTS - spin data, as a history of time segments (gpi_core.spinSim.spinhist) that each cascaded
+              Bloch node appends its own segment to, without copying the earlier ones.
+              np.asarray() of it gives the full (13, T, ...) spin array.  The node runs in GPI's own
+              process (GPI_THREAD) so that the segments are shared, not serialized, along the chain
 
     WIDGETS:
     Duration: duration of this particular part of the sequence
@@ -74,6 +78,18 @@ class ExternalNode(gpi.NodeAPI):
                  The (Mx,My) component of all spins decay with an additional exp(-t/Tc) during
                  this module.  If Tc=0, Crusher is ignored.
     RF Waveform: - specifies the mode of the input 2D RF waveform
+    Threads - number of threads the spins are shared between.  All spins are advanced through
+              the whole waveform in one compiled call (bloch_PyMOD), or in numpy if it is not built.
+              Without G_in and RF_in (free precession, crushers, constant gradients, hard pulses), spins that
+              do not move along the gradient are computed in closed form, once per output point
+    Sweep Axis - if not Off, the spins are split along this Spyn axis into shards that are simulated in
+              a pool of Processes, through shared memory, for large sweeps of independent isochromats.
+              The pool is started from GPI's own process, as the node runs as GPI_THREAD
+    Processes - number of processes for the Sweep Axis (each starts fresh, so this pays off for many spins)
+    History - which of this segment's time points (every dt of the Spyn node) are kept: all of them,
+              every Decimation'th one, or only the final state.  The last point is always kept, so the
+              next segment starts from it
+    Decimation - keep every n'th time point for the Decimated History
     """
 
     def initUI(self):
@@ -88,14 +104,20 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget('DoubleSpinBox', 'Crusher Tc (ms)', val=0.)
         self.addWidget('ExclusivePushButtons','RF Waveform',
                        buttons=['M P(deg)','M P(rad)','M Fq(kHz)','RFx RFy'],val=3)
+        self.addWidget('SpinBox', 'Threads', min=1, max=256, val=multiprocessing.cpu_count())
+        self.addWidget('ExclusivePushButtons', 'Sweep Axis',
+                       buttons=['Off','T1','T2','Fq','X','Y','Z'], val=0)
+        self.addWidget('SpinBox', 'Processes', min=1, max=256, val=multiprocessing.cpu_count())
+        self.addWidget('ExclusivePushButtons', 'History', buttons=['Full','Decimated','Final'], val=0)
+        self.addWidget('SpinBox', 'Decimation', min=1, val=10)
 
         # IO Ports
-        self.addInPort('M_in', 'NPYarray',obligation=gpi.REQUIRED)
+        self.addInPort('M_in', 'PASS',obligation=gpi.REQUIRED)
         self.addInPort('G_in', 'NPYarray',obligation=gpi.OPTIONAL)
         self.addInPort('RF_in', 'NPYarray',obligation=gpi.OPTIONAL)
         self.addInPort('Pars_in', 'DICT',obligation=gpi.OPTIONAL)
 
-        self.addOutPort('M_out', 'NPYarray')
+        self.addOutPort('M_out', 'PASS')
 
     def validate(self):
         '''This function runs before compute() as a GPI_APPLOOP exec-type.
@@ -105,8 +127,10 @@ class ExternalNode(gpi.NodeAPI):
         applied after compute() runs.
         '''
 
+        import gpi_core.spinSim.spinhist as sh
+
         # New data
-        m_in = self.getData('M_in')
+        m_in = sh.as_history(self.getData('M_in'))
         rf_in = self.getData('RF_in')
 
         # read Parameter from RFwaveforms module if changed and available
@@ -125,6 +149,9 @@ class ExternalNode(gpi.NodeAPI):
                     if param_dict['RF waveform has FM shape']:
                         self.setAttr('RF Waveform', val=2)
 
+        self.setAttr('Decimation', visible=self.getVal('History')==1)
+        self.setAttr('Processes', visible=self.getVal('Sweep Axis')>0)
+
         # Reconcile timing
         dtms = m_in[10,0,0,0,0,0,0,0,0,0,0]
         durval = max(1.,round(self.getVal('Duration (ms)')/dtms,0))*dtms
@@ -162,8 +189,10 @@ class ExternalNode(gpi.NodeAPI):
         '''This is where the main algorithm should be implemented.
         '''
 
+        import gpi_core.spinSim.spinhist as sh
+
         # New data
-        m_in = self.getData('M_in')
+        m_in = sh.as_history(self.getData('M_in'))
         g_in = self.getData('G_in')
         rf_in = self.getData('RF_in')
 
@@ -191,13 +220,9 @@ class ExternalNode(gpi.NodeAPI):
 
         # Some Initial Calcs
         odim = int(t_bloch/dtms)
-        oshape = list(m_in.shape)
-        oshape[1]=odim
         idim = int(1000.*dtms)
-        newdat=np.zeros(tuple(oshape))
         n_iter = int(1000.*t_bloch)
         usec = 0.001 # in units of msec
-        radspermT = 2.*np.pi*gamma*usec
 
         # Synthetic Crusher
         tc = self.getVal('Crusher Tc (ms)')
@@ -206,11 +231,6 @@ class ExternalNode(gpi.NodeAPI):
         else:
           r2c = r2
 
-        expt1=np.exp(-r1*usec)
-        expt2=np.exp(-r2c*usec)
-        mz0 = m0*(1.-expt1)
-        db0 = fq/gamma
-
         ######################
         # Create Gx,Gy,Gz array
         ######################
@@ -283,100 +303,51 @@ class ExternalNode(gpi.NodeAPI):
         ######################
         # Now iterate through time
         ######################
-        # record data in newdat for each index in outer loop
+        # record data for each index in outer loop
         # inner loop interval is 1 usec
+        # all spins are advanced through all steps in a single call
         ######################
 
-        for outer in range(0,odim): 
-          for inner in range(0,idim): 
-            i = outer*idim+inner
-            time = float(i+1)*usec
-            x = x0 + time*vx
-            y = y0 + time*vy
-            z = z0 + time*vz
-
-            xph = radspermT*rfx[i] #radians to rotate about x
-            yph = radspermT*rfy[i] #radians to rotate about y
-            zph = radspermT*(x*gx[i]+y*gy[i]+z*gz[i] + db0) #radians to rotate about z
-
-            mx,my,mz = self.rotate(mx,my,mz,xph,yph,zph)
-            mx = mx*expt2
-            my = my*expt2
-            mz = mz0 + expt1*mz
-
-          newdat[0,outer,:,:,:,:,:,:,:,:,:] = mx
-          newdat[1,outer,:,:,:,:,:,:,:,:,:] = my
-          newdat[2,outer,:,:,:,:,:,:,:,:,:] = mz
-          newdat[3,outer,:,:,:,:,:,:,:,:,:] = x
-          newdat[4,outer,:,:,:,:,:,:,:,:,:] = y
-          newdat[5,outer,:,:,:,:,:,:,:,:,:] = z
-          newdat[6,outer,:,:,:,:,:,:,:,:,:] = t0+time
-          newdat[7,outer,:,:,:,:,:,:,:,:,:] = gx[i]
-          newdat[8,outer,:,:,:,:,:,:,:,:,:] = gy[i]
-          newdat[9,outer,:,:,:,:,:,:,:,:,:] = gz[i]
-          newdat[10,outer,:,:,:,:,:,:,:,:,:] = rfx[i]
-          newdat[11,outer,:,:,:,:,:,:,:,:,:] = rfy[i]
-          newdat[12,outer,:,:,:,:,:,:,:,:,:] = tc
-
-        m_out=np.concatenate((m_in,newdat),axis=1)
+        import gpi_core.spinSim.blochsim as bs
+
+        sshape = mx.shape
+        spins = np.array([mx, my, mz, x0, y0, z0, vx, vy, vz, m0, r1, r2c, fq])
+        waves = np.array([gx, gy, gz, rfx, rfy])[:, :odim*idim]
+        sweep = self.getVal('Sweep Axis')
+        if sweep > 0:
+          # one shard per process along the sweep axis
+          mout = bs.simulate_sweep(spins, waves, idim, gamma, dt=usec, axis=sweep-1,
+                                   nprocs=self.getVal('Processes'))
+        else:
+          mout = bs.simulate(np.reshape(spins, (bs.NPARS, -1)), waves, idim, gamma, dt=usec,
+                             nthreads=self.getVal('Threads'))
+
+        # keep the requested time points, as a compact segment: only the
+        # magnetization and position vary per spin, the rest only in time
+        keep = sh.keep_points(odim, self.getVal('History'), self.getVal('Decimation'))
+        steps = (keep+1)*idim - 1
+        mout = np.reshape(mout[:,keep], (6, keep.size) + sshape)
+        if (t0 == t0.flat[0]).all():
+          t0 = t0.flat[0]
+        rows = list(mout) + [t0 + sh.along((steps+1)*usec, 0, 10),
+                             sh.along(gx[steps], 0, 10),
+                             sh.along(gy[steps], 0, 10),
+                             sh.along(gz[steps], 0, 10),
+                             sh.along(rfx[steps], 0, 10),
+                             sh.along(rfy[steps], 0, 10),
+                             tc]
+        newdat = sh.SpinEnsemble(rows, (13, keep.size) + sshape)
+
+        # appended without copying the history
+        m_out = m_in.append(newdat)
 
         self.setData('M_out', m_out)
 
         return 0
 
-    ######################
-    def rotate(self, rx, ry, rz, px, py, pz):
-    ######################
-# R = (rx, ry, rz) = (mx, my, mz)
-# P = (px, py, pz)
-# Rotate R about P, by |P| radians
-#
-# R1 is the projection of R on P, which does not rotate
-# R2 is the residue of R which is perpendicular to P
-# R3 and R4 are the vectors of the rotated R2 which are
-#           parallel and perpendicular to R2, respectively
-#
-# R1 = P (P dot R)/(|P|**2)
-# R2 = R - R1
-# R3 = R2 Cos(|P|)
-# R4 = (P x R2) Sin(|P|) / |P|
-#
-# R' = R1+R3+R4
-
-      psqu = px*px + py*py + pz*pz
-      if (psqu > 0).any():
-        pmag = np.sqrt(psqu)
-
-        # Need to mask, to avoid div_by_0
-        pzero = np.zeros(psqu.shape)
-
-        pdotr = px*rx + py*ry + pz*rz
-        r1norm = np.where(psqu,pdotr/psqu,pzero)
-        cp = np.cos(pmag)
-        spn = np.where(pmag,np.sin(pmag)/pmag,pzero)
-
-        r1x = px*r1norm
-        r1y = py*r1norm
-        r1z = pz*r1norm
-
-        r2x = rx-r1x
-        r2y = ry-r1y
-        r2z = rz-r1z
-
-        r3x = r2x*cp
-        r3y = r2y*cp
-        r3z = r2z*cp
-
-        r4x = (py*r2z - pz*r2y)*spn
-        r4y = (pz*r2x - px*r2z)*spn
-        r4z = (px*r2y - py*r2x)*spn
-
-        rx = r1x+r3x+r4x
-        ry = r1y+r3y+r4y
-        rz = r1z+r3z+r4z
-
-      return rx,ry,rz
-
     def execType(self):
-        '''Could be GPI_THREAD, GPI_PROCESS, GPI_APPLOOP'''
-        return gpi.GPI_PROCESS
+        # the output history references the earlier segments, which a process
+        # would have to copy out whole; in this process append() shares them.
+        # The Sweep Axis pool must also be started from here, not from a
+        # (daemonic) process worker
+        return gpi.GPI_THREAD
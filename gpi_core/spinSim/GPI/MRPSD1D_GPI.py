@@ -41,13 +41,15 @@ import numpy as np
 class ExternalNode(gpi.NodeAPI):
     """Reformats pulse sequence information from  Bloch- (potentially cascaded
     Bloch-) node(s) for plotting in 1D viewer/plotter nodes.
+
+    INPUT: spin data from Bloch (a spin history) or Spyn
     """
 
     def initUI(self):
         # Widgets
 
         # IO Ports
-        self.addInPort('M_in', 'NPYarray',obligation=gpi.REQUIRED)
+        self.addInPort('M_in', 'PASS',obligation=gpi.REQUIRED)
         self.addOutPort('B_out', 'NPYarray')
 
         return 0
@@ -57,8 +59,10 @@ class ExternalNode(gpi.NodeAPI):
 
     def compute(self):
 
-        # New data
-        m_in = self.getData('M_in')
+        import gpi_core.spinSim.spinhist as sh
+
+        # New data - only the first spin is read from each segment
+        m_in = sh.as_history(self.getData('M_in'))
         mdim = list(m_in.shape)
 
 # X Axis
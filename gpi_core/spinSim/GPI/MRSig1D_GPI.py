@@ -42,7 +42,7 @@ class ExternalNode(gpi.NodeAPI):
     """Reformats magnetization profiles defined in Spyn and Bloch nodes for
     plotting in 1D viewer/plotter nodes.
 
-    INPUT: data from Bloch or Spyn node
+    INPUT: data from Bloch (a spin history) or Spyn node
 
     OUTPUT: data to plot (typically via Matplotlib)
 
@@ -80,7 +80,7 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget('Slider', 'Vz index')
 
         # IO Ports
-        self.addInPort('M_in', 'NPYarray',obligation=gpi.REQUIRED)
+        self.addInPort('M_in', 'PASS',obligation=gpi.REQUIRED)
         self.addOutPort('M_out', 'NPYarray')
 
         return 0
@@ -93,7 +93,9 @@ class ExternalNode(gpi.NodeAPI):
         applied after compute() runs.
         '''
 
-        m_in = self.getData('M_in')
+        import gpi_core.spinSim.spinhist as sh
+
+        m_in = sh.as_history(self.getData('M_in'))
         mdim = list(m_in.shape)
         maxt1 = mdim[2]
         maxt2 = mdim[3]
@@ -209,8 +211,10 @@ class ExternalNode(gpi.NodeAPI):
         '''This is where the main algorithm should be implemented.
         '''
 
+        import gpi_core.spinSim.spinhist as sh
+
         # New data
-        m_in = self.getData('M_in')
+        m_in = sh.as_history(self.getData('M_in'))
         mdim = list(m_in.shape)
 
         xaxis = self.getVal('X Axis')
@@ -260,7 +264,12 @@ class ExternalNode(gpi.NodeAPI):
 # Y Axis for M
   # Average where Desired
         avex = self.getVal('Average Across:')
-        m_av = m_in[:3,:,:,:,:,:,:,:,:,:,:]
+        # only the time point on display is read, unless time is the X Axis
+        if xaxis == 0:
+          m_av = m_in[:3,:,:,:,:,:,:,:,:,:,:]
+        else:
+          tindex = self.getVal('T  index')+1
+          m_av = m_in[:3,tindex:tindex+1,:,:,:,:,:,:,:,:,:]
         index_to_ave = 2
         for i in range(0,9):
           if (np.array(avex) == i).any(): # T1
@@ -276,7 +285,7 @@ class ExternalNode(gpi.NodeAPI):
         if xaxis == 0:
           xi.append(slice(1,mdim[1]))
         else:
-          xi.append(self.getVal('T  index')+1)
+          xi.append(0)
 
     # Remaining Dimensions
         for i in range(1,10):
@@ -285,7 +294,7 @@ class ExternalNode(gpi.NodeAPI):
           elif not (np.array(avex) == i-1).any(): # Slice this axis if it hasn't already been averaged
             xi.append(idim[i])
 
-        outvals = m_av[xi]
+        outvals = m_av[tuple(xi)]
 
   # No assign Y Axis
         mdisp = self.getVal('M display')
@@ -44,7 +44,7 @@ class ExternalNode(gpi.NodeAPI):
     """Reformats spin magnetization profile data generated by Spyn and Bloch
     nodes for visualization in an OpenGL viewer node.
 
-    INPUT: MR Spin info from Bloch or Spyn module
+    INPUT: MR Spin info from Bloch (a spin history) or Spyn module
 
     OUTPUTS:
     Spin Objects - graphical objects showing spins (send to GLViewer)
@@ -124,14 +124,16 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget('Slider', 'Waveform Stretch',min=1,max=100,val=20)
 
         # IO Ports
-        self.addInPort('M_in', 'NPYarray')
+        self.addInPort('M_in', 'PASS')
         self.addOutPort('Spin Objects', 'GLOList')
         self.addOutPort('PS Waveform Objects', 'GLOList')
 
         return 0
 
     def validate(self):
-        m_in = self.getData('M_in')
+        import gpi_core.spinSim.spinhist as sh
+
+        m_in = sh.as_history(self.getData('M_in'))
         mdim = list(m_in.shape)
         options = ['Off','T1','T2','FQ','X','Y','Z','Vx','Vy','Vz']
         tipOptions = ['Off']
@@ -238,8 +240,10 @@ class ExternalNode(gpi.NodeAPI):
         # (note we will talk about A, B, C axes in the geometry viewer so we don't
         #  get confused with the X, Y, Z dimensions specified in the Spyn module)
 
+        import gpi_core.spinSim.spinhist as sh
+
         timeIndex = self.getVal('Time index')
-        m_in = self.getData('M_in')
+        m_in = sh.as_history(self.getData('M_in'))
         mdim = list(m_in.shape)
         totalOptions = ['T1','T2','FQ','X','Y','Z','Vx','Vy','Vz']
         viableOptions = list(totalOptions)
@@ -268,11 +272,17 @@ class ExternalNode(gpi.NodeAPI):
         yref  = m_in[4,1,0,0,0,0,:,0,0,0,0]-vely*Tstart # Y position array at T=0
         zref  = m_in[5,1,0,0,0,0,0,:,0,0,0]-velz*Tstart # Z position array at T=0
 
+        # Only the time points for tracer and vector history are read
+        tHist = self.getVal('Tracer History')
+        vHist = self.getVal('Vector History')
+        dim1wid = min(timeIndex,max(tHist, vHist))
+        m_in = m_in[:,1+timeIndex-dim1wid:2+timeIndex]
+
         # Remove all indices of length 1
         for i in reversed(list(range(9))):
           if mdim[i+2] == 1:
             viableOptions.pop(i)
-        m_in = np.squeeze(m_in)
+        m_in = np.squeeze(m_in, axis=tuple(i+2 for i in range(9) if mdim[i+2] == 1))
 
         # Identify axes
         aAxis = self.getVal('A Axis')
@@ -305,13 +315,10 @@ class ExternalNode(gpi.NodeAPI):
         # Now run through axes yet to slice
         # remaining options lists what is yet to be accounted for
         # sliceOptions gives the order of what's left in m_in, other than the 1st 2 dimensions (13,Time)
-        tHist = self.getVal('Tracer History')
-        vHist = self.getVal('Vector History')
-        dim1wid = min(timeIndex,max(tHist, vHist))
         xi = []
         Ax = []
         xi.append(slice(None)) # Mx My Mz
-        xi.append(slice(1+timeIndex-dim1wid,2+timeIndex)) # Time
+        xi.append(slice(None)) # Time, already cut to the history
         for i in range(len(viableOptions)):
           if viableOptions[i] in remainingOptions:
             sl = self.getVal(viableOptions[i]+' index')
@@ -319,7 +326,7 @@ class ExternalNode(gpi.NodeAPI):
           else:
             xi.append(slice(None))
             Ax.append(axesChosen.index(viableOptions[i]))
-        m_in = m_in[xi]
+        m_in = m_in[tuple(xi)]
 
         # OK, now m_in has between 2 and 5 dimensions
         # The first dimension has 13 indices, which includes Mx, My, and Mz
@@ -648,7 +655,7 @@ class ExternalNode(gpi.NodeAPI):
           showRfp = (np.array(gwaveList) == 6).any()
           numwaves = int(showGx) + int(showGy) + int(showGz) + int(showRfr) + int(showRfi) + int(showRfm) + int(showRfp)
 
-          g_in = self.getData('M_in')[7:,1:,0,0,0,0,0,0,0,0,0]
+          g_in = sh.as_history(self.getData('M_in'))[7:,1:,0,0,0,0,0,0,0,0,0]
           maxvals = np.amax(np.absolute(g_in), axis=1)
           gmax = np.amax(maxvals[0:3])
           rfmax = math.sqrt(maxvals[3]*maxvals[3] + maxvals[4]*maxvals[4])
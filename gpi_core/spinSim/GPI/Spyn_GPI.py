@@ -172,6 +172,8 @@ class ExternalNode(gpi.NodeAPI):
 
     OUTPUT - spin state, typically fed to Bloch module.  No data present until "Starting Spins"
              widget is set to something other than "OFF"
+             This is a compact spin ensemble (gpi_core.spinSim.spinhist.SpinEnsemble) that keeps each
+             parameter only along the dimensions it varies in; np.asarray() of it gives the full array
 
     WIDGETS:
     Starting Spins - starting state of all spins.  When set to "OFF", no data are generated
@@ -207,7 +209,7 @@ class ExternalNode(gpi.NodeAPI):
         self.addWidget('SpynAxys', 'Vz (cm/s)')
 
         # IO Ports
-        self.addOutPort('out', 'NPYarray')
+        self.addOutPort('out', 'PASS')
 
     def validate(self):
         '''This function runs before compute() as a GPI_APPLOOP exec-type.
@@ -324,78 +326,35 @@ class ExternalNode(gpi.NodeAPI):
          vzstart=0.00001*val['start']
          vzstep= 0.00001*(val['end']-val['start'])/max(1.,float(dim11-1))
 
-         # Create the data
-         out=np.zeros([dim1,dim2,dim3,dim4,dim5,dim6,dim7,dim8,dim9,dim10,dim11])
-
-         # Assign the 1st element of data in dim2, M0 T1 T2 Vx Vy Vz Fq Dx Dy Dz dt GM __
-         # These values don't change
-         # M0
-         out[0,0,:,:,:,:,:,:,:,:,:] = 1.
-
-         # T1
-         for i in range(0,dim3):
-           out[1,0,i,:,:,:,:,:,:,:,:] = r1start + r1step*float(i)
-
-         # T2
-         for i in range(0,dim4):
-           out[2,0,:,i,:,:,:,:,:,:,:] = r2start + r2step*float(i)
-
-         #Vx
-         for i in range(0,dim9):
-           out[3,0,:,:,:,:,:,:,i,:,:] = vxstart + vxstep*float(i)
-
-         #Vy
-         for i in range(0,dim10):
-           out[4,0,:,:,:,:,:,:,:,i,:] = vystart + vystep*float(i)
-
-         #Vz
-         for i in range(0,dim11):
-           out[5,0,:,:,:,:,:,:,:,:,i] = vzstart + vzstep*float(i)
-
-         #Fq
-         for i in range(0,dim5):
-           out[6,0,:,:,i,:,:,:,:,:,:] = fqstart + fqstep*float(i)
-
-         # Dx, Dy, Dz = 0, no action for now
-
-         # dt - convert from us to ms
-         out[10,0,:,:,:,:,:,:,:,:,:] = dtms
-
-         # Gamma - fixed for now, kHz/mT
-         out[11,0,:,:,:,:,:,:,:,:,:] = 42.577
-
-         # Assign 2nd element of data in dim2, Mx My Mz X  Y  Z  T  Gx Gy Gz Rx Ry Sp
-         # This is the first time point
-
-         #Mx My Mz
-         out[0,1,:,:,:,:,:,:,:,:,:] = mx
-         out[1,1,:,:,:,:,:,:,:,:,:] = my
-         out[2,1,:,:,:,:,:,:,:,:,:] = mz
-
-         #X0
-         for i in range(0,dim6):
-           out[3,1,:,:,:,i,:,:,:,:,:] = x0start + x0step*float(i)
-
-         #Y0
-         for i in range(0,dim7):
-           out[4,1,:,:,:,:,i,:,:,:,:] = y0start + y0step*float(i)
-
-         #Z0
-         for i in range(0,dim8):
-           out[5,1,:,:,:,:,:,i,:,:,:] = z0start + z0step*float(i)
-
-         #T0
-         out[6,1,:,:,:,:,:,:,:,:,:] = t0ms
-
-         # Reset positions to reflect time relative to zero
-         # X0 += Vx*T0
-         out[3,1,:,:,:,:,:,:,:,:,:] += out[3,0,:,:,:,:,:,:,:,:,:]*t0ms
-         # Y0 += Vy*T0
-         out[4,1,:,:,:,:,:,:,:,:,:] += out[4,0,:,:,:,:,:,:,:,:,:]*t0ms
-         # Z0 += Vz*T0
-         out[5,1,:,:,:,:,:,:,:,:,:] += out[5,0,:,:,:,:,:,:,:,:,:]*t0ms
-
-         #Gx Gy Gz Rx Ry Sp all 0, no action necessary
+         # Create the data, as one compact row per parameter
+         # spin axes: T1 T2 Fq X0 Y0 Z0 Vx Vy Vz
+         import gpi_core.spinSim.spinhist as sh
+         r1 = sh.along(r1start + r1step*np.arange(dim3), 0)
+         r2 = sh.along(r2start + r2step*np.arange(dim4), 1)
+         fq = sh.along(fqstart + fqstep*np.arange(dim5), 2)
+         x0 = sh.along(x0start + x0step*np.arange(dim6), 3)
+         y0 = sh.along(y0start + y0step*np.arange(dim7), 4)
+         z0 = sh.along(z0start + z0step*np.arange(dim8), 5)
+         vx = sh.along(vxstart + vxstep*np.arange(dim9), 6)
+         vy = sh.along(vystart + vystep*np.arange(dim10), 7)
+         vz = sh.along(vzstart + vzstep*np.arange(dim11), 8)
+
+         # 1st element of dim2 is the constants, M0 T1 T2 Vx Vy Vz Fq Dx Dy Dz dt GM __
+         # 2nd element is the first time point, Mx My Mz X  Y  Z  T  Gx Gy Gz Rx Ry Sp
+         # Positions are reset to reflect time relative to zero, X0 += Vx*T0
+         # Dx, Dy, Dz = 0, no action for now; Gamma fixed for now, kHz/mT
+         rows = [sh.over_time(1., mx),
+                 sh.over_time(r1, my),
+                 sh.over_time(r2, mz),
+                 sh.over_time(vx, x0 + vx*t0ms),
+                 sh.over_time(vy, y0 + vy*t0ms),
+                 sh.over_time(vz, z0 + vz*t0ms),
+                 sh.over_time(fq, t0ms),
+                 0., 0., 0.,
+                 sh.over_time(dtms, 0.),
+                 sh.over_time(42.577, 0.),
+                 0.]
+         out = sh.SpinEnsemble(rows, [dim1,dim2,dim3,dim4,dim5,dim6,dim7,dim8,dim9,dim10,dim11])
 
        else:
          out = None
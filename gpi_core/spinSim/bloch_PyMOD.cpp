@@ -0,0 +1,88 @@
+/*
+ * Copyright (c) 2014, Dignity Health
+ * 
+ *     The GPI core node library is licensed under
+ * either the BSD 3-clause or the LGPL v. 3.
+ * 
+ *     Under either license, the following additional term applies:
+ * 
+ *         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+ * PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+ * SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+ * PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+ * USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+ * TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+ * WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+ * HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+ * 
+ *     If you elect to license the GPI core node library under the LGPL the
+ * following applies:
+ * 
+ *         This file is part of the GPI core node library.
+ * 
+ *         The GPI core node library is free software: you can redistribute it
+ * and/or modify it under the terms of the GNU Lesser General Public License as
+ * published by the Free Software Foundation, either version 3 of the License,
+ * or (at your option) any later version. GPI core node library is distributed
+ * in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+ * the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+ * See the GNU Lesser General Public License for more details.
+ * 
+ *         You should have received a copy of the GNU Lesser General Public
+ * License along with the GPI core node library. If not, see
+ * <http://www.gnu.org/licenses/>.
+ */
+
+
+/***************
+Bloch simulator PyMOD for the Bloch node
+Date 2026 Oct
+***************/
+
+#include "PyFI/PyFI.h"
+#include "multiproc/threads.c"
+using namespace PyFI;
+
+#include <iostream>
+#include <vector>
+#include <cmath>
+using namespace std;
+#include "blochkern.cpp"
+
+
+/**************************/
+PYFI_FUNC(simulate)
+/**************************/
+{
+    PYFI_START(); /* This must be the first line */
+
+    /* input */
+    PYFI_POSARG(Array<double>, spins); // (13, nspins): mx,my,mz, x0,y0,z0, vx,vy,vz, m0,r1,r2,fq
+    PYFI_POSARG(Array<double>, waves); // (5, nsteps): gx,gy,gz (mT/m), rfx,rfy (mT)
+    PYFI_POSARG(int64_t, idim);        // steps per recorded point
+    PYFI_POSARG(double, gamma);        // kHz/mT
+
+    PYFI_KWARG(double, dt, 0.001); // "time step in ms (default:0.001)"
+    PYFI_KWARG(int64_t, nthreads, 1); // "number of threads (default:1)"
+
+    if (spins->ndim() != 2 || spins->size(1) != BLOCH_NPARS)
+        PYFI_ERROR("simulate() expects spins of shape (13, nspins)");
+    if (waves->ndim() != 2 || waves->size(1) != 5 || *idim < 1 || waves->size(0) % *idim)
+        PYFI_ERROR("simulate() expects waves of shape (5, n*idim)");
+
+    /* output is (6, odim, nspins) */
+    uint64_t dims[3] = {spins->size(0), waves->size(0) / *idim, BLOCH_NOUT};
+    PYFI_SETOUTPUT_ALLOC_DIMS(Array<double>, out, 3, dims);
+
+    if (blochsim(*spins, *waves, *out, *idim, *dt, *gamma, *nthreads))
+        PYFI_ERROR("blochsim() has failed");
+
+    PYFI_END(); /* This must be the last line */
+} /* simulate */
+
+
+/**************************/
+PYFI_LIST_START_
+    PYFI_DESC(simulate, "Bloch simulation of many isochromats through G and RF waveforms")
+PYFI_LIST_END_
+/**************************/
@@ -0,0 +1,148 @@
+/*
+ * Copyright (c) 2014, Dignity Health
+ * 
+ *     The GPI core node library is licensed under
+ * either the BSD 3-clause or the LGPL v. 3.
+ * 
+ *     Under either license, the following additional term applies:
+ * 
+ *         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+ * PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+ * SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+ * PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+ * USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+ * TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+ * WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+ * HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+ * 
+ *     If you elect to license the GPI core node library under the LGPL the
+ * following applies:
+ * 
+ *         This file is part of the GPI core node library.
+ * 
+ *         The GPI core node library is free software: you can redistribute it
+ * and/or modify it under the terms of the GNU Lesser General Public License as
+ * published by the Free Software Foundation, either version 3 of the License,
+ * or (at your option) any later version. GPI core node library is distributed
+ * in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+ * the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+ * See the GNU Lesser General Public License for more details.
+ * 
+ *         You should have received a copy of the GNU Lesser General Public
+ * License along with the GPI core node library. If not, see
+ * <http://www.gnu.org/licenses/>.
+ */
+
+
+/***************
+Bloch integration of many isochromats at once, for the Bloch node
+***************/
+
+#define BLOCH_NPARS 13  // mx,my,mz, x0,y0,z0, vx,vy,vz, m0,r1,r2,fq
+#define BLOCH_NOUT  6   // mx,my,mz, x,y,z
+
+struct blochjob {
+  int64_t nspins, odim, idim;
+  double dt, gamma;
+  vector<double> xph, yph;   // rf rotation per step, in radians
+  vector<double> gx, gy, gz; // gradients per step, in radians per unit position
+};
+
+/* Rotate (mx,my,mz) about (px,py,pz) by |P| radians, in place:
+ * R' = P (P.R)/|P|^2 (1-cos|P|) + R cos|P| + (P x R) sin|P|/|P|
+ */
+inline void blochrotate(double &mx, double &my, double &mz, double px, double py, double pz)
+{
+  double psqu, pmag, cp, spn, r1norm, rx, ry, rz;
+
+  psqu = px*px + py*py + pz*pz;
+  if (psqu <= 0.)
+    return;
+  pmag = sqrt(psqu);
+  cp = cos(pmag);
+  spn = sin(pmag)/pmag;
+  r1norm = (px*mx + py*my + pz*mz)/psqu*(1.-cp);
+
+  rx = px*r1norm + mx*cp + (py*mz - pz*my)*spn;
+  ry = py*r1norm + my*cp + (pz*mx - px*mz)*spn;
+  rz = pz*r1norm + mz*cp + (px*my - py*mx)*spn;
+  mx = rx;
+  my = ry;
+  mz = rz;
+}
+
+// each thread takes a contiguous block of spins through the whole waveform
+void blochsim_thread(int *num_threads, int *cur_thread, Array<double> &spins, Array<double> &out,
+                     blochjob *job)
+{
+  int64_t s, start, stop, o, n, i;
+  double mx, my, mz, x0, y0, z0, vx, vy, vz, x, y, z, t;
+  double expt1, expt2, mz0, db0;
+
+  start = (job->nspins * *cur_thread) / *num_threads;
+  stop = (job->nspins * (*cur_thread+1)) / *num_threads;
+
+  for (s = start; s < stop; s++) {
+    mx = spins(s,0); my = spins(s,1); mz = spins(s,2);
+    x0 = spins(s,3); y0 = spins(s,4); z0 = spins(s,5);
+    vx = spins(s,6); vy = spins(s,7); vz = spins(s,8);
+    expt1 = exp(-spins(s,10)*job->dt);
+    expt2 = exp(-spins(s,11)*job->dt);
+    mz0 = spins(s,9)*(1.-expt1);
+    db0 = 2.*M_PI*job->dt*spins(s,12); // off-resonance rotation per step
+    x = x0; y = y0; z = z0;
+
+    for (o = 0, i = 0; o < job->odim; o++) {
+      for (n = 0; n < job->idim; n++, i++) {
+        t = (double)(i+1)*job->dt;
+        x = x0 + t*vx;
+        y = y0 + t*vy;
+        z = z0 + t*vz;
+        blochrotate(mx, my, mz, job->xph[i], job->yph[i],
+                    x*job->gx[i] + y*job->gy[i] + z*job->gz[i] + db0);
+        mx *= expt2;
+        my *= expt2;
+        mz = mz0 + expt1*mz;
+        }
+      out(s,o,0) = mx; out(s,o,1) = my; out(s,o,2) = mz;
+      out(s,o,3) = x;  out(s,o,4) = y;  out(s,o,5) = z;
+      }
+    }
+}
+
+/* spins(nspins, BLOCH_NPARS), waves(odim*idim, 5): gx,gy,gz (mT/m), rfx,rfy (mT)
+ * -> out(nspins, odim, BLOCH_NOUT), recorded after every idim steps of dt (ms)
+ */
+int blochsim(Array<double> &spins, Array<double> &waves, Array<double> &out,
+             int64_t idim, double dt, double gamma, int64_t nthreads)
+{
+  int64_t i, nsteps, threads;
+  double radspermT;
+  blochjob job;
+
+  if (spins.size(1) != BLOCH_NPARS || waves.size(1) != 5 || idim < 1)
+    return (1);
+
+  job.nspins = spins.size(0);
+  job.idim = idim;
+  job.odim = waves.size(0)/idim;
+  job.dt = dt;
+  job.gamma = gamma;
+  nsteps = job.odim*idim;
+
+  radspermT = 2.*M_PI*gamma*dt;
+  job.gx.resize(nsteps); job.gy.resize(nsteps); job.gz.resize(nsteps);
+  job.xph.resize(nsteps); job.yph.resize(nsteps);
+  for (i = 0; i < nsteps; i++) {
+    job.gx[i] = radspermT*waves(i,0);
+    job.gy[i] = radspermT*waves(i,1);
+    job.gz[i] = radspermT*waves(i,2);
+    job.xph[i] = radspermT*waves(i,3);
+    job.yph[i] = radspermT*waves(i,4);
+    }
+
+  threads = max((int64_t)1, min(nthreads, job.nspins));
+  create_threads3 (threads, blochsim_thread, &spins, &out, &job);
+
+  return (0);
+}
@@ -0,0 +1,315 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+''' Bloch simulation of many isochromats through G and RF waveforms.
+
+    simulate() advances every spin through all time steps in one call to
+    bloch.simulate() (bloch_PyMOD.cpp), threaded over spins, when it is
+    built, or through the same steps in numpy otherwise.
+
+    The spin parameters are packed as rows of one (13, nspins) array:
+      mx,my,mz - starting magnetization
+      x0,y0,z0 - starting position
+      vx,vy,vz - velocity
+      m0,r1,r2 - equilibrium magnetization and relaxation rates (1/ms)
+      fq       - off-resonance (kHz)
+    and the waveforms as rows of one (5, nsteps) array: gx,gy,gz (mT/m) and
+    rfx,rfy (mT), one value per time step.
+
+    When the waveforms are constant (free precession, crushers, constant
+    gradients, hard pulses), every time step of a spin that does not move
+    along the gradient is the same affine map M -> A M + b (a rotation, then
+    relaxation).  simulate_constant() raises it to the idim'th power by
+    repeated squaring and applies that once per output point, so these
+    segments cost O(log idim + odim) per spin instead of O(odim*idim), with
+    the same result as stepping to rounding.
+
+    simulate_sweep() shards the spins along one of their axes (e.g. T1 or
+    X0) over a pool of processes, which read the spins from and write their
+    results to shared memory, for sweeps too large for one process.
+'''
+
+import os
+import numpy as np
+
+NPARS = 13
+SPIN_ROWS = ['mx', 'my', 'mz', 'x0', 'y0', 'z0', 'vx', 'vy', 'vz', 'm0', 'r1', 'r2', 'fq']
+
+
+def rotate(rx, ry, rz, px, py, pz):
+    '''Rotate R = (rx, ry, rz) about P = (px, py, pz) by |P| radians.
+
+       R1 is the projection of R on P, which does not rotate
+       R2 is the residue of R which is perpendicular to P
+       R3 and R4 are the vectors of the rotated R2 which are
+                 parallel and perpendicular to R2, respectively
+
+       R1 = P (P dot R)/(|P|**2)
+       R2 = R - R1
+       R3 = R2 Cos(|P|)
+       R4 = (P x R2) Sin(|P|) / |P|
+
+       R' = R1+R3+R4
+    '''
+    psqu = px*px + py*py + pz*pz
+    if (psqu > 0).any():
+        pmag = np.sqrt(psqu)
+
+        # Need to mask, to avoid div_by_0
+        pzero = np.zeros(psqu.shape)
+
+        pdotr = px*rx + py*ry + pz*rz
+        r1norm = np.where(psqu, pdotr/np.where(psqu, psqu, 1.), pzero)
+        cp = np.cos(pmag)
+        spn = np.where(pmag, np.sin(pmag)/np.where(pmag, pmag, 1.), pzero)
+
+        r1x = px*r1norm
+        r1y = py*r1norm
+        r1z = pz*r1norm
+
+        r2x = rx-r1x
+        r2y = ry-r1y
+        r2z = rz-r1z
+
+        rx = r1x + r2x*cp + (py*r2z - pz*r2y)*spn
+        ry = r1y + r2y*cp + (pz*r2x - px*r2z)*spn
+        rz = r1z + r2z*cp + (px*r2y - py*r2x)*spn
+
+    return rx, ry, rz
+
+
+def simulate_numpy(spins, waves, idim, gamma, dt=0.001):
+    '''The reference time loop, vectorized over spins only.
+    '''
+    mx, my, mz, x0, y0, z0, vx, vy, vz, m0, r1, r2, fq = spins
+    gx, gy, gz, rfx, rfy = waves
+    odim = waves.shape[1]//idim
+    out = np.zeros((6, odim, spins.shape[1]))
+
+    radspermT = 2.*np.pi*gamma*dt
+    expt1 = np.exp(-r1*dt)
+    expt2 = np.exp(-r2*dt)
+    mz0 = m0*(1.-expt1)
+    db0 = fq/gamma
+    x, y, z = x0, y0, z0
+
+    for outer in range(odim):
+        for inner in range(idim):
+            i = outer*idim + inner
+            time = float(i+1)*dt
+            x = x0 + time*vx
+            y = y0 + time*vy
+            z = z0 + time*vz
+
+            xph = radspermT*rfx[i]*np.ones(mx.shape)
+            yph = radspermT*rfy[i]*np.ones(mx.shape)
+            zph = radspermT*(x*gx[i] + y*gy[i] + z*gz[i] + db0)
+
+            mx, my, mz = rotate(mx, my, mz, xph, yph, zph)
+            mx = mx*expt2
+            my = my*expt2
+            mz = mz0 + expt1*mz
+
+        out[:, outer] = mx, my, mz, x, y, z
+
+    return out
+
+
+def step_matrices(spins, wave, gamma, dt=0.001):
+    '''The (nspins, 4, 4) homogeneous matrices of one time step of each spin
+       under the constant wave (5,): rotation, then relaxation.  Position is
+       taken at x0,y0,z0, so this is only exact for spins that do not move
+       along the gradient.
+    '''
+    mx, my, mz, x0, y0, z0, vx, vy, vz, m0, r1, r2, fq = spins
+    gx, gy, gz, rfx, rfy = wave
+    nspins = spins.shape[1]
+
+    radspermT = 2.*np.pi*gamma*dt
+    p = np.empty((nspins, 3))
+    p[:, 0] = radspermT*rfx
+    p[:, 1] = radspermT*rfy
+    p[:, 2] = radspermT*(x0*gx + y0*gy + z0*gz + fq/gamma)
+
+    # Rodrigues: R = cos I + sin [n]x + (1-cos) n n^T, n = P/|P|
+    pmag = np.sqrt((p*p).sum(axis=1))
+    n = p/np.where(pmag, pmag, 1.)[:, np.newaxis]
+    cp = np.cos(pmag)[:, np.newaxis, np.newaxis]
+    sp = np.sin(pmag)[:, np.newaxis, np.newaxis]
+    cross = np.zeros((nspins, 3, 3))
+    cross[:, 0, 1], cross[:, 0, 2] = -n[:, 2], n[:, 1]
+    cross[:, 1, 0], cross[:, 1, 2] = n[:, 2], -n[:, 0]
+    cross[:, 2, 0], cross[:, 2, 1] = -n[:, 1], n[:, 0]
+    rot = cp*np.eye(3) + sp*cross + (1.-cp)*n[:, :, np.newaxis]*n[:, np.newaxis, :]
+
+    expt1 = np.exp(-r1*dt)
+    expt2 = np.exp(-r2*dt)
+    step = np.zeros((nspins, 4, 4))
+    step[:, :3, :3] = np.stack([expt2, expt2, expt1], axis=1)[:, :, np.newaxis]*rot
+    step[:, 2, 3] = m0*(1.-expt1)
+    step[:, 3, 3] = 1.
+    return step
+
+
+def matrix_power(a, n):
+    '''a (..., k, k) to the n'th power, by repeated squaring.
+    '''
+    out = np.broadcast_to(np.eye(a.shape[-1]), a.shape).copy()
+    while n > 0:
+        if n & 1:
+            out = np.matmul(a, out)
+        n >>= 1
+        if n:
+            a = np.matmul(a, a)
+    return out
+
+
+def simulate_constant(spins, wave, odim, idim, gamma, dt=0.001):
+    '''simulate() for a constant wave (5,) and spins that do not move along
+       the gradient, in closed form.
+    '''
+    mx, my, mz, x0, y0, z0, vx, vy, vz = spins[:9]
+    out = np.empty((6, odim, spins.shape[1]))
+
+    block = matrix_power(step_matrices(spins, wave, gamma, dt), idim)
+    m = np.stack([mx, my, mz, np.ones(mx.shape)], axis=1)[:, :, np.newaxis]
+    for outer in range(odim):
+        m = np.matmul(block, m)
+        time = float((outer+1)*idim)*dt
+        out[:3, outer] = m[:, :3, 0].T
+        out[3:, outer] = x0 + time*vx, y0 + time*vy, z0 + time*vz
+
+    return out
+
+
+def simulate_steps(spins, waves, idim, gamma, dt=0.001, nthreads=1):
+    '''simulate() one time step at a time, compiled if bloch_PyMOD is built.
+    '''
+    try:
+        import gpi_core.spinSim.bloch as bl
+    except ImportError:
+        return simulate_numpy(spins, waves, idim, gamma, dt)
+    return bl.simulate(spins, waves, int(idim), float(gamma), dt=float(dt), nthreads=int(nthreads))
+
+
+def simulate(spins, waves, idim, gamma, dt=0.001, nthreads=1):
+    '''Advance the spins (13, nspins) through the waveforms (5, nsteps), in
+       steps of dt (ms).  Returns (6, nsteps//idim, nspins): mx,my,mz,x,y,z
+       after every idim steps.
+    '''
+    spins = np.require(spins, dtype=np.float64, requirements='C')
+    waves = np.require(waves, dtype=np.float64, requirements='C')
+    if spins.ndim != 2 or spins.shape[0] != NPARS:
+        raise ValueError("spins must be of shape (%d, nspins)" % NPARS)
+    if waves.ndim != 2 or waves.shape[0] != 5 or waves.shape[1] % idim:
+        raise ValueError("waves must be of shape (5, n*idim)")
+
+    # constant waveforms: closed form for spins that see the same field every step
+    if spins.shape[1] and (waves == waves[:, :1]).all():
+        wave = waves[:, 0]
+        static = spins[6]*wave[0] + spins[7]*wave[1] + spins[8]*wave[2] == 0.
+        odim = waves.shape[1]//idim
+        if static.all():
+            return simulate_constant(spins, wave, odim, idim, gamma, dt)
+        out = np.empty((6, odim, spins.shape[1]))
+        out[:, :, static] = simulate_constant(spins[:, static], wave, odim, idim, gamma, dt)
+        out[:, :, ~static] = simulate_steps(np.ascontiguousarray(spins[:, ~static]), waves,
+                                            idim, gamma, dt, nthreads)
+        return out
+
+    return simulate_steps(spins, waves, idim, gamma, dt, nthreads)
+
+
+def _sweep_shard(spins_name, out_name, sshape, axis, lo, hi, waves, idim, gamma, dt):
+    '''Simulate spins [lo, hi) along axis, in a pool process.
+    '''
+    from multiprocessing import shared_memory
+    spins_shm = shared_memory.SharedMemory(name=spins_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    try:
+        odim = waves.shape[1]//idim
+        spins = np.ndarray((NPARS,)+sshape, dtype=np.float64, buffer=spins_shm.buf)
+        out = np.ndarray((6, odim)+sshape, dtype=np.float64, buffer=out_shm.buf)
+        sel = (slice(None),)*axis + (slice(lo, hi),)
+        shard = spins[(slice(None),)+sel]
+        res = simulate(np.reshape(shard, (NPARS, -1)), waves, idim, gamma, dt)
+        out[(slice(None), slice(None))+sel] = np.reshape(res, (6, odim)+shard.shape[1:])
+        del spins, out, shard
+    finally:
+        spins_shm.close()
+        out_shm.close()
+
+
+def simulate_sweep(spins, waves, idim, gamma, dt=0.001, axis=0, nprocs=None):
+    '''simulate() of spins (13, T1, ..., Vz), split along spin axis (0 for T1,
+       ..., 5 for Z0) over nprocs processes (default: all cores).  Returns
+       (6, nsteps//idim, T1, ..., Vz).  Each process is started fresh
+       (spawned), so this pays off for large numbers of spins.  A daemonic
+       process cannot start the pool, so there the spins are shared between
+       nprocs threads instead.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import current_process, get_context, shared_memory
+
+    spins = np.asarray(spins, dtype=np.float64)
+    waves = np.require(waves, dtype=np.float64, requirements='C')
+    sshape = spins.shape[1:]
+    odim = waves.shape[1]//idim
+    nshards = min(nprocs or os.cpu_count() or 1, sshape[axis])
+    if nshards <= 1 or current_process().daemon:
+        out = simulate(np.reshape(spins, (NPARS, -1)), waves, idim, gamma, dt,
+                       nthreads=nprocs or os.cpu_count() or 1)
+        return np.reshape(out, (6, odim)+sshape)
+
+    spins_shm = shared_memory.SharedMemory(create=True, size=max(1, spins.nbytes))
+    out_shm = shared_memory.SharedMemory(create=True, size=max(1, 6*odim*spins[0].nbytes))
+    try:
+        shared = np.ndarray(spins.shape, dtype=np.float64, buffer=spins_shm.buf)
+        shared[...] = spins
+        del shared
+
+        bounds = np.linspace(0, sshape[axis], nshards+1).astype(int)
+        with ProcessPoolExecutor(nshards, mp_context=get_context('spawn')) as pool:
+            jobs = [pool.submit(_sweep_shard, spins_shm.name, out_shm.name, sshape, axis,
+                                int(bounds[i]), int(bounds[i+1]), waves, idim, gamma, dt)
+                    for i in range(nshards)]
+            for job in jobs:
+                job.result()
+
+        out = np.ndarray((6, odim)+sshape, dtype=np.float64, buffer=out_shm.buf).copy()
+    finally:
+        spins_shm.close()
+        spins_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
+    return out
@@ -0,0 +1,245 @@
+# Copyright (c) 2014, Dignity Health
+# 
+#     The GPI core node library is licensed under
+# either the BSD 3-clause or the LGPL v. 3.
+# 
+#     Under either license, the following additional term applies:
+# 
+#         NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL
+# PURPOSES AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+# SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+# PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+# USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT LIMITED
+# TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR MAKES NO
+# WARRANTY AND HAS NOR LIABILITY ARISING FROM ANY USE OF THE SOFTWARE IN ANY
+# HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+# 
+#     If you elect to license the GPI core node library under the LGPL the
+# following applies:
+# 
+#         This file is part of the GPI core node library.
+# 
+#         The GPI core node library is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version. GPI core node library is distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Lesser General Public License for more details.
+# 
+#         You should have received a copy of the GNU Lesser General Public
+# License along with the GPI core node library. If not, see
+# <http://www.gnu.org/licenses/>.
+
+''' Spin history as a list of time segments.
+
+    The spin data passed between Spyn, Bloch and the display nodes is a
+    (13, T, T1, T2, FQ, X0, Y0, Z0, Vx, Vy, Vz) array, with the constants of
+    each spin at time index 0 and the state at every following time point.
+    Cascaded Bloch nodes used to concatenate their segment onto a copy of the
+    whole history; a SpinHistory instead keeps the segments as separate
+    blocks along the time axis, and append() shares the existing blocks with
+    the new history, so a chain of N segments copies each segment once.
+
+    A SpinHistory indexes like the full array for the patterns used by the
+    spin nodes (integers and slices, with the time axis second), only
+    touching the blocks that are selected, and np.asarray() gives the full
+    array for anything else.
+
+    The blocks themselves may be SpinEnsembles: each of the 13 parameter
+    rows is kept as the smallest array that broadcasts to (T, T1, ..., Vz),
+    e.g. T1 only varies along the T1 axis and the gradients only along time.
+    Spyn makes its spins this way, and Bloch stores its segments this way
+    (only the magnetization and position vary per spin), so large sweeps
+    cost memory in proportion to the number of spins only where they must.
+    Indexing broadcasts lazily and densify() (or np.asarray()) gives the
+    dense block.
+'''
+
+import operator
+import numpy as np
+
+# what a Bloch segment keeps of its own time points
+HISTORY_OPTIONS = ['Full', 'Decimated', 'Final']
+
+
+def along(vec, axis, ndim=9):
+    '''vec shaped to lie along axis of an ndim-dimensional spin array.
+    '''
+    shape = [1]*ndim
+    shape[axis] = -1
+    return np.reshape(np.asarray(vec, dtype=np.float64), shape)
+
+
+def over_time(*vals):
+    '''A compact row from its value at each time point, where each value is a
+       scalar or an array broadcastable to the 9 spin dimensions.
+    '''
+    vals = [np.reshape(np.asarray(v, dtype=np.float64), np.shape(v) or (1,)*9) for v in vals]
+    shape = np.broadcast_shapes(*[v.shape for v in vals])
+    return np.stack([np.broadcast_to(v, shape) for v in vals])
+
+
+class SpinEnsemble(object):
+    '''A (13, T, T1, ..., Vz) spin block stored as one compact row per
+       parameter: an array of the full number of dimensions (or a scalar)
+       that broadcasts to (T, T1, ..., Vz).
+    '''
+
+    def __init__(self, rows, shape):
+        self.shape = tuple(int(n) for n in shape)
+        self.rows = [np.asarray(r, dtype=np.float64) for r in rows]
+        if len(self.rows) != self.shape[0]:
+            raise ValueError("need one row per parameter")
+        for r in self.rows:
+            if r.ndim not in (0, len(self.shape)-1):
+                raise ValueError("rows must be scalars or have %d dimensions" % (len(self.shape)-1))
+            np.broadcast_shapes(r.shape, self.shape[1:])
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    @property
+    def nbytes(self):
+        return sum(r.nbytes for r in self.rows)
+
+    def row(self, p):
+        '''Read only (T, T1, ..., Vz) view of parameter p, without copying.
+        '''
+        return np.broadcast_to(self.rows[p], self.shape[1:])
+
+    def densify(self):
+        return np.stack([self.row(p) for p in range(self.shape[0])])
+
+    def __array__(self, dtype=None, copy=None):
+        out = self.densify()
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if not key or \
+           not all(isinstance(k, (int, np.integer, slice)) for k in key):
+            return self.densify()[key]
+        p, rest = key[0], key[1:]
+        if not isinstance(p, slice):
+            return self.row(operator.index(p))[rest]
+        ps = range(self.shape[0])[p]
+        if len(ps) == 0:
+            return self.densify()[key]
+        return np.stack([self.row(i)[rest] for i in ps])
+
+    def take_times(self, keep):
+        '''A new ensemble with only the time points keep.
+        '''
+        rows = [r if r.ndim == 0 or r.shape[0] == 1 else r[keep] for r in self.rows]
+        shape = (self.shape[0], len(keep)) + self.shape[2:]
+        return SpinEnsemble(rows, shape)
+
+
+class SpinHistory(object):
+    '''Spin data in blocks along the time axis (axis 1).
+    '''
+
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+
+    @property
+    def shape(self):
+        shape = list(self.blocks[0].shape)
+        shape[1] = sum(b.shape[1] for b in self.blocks)
+        return tuple(shape)
+
+    @property
+    def ndim(self):
+        return self.blocks[0].ndim
+
+    @property
+    def dtype(self):
+        return self.blocks[0].dtype
+
+    @property
+    def last(self):
+        '''The state at the last time point, (13, T1, ..., Vz).
+        '''
+        return self.blocks[-1][:, -1]
+
+    def append(self, block):
+        '''A new history with block added to the end of this one (which is
+           left as it is, since it may feed other nodes too).
+        '''
+        return SpinHistory(self.blocks + [block])
+
+    def densify(self):
+        return np.concatenate([np.asarray(b) for b in self.blocks], axis=1)
+
+    def __array__(self, dtype=None, copy=None):
+        out = self.densify()
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(self.blocks) == 1:
+            return self.blocks[0][key]
+        if len(key) < 2 or \
+           not all(isinstance(k, (int, np.integer, slice)) for k in key):
+            return np.asarray(self)[key]
+
+        t = key[1]
+        ntime = self.shape[1]
+        starts = np.cumsum([0] + [b.shape[1] for b in self.blocks])
+
+        # a single time point comes from one block
+        if not isinstance(t, slice):
+            t = operator.index(t)
+            if t < 0:
+                t += ntime
+            if not 0 <= t < ntime:
+                raise IndexError("time index out of range")
+            b = int(np.searchsorted(starts, t, side='right')) - 1
+            return self.blocks[b][(key[0], t-starts[b]) + key[2:]]
+
+        # a time slice is the same slice of each block it covers
+        start, stop, step = t.indices(ntime)
+        if step < 0:
+            return np.asarray(self)[key]
+        parts = []
+        for b, block in enumerate(self.blocks):
+            lo, hi = starts[b], min(starts[b+1], stop)
+            first = start if start >= lo else start + -((start-lo)//step)*step
+            if first < hi:
+                parts.append(block[(key[0], slice(first-lo, hi-lo, step)) + key[2:]])
+        if not parts:
+            return np.asarray(self)[key]
+        return np.concatenate(parts, axis=0 if isinstance(key[0], (int, np.integer)) else 1)
+
+
+def as_history(m):
+    '''A SpinHistory of m, which may already be one (e.g. from Bloch), a
+       SpinEnsemble (e.g. from Spyn) or a spin array.
+    '''
+    if isinstance(m, SpinHistory):
+        return m
+    if isinstance(m, SpinEnsemble):
+        return SpinHistory([m])
+    return SpinHistory([np.asarray(m)])
+
+
+def keep_points(nout, history=0, decimation=1):
+    '''Indices of the nout new time points of a segment to keep, for one of
+       HISTORY_OPTIONS.  The last point is always kept.
+    '''
+    if history == 2 or nout == 0:
+        return np.arange(nout)[-1:]
+    if history == 1 and decimation > 1:
+        keep = np.arange(decimation-1, nout, decimation)
+        if keep.size == 0 or keep[-1] != nout-1:
+            keep = np.append(keep, nout-1)
+        return keep
+    return np.arange(nout)